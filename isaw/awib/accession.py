@@ -0,0 +1,200 @@
+"""
+Accession an original image as an AWIB package in a single process
+"""
+
+from datetime import datetime, timezone
+import getpass
+from isaw.awib.checksums import ChecksumError, safecopy, write_sidecar
+from isaw.awib.conversions import MasterMaker
+from isaw.awib.exiftool import ExifTool
+from isaw.awib.guid import assign_guid
+from isaw.awib.metadata import make_metadata, write_metadata
+from isaw.awib.validate import EXPECTED_FILES
+import logging
+import os
+from os.path import abspath, basename, isfile, join, realpath, splitext
+import pwd
+import socket
+import subprocess
+
+DASHES = '-' * 77
+
+
+class AccessionError(Exception):
+    pass
+
+
+class Package():
+    """
+    an AWIB image package directory and its history log
+    """
+
+    def __init__(self, path):
+        self.path = abspath(path)
+
+    def join(self, fn):
+        return join(self.path, fn)
+
+    def log(self, msg):
+        stamp = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+        with open(self.join('history.log'), 'a', encoding='utf-8') as f:
+            f.write('{} {}\n'.format(stamp, msg))
+
+    def log_history(self, historian):
+        """
+        append the history of a Historian to the log as JSON lines
+        """
+        with open(self.join('history.log'), 'a', encoding='utf-8') as f:
+            historian.export_history(f)
+
+    def write_checksum(self, fn, sha512=None):
+        """
+        write the .sha512 file for fn, hashing it only if sha512 is not given
+        """
+        shapath = write_sidecar(self.join(fn), sha512)
+        self.log(
+            'generated checksum file {} for file {}'
+            ''.format(basename(shapath), fn))
+
+    def missing_files(self):
+        return [fn for fn in EXPECTED_FILES if not isfile(self.join(fn))]
+
+
+def get_agent():
+    try:
+        name = pwd.getpwuid(os.getuid())[4].split(',')[0]
+    except KeyError:
+        name = ''
+    return name or getpass.getuser()
+
+
+def extract_metadata(package, fn, exiftool):
+    name, extension = splitext(fn)
+    xml_fn = '{}_exiftool.xml'.format(name)
+    report = exiftool.report(package.join(fn))
+    with open(package.join(xml_fn), 'wb') as f:
+        f.write(report)
+    package.log(
+        'generated exiftool report file {} for file {}'.format(xml_fn, fn))
+    package.write_checksum(xml_fn)
+
+
+def identify_with_jhove(package, fn):
+    name, extension = splitext(fn)
+    xml_fn = '{}_jhove.xml'.format(name)
+    subprocess.run(
+        [join(os.environ['JHOVEHOME'], 'jhove'), '-h', 'xml', '-ks', '-o',
+            package.join(xml_fn), package.join(fn)],
+        check=True)
+    package.log(
+        'generated jhove report file {} for file {}'.format(xml_fn, fn))
+    package.write_checksum(xml_fn)
+
+
+def accession(
+        src, dest, img_name='', agent=None, external_tools=True, sync=None,
+        exiftool=None):
+    """
+    create an AWIB package for the original image src in directory dest and
+    return its Package
+
+    The original is read once to copy and hash it, once to verify the copy
+    and once to decode it; the master and metadata.xml are made in this
+    process. Exiftool and jhove are still run for metadata capture and GUID
+    assignment unless external_tools is False. sync is passed to
+    isaw.awib.checksums.safecopy.
+
+    The master carries the original's embedded EXIF, XMP and IPTC metadata,
+    written with it rather than copied by exiftool afterwards. exiftool is
+    an isaw.awib.exiftool ExifTool or ExifToolPool to run exiftool commands
+    with, so that one process can serve many packages; by default one is
+    started for this package and closed afterwards.
+    """
+    logger = logging.getLogger(__name__)
+    src = realpath(src)
+    if not isfile(src):
+        raise AccessionError('Original (input) file not found: "{}"'.format(
+            src))
+    if agent is None:
+        agent = get_agent()
+    img_name = ''.join(img_name.split())
+    fn = basename(src)
+    name, extension = splitext(fn)
+    extension = extension.lower()
+    imgid = img_name or name
+    package = Package(join(dest, imgid))
+    os.makedirs(package.path, exist_ok=True)
+    package.log(
+        "\nISAW AWIB package {} created by {} ({}@{}) using the "
+        "'accession' module from isaw.awib to create an AWIB-style package "
+        "from the unmanaged image {}."
+        "".format(
+            imgid, agent, getpass.getuser(),
+            socket.gethostname().split('.')[0], src))
+
+    # copy original to destination, verified with checksum
+    original_fn = 'original{}'.format(extension)
+    original = package.join(original_fn)
+    try:
+        digests = safecopy(src, original, sync=sync)
+    except ChecksumError as e:
+        raise AccessionError(str(e))
+    package.log('copied {} to {}'.format(src, original_fn))
+    package.write_checksum(original_fn, digests['sha512'])
+    logger.debug('sha512 of original: {}'.format(digests['sha512']))
+    if external_tools and exiftool is None:
+        with ExifTool() as exiftool:
+            return _package_original(
+                package, original_fn, img_name, agent, external_tools,
+                exiftool)
+    return _package_original(
+        package, original_fn, img_name, agent, external_tools, exiftool)
+
+
+def _package_original(
+        package, original_fn, img_name, agent, external_tools, exiftool):
+    # everything accession does after the original is copied
+    original = package.join(original_fn)
+    if external_tools:
+        identify_with_jhove(package, original_fn)
+        extract_metadata(package, original_fn, exiftool)
+
+    # make a master tiff file, copy embedded data, and capture information
+    # about it
+    maker = MasterMaker(original, discard_original=True)
+    maker.make()
+    maker.save(package.join('master.tif'), carry_metadata=True)
+    package.log_history(maker)
+    package.log(
+        'generated master.tif from {} using isaw.awib.conversions.MasterMaker'
+        ', carrying over its embedded EXIF, XMP and IPTC metadata'
+        ''.format(original_fn))
+    if external_tools:
+        identify_with_jhove(package, 'master.tif')
+        extract_metadata(package, 'master.tif', exiftool)
+
+        # instantiate metadata file and assign a GUID
+        meta = make_metadata(
+            package.join('original_exiftool.xml'),
+            package.join('original_jhove.xml'), agent, img_name,
+            original_fn=original_fn)
+        write_metadata(meta, package.join('metadata.xml'))
+        package.log(
+            'created metadata.xml file using isaw.awib.metadata to transform '
+            'metadata extracted with exiftool and with jhove.')
+        guid = assign_guid(
+            package.path, exiftool, basename(package.path).replace(' ', ''),
+            agent=agent)
+        package.log(
+            'generated and assigned a GUID ({}) to this image using '
+            'isaw.awib.guid'.format(guid.urn))
+        package.write_checksum('metadata.xml')
+    package.write_checksum('master.tif')
+    package.log('ACCESSION COMPLETE: IMAGE PACKAGING COMPLETE\n# ' + DASHES)
+    if external_tools:
+        missing = package.missing_files()
+        if len(missing) > 0:
+            raise AccessionError(
+                'INVALID: missing from package: {}'.format(', '.join(missing)))
+        package.log('Package successfully validated.')
+    return package
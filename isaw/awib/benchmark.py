@@ -0,0 +1,313 @@
+"""
+Measure the time and memory taken to make masters from synthetic originals
+in each format Pillow can write, at a range of sizes and bit depths
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from isaw.awib.conversions import MasterMaker
+from isaw.awib.image_types import IMAGETYPES
+from isaw.awib.streaming import compression_available
+import math
+import multiprocessing
+import os
+from os.path import dirname, getsize, join, realpath
+import platform
+import PIL
+from PIL import Image
+import resource
+import subprocess
+import tempfile
+import time
+
+SIZES = (1, 10, 50, 100, 200)  # megapixels
+MODES = ('8bit', '16bit', 'palette')
+# Pillow's names for IMAGETYPES keys that differ
+PILLOW_FORMATS = {
+    'J2K': 'JPEG2000',
+    'JP2': 'JPEG2000',
+    'PBM': 'PPM',
+    'PBMRAW': 'PPM',
+    'PGM': 'PPM',
+    'TARGA': 'TGA'}
+# icons are limited to 256 x 256 pixels, so cannot hold a 1 MP original
+SKIP_FORMATS = ('ICO',)
+# relative slowdown or growth reported as a regression by compare()
+THRESHOLD = 0.1
+# MasterMaker.save() options compared by run_save_options()
+SAVE_OPTIONS = [
+    {},
+    {'compression': 'lzw'},
+    {'compression': 'lzw', 'predictor': 1},
+    {'compression': 'adobe_deflate'},
+    {'compression': 'adobe_deflate', 'tile_size': 256},
+    {'compression': 'adobe_deflate', 'tile_size': 256, 'pyramid': True},
+    {'compression': 'zstd'},
+    {'compression': 'lzma'},
+    {'compression': 'packbits'},
+    {'tile_size': 512},
+    {'bigtiff': True}]
+
+
+def writable_formats():
+    """
+    return the IMAGETYPES keys of formats that Pillow can write
+    """
+    Image.init()
+    formats = []
+    for k, v in sorted(IMAGETYPES.items()):
+        if not v['write'] or k in SKIP_FORMATS:
+            continue
+        if PILLOW_FORMATS.get(k, k) in Image.SAVE:
+            formats.append(k)
+    return formats
+
+
+def dimensions(megapixels):
+    """
+    return the (width, height) of a 4:3 image of about megapixels MP
+    """
+    width = int(round(math.sqrt(megapixels * 1000000 * 4 / 3)))
+    return (width, max(1, int(round(megapixels * 1000000 / width))))
+
+
+def synthetic_image(megapixels, mode):
+    """
+    return an image of gradients and noise, which neither compresses away
+    nor costs much to make; mode is one of MODES
+    """
+    size = dimensions(megapixels)
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 64)
+    if mode == '8bit':
+        return Image.merge(
+            'RGB', (gradient, gradient.transpose(Image.ROTATE_180), noise))
+    if mode == '16bit':
+        return gradient.convert('I').point(lambda i: i * 257).convert('I;16')
+    if mode == 'palette':
+        im = Image.blend(gradient, noise, 0.25)
+        im = im.convert('P')
+        im.putpalette(
+            [c for i in range(256) for c in (i, 255 - i, (i * 4) % 256)])
+        return im
+    raise ValueError('unknown mode: {}'.format(mode))
+
+
+def write_original(im, fmt, directory):
+    """
+    save im in format fmt (an IMAGETYPES key) in directory and return its
+    path; raises OSError, ValueError or KeyError if Pillow cannot write im
+    in that format
+    """
+    extension = IMAGETYPES[fmt].get(
+        'write_extension', IMAGETYPES[fmt]['extensions'][0])
+    path = join(directory, 'original_{}.{}'.format(fmt, extension))
+    try:
+        im.save(path, PILLOW_FORMATS.get(fmt, fmt))
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return path
+
+
+def measure(original, master):
+    """
+    make and save a master for original and return a dictionary of seconds
+    taken, per-stage statistics and peak resident memory; called in a fresh
+    process so that the peak belongs to this master alone
+    """
+    baseline = _max_rss()
+    maker = MasterMaker(original, discard_original=True)
+    start = time.perf_counter()
+    maker.make()
+    made = time.perf_counter()
+    maker.save(master)
+    saved = time.perf_counter()
+    return {
+        'make_seconds': made - start,
+        'save_seconds': saved - made,
+        'baseline_rss': baseline,
+        'peak_rss': _max_rss(),
+        'master_bytes': getsize(master),
+        'stages': maker.stats.as_dict()}
+
+
+def run_case(fmt, mode, megapixels, directory, repeat=1):
+    """
+    benchmark one format, mode and size and return a result dictionary,
+    with an 'error' entry instead of timings if the original could not be
+    written or the master could not be made
+    """
+    width, height = dimensions(megapixels)
+    result = {
+        'format': fmt,
+        'mode': mode,
+        'megapixels': megapixels,
+        'width': width,
+        'height': height}
+    im = synthetic_image(megapixels, mode)
+    try:
+        original = write_original(im, fmt, directory)
+    except (KeyError, OSError, ValueError) as e:
+        result['error'] = 'cannot write: {}'.format(e)
+        return result
+    finally:
+        del im
+    master = join(directory, 'master.tif')
+    result['original_bytes'] = getsize(original)
+    runs = []
+    # spawned rather than forked, so peak memory does not include the pages
+    # of this process
+    context = multiprocessing.get_context('spawn')
+    try:
+        for i in range(repeat):
+            with ProcessPoolExecutor(
+                    max_workers=1, mp_context=context) as executor:
+                future = executor.submit(measure, original, master)
+                runs.append(future.result())
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        return result
+    finally:
+        for path in (original, master):
+            if os.path.exists(path):
+                os.remove(path)
+    # the fastest run is the least disturbed by the rest of the system
+    best = min(runs, key=lambda r: r['make_seconds'] + r['save_seconds'])
+    result.update(best)
+    result['runs'] = len(runs)
+    return result
+
+
+def run(formats=None, modes=MODES, sizes=SIZES, repeat=1, directory=None,
+        progress=None):
+    """
+    benchmark every combination of formats (default: all that Pillow can
+    write), modes and sizes (in megapixels) and return a report dictionary
+    suitable for json.dump; progress, if given, is called with each result
+    """
+    if formats is None:
+        formats = writable_formats()
+    report = environment()
+    report['results'] = []
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        for megapixels in sizes:
+            for mode in modes:
+                for fmt in formats:
+                    result = run_case(fmt, mode, megapixels, scratch, repeat)
+                    report['results'].append(result)
+                    if progress is not None:
+                        progress(result)
+    return report
+
+
+def measure_save_options(original, directory, save_options=SAVE_OPTIONS):
+    """
+    make a master for original once, save it with each of save_options in
+    turn, and return a list of result dictionaries giving the seconds taken
+    and the size of the file
+    """
+    maker = MasterMaker(original, discard_original=True)
+    maker.make()
+    master = join(directory, 'master.tif')
+    raw_bytes = maker.master.width * maker.master.height * 3
+    results = []
+    for options in save_options:
+        result = {'options': options}
+        results.append(result)
+        compression = options.get('compression')
+        if compression is not None and not compression_available(compression):
+            result['error'] = '{} compression is not available'.format(
+                compression)
+            continue
+        start = time.perf_counter()
+        maker.save(master, **options)
+        result['seconds'] = time.perf_counter() - start
+        result['bytes'] = getsize(master)
+        result['ratio'] = raw_bytes / result['bytes']
+        os.remove(master)
+    return results
+
+
+def run_save_options(
+        sizes=SIZES, save_options=SAVE_OPTIONS, originals=None,
+        directory=None, progress=None):
+    """
+    compare the size and encode time of masters saved with each of
+    save_options, for synthetic 8-bit originals of each of sizes (in
+    megapixels) or, if originals (a list of paths) is given, for those; the
+    noise in synthetic images makes them compress less than photographs
+    """
+    report = environment()
+    report['save_results'] = []
+    if originals is None:
+        cases = [{'megapixels': megapixels} for megapixels in sizes]
+    else:
+        cases = [{'original': path} for path in originals]
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        for case in cases:
+            if originals is None:
+                im = synthetic_image(case['megapixels'], '8bit')
+                path = write_original(im, 'TIFF', scratch)
+                del im
+            else:
+                path = case['original']
+            for result in measure_save_options(path, scratch, save_options):
+                result.update(case)
+                report['save_results'].append(result)
+                if progress is not None:
+                    progress(result)
+            if originals is None:
+                os.remove(path)
+    return report
+
+
+def environment():
+    """
+    describe the code and machine being measured
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=dirname(realpath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+            universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'machine': platform.platform(),
+        'cpus': os.cpu_count()}
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """
+    return a list of (format, mode, megapixels, measure, old, new) tuples
+    for every result in current that is more than threshold (relatively)
+    slower or larger than the same case in baseline; both are run() reports
+    """
+    def key(r):
+        return (r['format'], r['mode'], r['megapixels'])
+
+    old = {key(r): r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    for r in current['results']:
+        if 'error' in r or key(r) not in old:
+            continue
+        for measure in ('make_seconds', 'save_seconds', 'peak_rss'):
+            before, after = old[key(r)][measure], r[measure]
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append(key(r) + (measure, before, after))
+    return regressions
+
+
+def _max_rss():
+    # peak resident set size of this process in bytes (Linux reports KiB,
+    # macOS bytes)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        return rss
+    return rss * 1024
@@ -0,0 +1,137 @@
+"""
+Copy files and compute and record their checksums with as few reads as
+possible
+"""
+
+import hashlib
+import mmap
+import os
+from os.path import basename, dirname, join, splitext
+import shutil
+
+# large reads keep the number of system calls and hash updates per
+# multi-gigabyte original small; a multiple of any likely block size, as
+# O_DIRECT requires
+CHUNK_SIZE = 16 * 1024 * 1024
+ALGORITHMS = ('md5', 'sha512')
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def hash_file(path, algorithms=ALGORITHMS, chunk_size=CHUNK_SIZE,
+              direct=False):
+    """
+    return a dictionary of hex digests of the file at path, one for each
+    hashlib algorithm name in algorithms, computed in a single read
+
+    If direct is True the file is read with O_DIRECT where the platform and
+    filesystem allow it, so that the bytes on disk are hashed rather than a
+    copy in the page cache.
+    """
+    hashes = [hashlib.new(a) for a in algorithms]
+    for chunk in _read_chunks(path, chunk_size, direct):
+        for h in hashes:
+            h.update(chunk)
+    return {a: h.hexdigest() for a, h in zip(algorithms, hashes)}
+
+
+def sha512_file(path, chunk_size=CHUNK_SIZE):
+    return hash_file(path, ('sha512',), chunk_size)['sha512']
+
+
+def safecopy(src, dest, chunk_size=CHUNK_SIZE, sync=None):
+    """
+    copy src to dest (with its permissions and times, like cp -p) and return
+    a dictionary of the md5 and sha512 hex digests of the file
+
+    Both hashes are computed from the bytes as they are copied; the copy is
+    then verified by reading dest once and comparing md5 digests. sync may
+    be None, 'fsync' (flush dest to disk before verifying) or 'direct'
+    (flush it and then verify with O_DIRECT reads).
+    """
+    if sync not in (None, 'fsync', 'direct'):
+        raise ValueError('unknown sync mode: {}'.format(sync))
+    hashes = {a: hashlib.new(a) for a in ALGORITHMS}
+    with open(src, 'rb') as f_in, open(dest, 'wb') as f_out:
+        for chunk in _read_chunks(f_in, chunk_size):
+            for h in hashes.values():
+                h.update(chunk)
+            f_out.write(chunk)
+        if sync is not None:
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    shutil.copystat(src, dest)
+    digests = {a: h.hexdigest() for a, h in hashes.items()}
+    dest_md5 = hash_file(
+        dest, ('md5',), chunk_size, direct=(sync == 'direct'))['md5']
+    if dest_md5 != digests['md5']:
+        raise ChecksumError(
+            'copy from {} to {} failed on checksum verification'
+            ''.format(src, dest))
+    return digests
+
+
+def sidecar_path(path):
+    name, extension = splitext(basename(path))
+    return join(dirname(path), '{}.sha512'.format(name))
+
+
+def write_sidecar(path, sha512=None):
+    """
+    write the .sha512 file that sits beside path, in the format of GNU
+    sha512sum, hashing path only if sha512 is not given; returns the path
+    of the sidecar file
+    """
+    if sha512 is None:
+        sha512 = sha512_file(path)
+    shapath = sidecar_path(path)
+    with open(shapath, 'w', encoding='utf-8') as f:
+        f.write('{}  {}\n'.format(sha512, basename(path)))
+    return shapath
+
+
+def read_sidecar(shapath):
+    """
+    return the sha512 hex digest recorded in a .sha512 file
+    """
+    with open(shapath, 'r', encoding='utf-8') as f:
+        return f.read().split()[0]
+
+
+def _read_chunks(path_or_file, chunk_size, direct=False):
+    if direct and hasattr(os, 'O_DIRECT'):
+        try:
+            fd = os.open(path_or_file, os.O_RDONLY | os.O_DIRECT)
+        except OSError:
+            pass  # e.g., tmpfs does not support O_DIRECT
+        else:
+            try:
+                yield from _read_direct(fd, chunk_size)
+            finally:
+                os.close(fd)
+            return
+    if hasattr(path_or_file, 'read'):
+        f = path_or_file
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+    else:
+        with open(path_or_file, 'rb') as f:
+            yield from _read_chunks(f, chunk_size)
+
+
+def _read_direct(fd, chunk_size):
+    # O_DIRECT needs a page-aligned buffer, which an anonymous mmap provides
+    chunk_size = max(
+        mmap.PAGESIZE, chunk_size - (chunk_size % mmap.PAGESIZE))
+    buf = mmap.mmap(-1, chunk_size)
+    try:
+        with memoryview(buf) as view:
+            while True:
+                n = os.readv(fd, [buf])
+                if n == 0:
+                    break
+                yield bytes(view[:n])
+    finally:
+        buf.close()
@@ -1,136 +1,810 @@
-from datetime import datetime
+from collections import deque, OrderedDict
+from datetime import datetime, timezone
+from hashlib import sha1
 from io import BytesIO
+from isaw.awib.streaming import (band_height, DEFAULT_BAND_SIZE,
+                                 is_raw_tiff, iter_bands, needs_bigtiff,
+                                 TiffWriter)
+import json
 import logging
 from logging import DEBUG, INFO
+import os
 from os.path import abspath, dirname, join, realpath
 from PIL import Image
 from PIL.ImageCms import (applyTransform, buildTransform, getOpenProfile,
                           getProfileName, INTENT_PERCEPTUAL, PyCMSError)
+from PIL.TiffImagePlugin import ImageFileDirectory_v2
+import struct
+from threading import Lock
+import time
+
+DEFAULT_PROFILE = 'sRGB_IEC61966-2-1_black_scaled'
+TRANSFORM_CACHE_SIZE = 32
+# number of history records a Historian keeps; older records are dropped
+HISTORY_SIZE = 1000
+# descriptive tags of an original's first IFD that its master carries:
+# ImageDescription, Make, Model, Orientation, Software, DateTime, Artist and
+# Copyright
+CARRIED_TAGS = [270, 271, 272, 274, 305, 306, 315, 33432]
+EXIF_IFD = 34665
+GPS_IFD = 34853
+INTEROP_IFD = 40965
+MAKERNOTE = 37500
+XMP = 700
+IPTC = 33723
+XMP_MARKER = b'http://ns.adobe.com/xap/1.0/\0'
+# pixel limit for originals, which are trusted archive files and may be far
+# larger than Pillow's decompression bomb threshold; None for no limit
+ORIGINAL_MAX_PIXELS = None
+
+
+class LRUCache():
+    """
+    least-recently-used cache of objects that are expensive to make, with
+    hit and miss counters
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, factory):
+        """
+        return the cached value for key, calling factory() to make and store
+        it if it is not already cached
+        """
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return value
+        value = factory()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._items),
+            'maxsize': self.maxsize}
+
+
+# bundled profiles are keyed by name and embedded source profiles by the hash
+# of their bytes; transforms are keyed by that name or hash plus the image
+# mode and the name of the target profile
+PROFILE_CACHE = LRUCache(TRANSFORM_CACHE_SIZE)
+TRANSFORM_CACHE = LRUCache(TRANSFORM_CACHE_SIZE)
+
+
+class HistoryRecord():
+    """
+    one history entry; the message is only formatted (msg.format(*args))
+    when it is read
+    """
+    __slots__ = ('monotonic', 'level', 'msg', 'args', 'data')
+
+    def __init__(self, monotonic, level, msg, args, data):
+        self.monotonic = monotonic
+        self.level = level
+        self.msg = msg
+        self.args = args
+        self.data = data
+
+    def __str__(self):
+        return self.message
+
+    @property
+    def message(self):
+        if self.args:
+            return self.msg.format(*self.args)
+        return self.msg
 
 
 class Historian():
+    """
+    keeps the most recent history_size log records (all of them if
+    history_size is None) in a ring buffer, timestamped with the monotonic
+    clock; records are only formatted when they are logged, read or exported
+    """
 
-    def __init__(self, logging_threshold=INFO):
-        self.history = []
+    def __init__(self, logging_threshold=INFO, history_size=HISTORY_SIZE):
+        self.history = deque(maxlen=history_size)
         self.logger = logging.getLogger()
         self.logger.setLevel(logging_threshold)
+        # wall-clock time of monotonic time _monotonic_start
+        self._wall_start = time.time()
+        self._monotonic_start = time.monotonic()
 
     def get_history(self):
-        return self.history
+        """
+        return a list of (datetime, message, data) tuples
+        """
+        return [
+            (self._datetime(r), r.message, r.data) for r in self.history]
 
-    def log(self, msg, log_level=DEBUG, data=None):
-        self._append_history(msg, log_level, data)
+    def log(self, msg, log_level=DEBUG, *args, data=None):
+        """
+        record msg at log_level, formatted with args by str.format (only
+        when it is read) if any are given
+        """
+        self._append_history(msg, args, log_level, data)
 
-    def _append_history(self, msg, log_level=DEBUG, data=None):
-        self.history.append((datetime.now(), msg, data))
-        if self.logger.isEnabledFor(log_level):
-            self.logger.log(log_level, '{}: {}'.format(type(self), msg))
+    def export_history(self, f, clear=True):
+        """
+        write the history to the text file f as JSON lines, oldest first,
+        and then forget it unless clear is False; returns the number of
+        records written
+        """
+        count = 0
+        for r in self.history:
+            f.write(json.dumps({
+                'time': self._datetime(r).isoformat(),
+                'monotonic': r.monotonic,
+                'level': logging.getLevelName(r.level),
+                'source': type(self).__name__,
+                'message': r.message,
+                'data': r.data}, default=str))
+            f.write('\n')
+            count += 1
+        if clear:
+            self.history.clear()
+        return count
 
+    def _append_history(self, msg, args=(), log_level=DEBUG, data=None):
+        enabled = self.logger.isEnabledFor(log_level)
+        if self.history.maxlen == 0 and not enabled:
+            return
+        record = HistoryRecord(time.monotonic(), log_level, msg, args, data)
+        self.history.append(record)
+        if enabled:
+            self.logger.log(log_level, '%s: %s', type(self), record)
 
-class MasterMaker(Historian):
+    def _datetime(self, record):
+        return datetime.fromtimestamp(
+            self._wall_start + record.monotonic - self._monotonic_start,
+            timezone.utc)
+
+
+class StageStats():
+    """
+    calls, wall-clock seconds, CPU seconds and bytes processed for each
+    stage of making a master, in the order the stages were first run
+    """
 
-    def __init__(self, src, logging_threshold=INFO, dest=None):
-        Historian.__init__(self, logging_threshold)
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def __getitem__(self, stage):
+        return self.stages[stage]
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def add(self, stage, wall, cpu, nbytes=0):
         try:
-            self.original = Image.open(src)
-        except AttributeError:
-            self.original = src
-            self.original_filename = 'unknown ({})'.format(
-                self.original.format)
-            self.log(
-                'initiated with image already in RAM ({})'
-                ''.format(self.original.format))
-        else:
-            self.original_filename = src
-            self.log(
-                'initiated and opened image ({}) from file "{}"'
-                ''.format(self.original.format, src))
+            totals = self.stages[stage]
+        except KeyError:
+            totals = self.stages[stage] = {
+                'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes': 0}
+        totals['calls'] += 1
+        totals['wall'] += wall
+        totals['cpu'] += cpu
+        totals['bytes'] += nbytes
+
+    def as_dict(self):
+        return OrderedDict((k, dict(v)) for k, v in self.stages.items())
+
+
+def summarize_stages(stats, percentiles=(50, 90, 99, 100)):
+    """
+    aggregate a sequence of StageStats (or their as_dict() values), one per
+    master, and return an ordered dictionary with, for each stage, the
+    number of masters and calls, percentiles of per-master wall and CPU
+    seconds and bytes, and totals
+    """
+    values = OrderedDict()
+    for s in stats:
+        if isinstance(s, StageStats):
+            s = s.as_dict()
+        for stage, totals in s.items():
+            values.setdefault(stage, []).append(totals)
+    summary = OrderedDict()
+    for stage, rows in values.items():
+        summary[stage] = {'masters': len(rows)}
+        summary[stage]['calls'] = sum(r['calls'] for r in rows)
+        for k in ('wall', 'cpu', 'bytes'):
+            ordered = sorted(r[k] for r in rows)
+            summary[stage][k] = OrderedDict(
+                (p, _percentile(ordered, p)) for p in percentiles)
+            summary[stage][k]['total'] = sum(ordered)
+    return summary
+
+
+def _percentile(ordered, p):
+    # nearest-rank percentile of a sorted, non-empty list
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class _StageTimer():
+    __slots__ = ('maker', 'stage', 'bytes', '_wall', '_cpu')
+
+    def __init__(self, maker, stage, nbytes=0):
+        self.maker = maker
+        self.stage = stage
+        self.bytes = nbytes
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a stage whose bytes are left as None turned out to do no work
+        if exc_type is not None or self.bytes is None:
+            return
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        self.maker.stats.add(self.stage, wall, cpu, self.bytes)
+        if self.maker.stage_hook is not None:
+            self.maker.stage_hook(self.stage, wall, cpu, self.bytes)
+
+
+class _ProfileName():
+    """
+    the name of an ICC profile, looked up only when it is formatted
+    """
+    __slots__ = ('profile',)
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __str__(self):
+        return getProfileName(self.profile).strip()
+
+
+class MasterMaker(Historian):
+    """
+    makes the master of an original: the image converted to the standard
+    ICC profile for its gamut, sRGB2014 or ProPhoto
+
+    A MasterMaker made without src is a long-lived worker: process() (or
+    process_all()) makes and saves one master after another, keeping the
+    bundled profiles it has loaded, the shared transform cache, and the
+    buffer of its last master to reuse for the next one of the same size.
+    """
+
+    def __init__(
+            self, src=None, logging_threshold=INFO, dest=None,
+            discard_original=False, history_size=HISTORY_SIZE,
+            stats=None, stage_hook=None):
+        """
+        src is a filename or an image already in RAM; if discard_original is
+        True the pixels of the original may be overwritten by the master, so
+        the original must not be used once make() has been called (an
+        uncompressed TIFF original is read band by band instead, see make())
+
+        The time taken by each stage (open, decode, profile, build_transform,
+        convert, apply_transform, save or encode) is added to stats, a
+        StageStats, and passed to stage_hook(stage, wall, cpu, bytes) if it
+        is given.
+        """
+        Historian.__init__(self, logging_threshold, history_size)
+        self.discard_original = discard_original
+        self.stats = StageStats() if stats is None else stats
+        self.stage_hook = stage_hook
+        self.profiles = {}
+        self.original = None
+        self.original_filename = None
+        self.master = None
+        self._scratch = None
+        if src is not None:
+            self._open(src)
         self.dest = dest
 
+    def process(
+            self, src, dest=None, band_size=None, stats=None,
+            **save_options):
+        """
+        make the master of src (as for __init__) and write it to dest,
+        returning its path; it is streamed in bands of band_size bytes if
+        band_size is given (see stream()), and save_options are passed to
+        save() or stream()
+
+        Each call starts a new history and, unless stats is given, a new
+        StageStats, so that they describe src alone.
+        """
+        self.history.clear()
+        self.stats = StageStats() if stats is None else stats
+        self.master = None
+        self._open(src)
+        try:
+            if band_size:
+                return self.stream(dest, band_size, **save_options)
+            self.make()
+            return self.save(dest, **save_options)
+        finally:
+            if self.master is not None and self.master is not self.original:
+                self._scratch = self.master
+            self.master = None
+            if src is not self.original:
+                self.original.close()
+
+    def process_all(self, jobs, band_size=None, **save_options):
+        """
+        process() each (src, dest) pair of the iterable jobs in turn,
+        generating a (src, destination, error, stats) tuple for each, where
+        error is None or the description of the exception that stopped it
+        and stats is a dictionary (see StageStats.as_dict)
+        """
+        for src, dest in jobs:
+            try:
+                destination = self.process(
+                    src, dest, band_size, **save_options)
+            except Exception as e:
+                yield (src, None, '{}: {}'.format(type(e).__name__, e), None)
+            else:
+                yield (src, destination, None, self.stats.as_dict())
+
     def make(self):
+        """
+        make the master in memory and return it
+
+        An uncompressed TIFF original is not decoded in full: it is read
+        band by band from a memory map of the file and each band is
+        converted straight into the master (see
+        isaw.awib.streaming.iter_bands), so the original's pixels are never
+        copied into memory alongside it. This is done even with
+        discard_original, as it needs no more memory than converting in
+        place and the master's buffer can be reused by process().
+        """
+        if is_raw_tiff(self.original):
+            self._standardize_icc_by_band()
+            return self.master
+        with self._stage('decode', _pixel_bytes(self.original)):
+            self.original.load()
         self._standardize_icc()
         return self.master
 
-    def save(self, dest=None):
+    def save(
+            self, dest=None, compression=None, predictor=None,
+            tile_size=None, bigtiff=None, pyramid=False,
+            carry_metadata=False):
+        """
+        write the master as an uncompressed TIFF in strips or, if any of
+        compression, predictor, tile_size, bigtiff or pyramid is given, with
+        isaw.awib.streaming.TiffWriter; every compression it offers is
+        lossless. With pyramid, reduced-resolution copies of the master
+        follow it in the file. Masters too large for a classic TIFF are
+        always written as BigTIFF unless bigtiff is False.
+
+        With carry_metadata, the EXIF, XMP and IPTC metadata embedded in the
+        original (see embedded_metadata) are written into the master with
+        it, rather than copied afterwards by rewriting the file.
+        """
+        destination = self._get_destination(dest)
+        metadata = self._get_metadata(carry_metadata)
+        options = {
+            'compression': compression,
+            'predictor': predictor,
+            'tile_size': tile_size,
+            'bigtiff': bigtiff}
+        if bigtiff is None and needs_bigtiff(
+                self.master.size, tile_size, pyramid):
+            options['bigtiff'] = True
+        with self._stage('save') as stage:
+            if all([v is None for v in options.values()]) and not pyramid:
+                self.master.DEBUG = True
+                # the master may be the original itself, whose compression
+                # Pillow would otherwise reuse
+                if metadata is None:
+                    self.master.save(destination, compression='raw')
+                else:
+                    self.master.save(
+                        destination, compression='raw', tiffinfo=metadata)
+            else:
+                writer = TiffWriter(
+                    destination,
+                    self.master.size,
+                    icc_profile=self.master.info.get('icc_profile'),
+                    dpi=self.master.info.get('dpi'),
+                    pyramid=pyramid,
+                    metadata=metadata,
+                    **options)
+                with writer:
+                    for band in iter_bands(self.master):
+                        if band.mode != 'RGB':
+                            band = band.convert('RGB')
+                        writer.write(band)
+            stage.bytes = os.path.getsize(destination)
+        return destination
+
+    def stream(
+            self, dest=None, band_size=DEFAULT_BAND_SIZE, compression=None,
+            predictor=None, tile_size=None, bigtiff=None, pyramid=False,
+            carry_metadata=False):
+        """
+        convert the original and write the master to disk band by band,
+        never holding more than about band_size bytes of pixels at once;
+        the other arguments are as for save()
+        """
+        destination = self._get_destination(dest)
+        metadata = self._get_metadata(carry_metadata)
+        tx, mode = self._select_transform()
+        if tx is None:
+            mode = 'RGB'
+            icc_profile = self.original.info.get('icc_profile')
+        else:
+            icc_profile = tx.output_profile.tobytes()
+        writer = TiffWriter(
+            destination,
+            self.original.size,
+            icc_profile=icc_profile,
+            dpi=self.original.info.get('dpi'),
+            compression=compression,
+            predictor=predictor,
+            tile_size=tile_size,
+            bigtiff=bigtiff,
+            pyramid=pyramid,
+            metadata=metadata)
+        with writer:
+            for band in self._convert_bands(tx, mode, band_size):
+                with self._stage('encode', _pixel_bytes(band)):
+                    writer.write(band)
+        self.log(
+            'Streamed master to "{}" in bands of up to {} rows.', DEBUG,
+            destination, band_height(self.original, band_size))
+        return destination
+
+    def _get_destination(self, dest):
         if dest is None:
             if self.dest is None:
                 raise RuntimeError(
                     'save method called with no destination filename')
             else:
-                destination = abspath(self.dest)
+                return abspath(self.dest)
         else:
-            destination = abspath(dest)
-        self.master.DEBUG = True
-        self.master.save(destination)
-        return destination
+            return abspath(dest)
+
+    def _open(self, src):
+        try:
+            with self._stage('open') as stage:
+                self.original = open_trusted(src, ORIGINAL_MAX_PIXELS)
+                if isinstance(src, (str, os.PathLike)):
+                    stage.bytes = os.path.getsize(src)
+        except AttributeError:
+            self.original = src
+            self.original_filename = 'unknown ({})'.format(
+                self.original.format)
+            self.log(
+                'initiated with image already in RAM ({})', DEBUG,
+                self.original.format)
+        else:
+            self.original_filename = src
+            self.log(
+                'initiated and opened image ({}) from file "{}"', DEBUG,
+                self.original.format, src)
+
+    def _new_master(self, size):
+        # an RGB image of size to hold a master, reusing the buffer of the
+        # last master that process() saved if it is the same size
+        scratch, self._scratch = self._scratch, None
+        if scratch is not None and scratch.size == size and (
+                scratch.mode == 'RGB' and not scratch.readonly):
+            scratch.info = {}
+            self.log('Reusing the buffer of the previous master.')
+            return scratch
+        return Image.new('RGB', size)
+
+    def _get_metadata(self, carry_metadata):
+        if not carry_metadata:
+            return None
+        metadata = embedded_metadata(self.original)
+        self.log(
+            'Carrying embedded metadata from the original into the master: '
+            '{} tags.', DEBUG, len(metadata))
+        return metadata
+
+    def _convert_bands(self, tx, mode, band_size=DEFAULT_BAND_SIZE):
+        # generate the bands of the original converted to mode and
+        # transformed by tx, if it is not None
+        bands = iter_bands(self.original, band_size)
+        while True:
+            with self._stage('decode', None) as stage:
+                band = next(bands, None)
+                if band is not None:
+                    stage.bytes = _pixel_bytes(band)
+            if band is None:
+                return
+            if band.mode != mode:
+                with self._stage('convert', _pixel_bytes(band)):
+                    band = _convert(band, mode)
+            if tx is None:
+                pass
+            elif band.mode == 'RGB':
+                # each band is a private copy, so it can be reused
+                with self._stage('apply_transform', _pixel_bytes(band)):
+                    applyTransform(band, tx, inPlace=True)
+            else:
+                with self._stage('apply_transform', _pixel_bytes(band)):
+                    band = applyTransform(band, tx, inPlace=False)
+            yield band
+
+    def _stage(self, stage, nbytes=0):
+        return _StageTimer(self, stage, nbytes)
 
     def _standardize_icc(self):
-        profile_original = self._get_original_profile()
-        profile_original_name = getProfileName(profile_original).strip()
-        self.log('profile_original_name: "{}"'.format(profile_original_name))
+        tx, mode = self._select_transform()
+        if tx is None:
+            self.master = self.original
+        else:
+            im = self.original
+            if im.mode != mode:
+                with self._stage('convert', _pixel_bytes(im)):
+                    im = _convert(im, mode)
+                private = True
+            else:
+                private = self.discard_original
+            if private and im.mode == 'RGB':
+                im.load()
+                private = not im.readonly
+            with self._stage('apply_transform', _pixel_bytes(im)):
+                if private and im.mode == 'RGB':
+                    applyTransform(im, tx, inPlace=True)
+                    self.master = im
+                else:
+                    self.master = tx.apply(im, self._new_master(im.size))
+            if self.master is im:
+                self.log('Transformed pixels in place.')
+
+    def _standardize_icc_by_band(self):
+        tx, mode = self._select_transform()
+        if tx is None:
+            with self._stage('decode', _pixel_bytes(self.original)):
+                self.original.load()
+            self.master = self.original
+            return
+        self.master = self._new_master(self.original.size)
+        y = 0
+        for band in self._convert_bands(tx, mode):
+            self.master.paste(band, (0, y))
+            y += band.size[1]
+        self.master.info['icc_profile'] = tx.output_profile.tobytes()
+
+    def _select_transform(self):
+        """
+        return a (transform, mode) tuple, where mode is the mode the original
+        must be converted to before the transform is applied; transform is
+        None if the original already has the target profile
+        """
+        with self._stage('profile'):
+            profile_key, profile_original, profile_original_name = (
+                self._get_original_profile())
+        self.log(
+            'profile_original_name: "{}"', DEBUG, profile_original_name)
         if ('sRGB' in profile_original_name or
                 'IEC 61966-2-1' in profile_original_name):
                 target = 'sRGB2014'
         else:
             target = 'ProPhoto'
         profile_target = self._get_profile_from_file(target)
-        profile_target_name = getProfileName(profile_target).strip()
         if profile_original == profile_target:
-            self.master = self.original
             self.log(
-                'Original ICC profile was already the specified target ({}).'
-                ''.format(profile_target_name))
-        else:
-            try:
-                tx = buildTransform(
+                'Original ICC profile was already the specified target ({}).',
+                DEBUG, _ProfileName(profile_target))
+            return (None, self.original.mode)
+        mode = self.original.mode
+        try:
+            tx = self._get_transform(
+                profile_key, profile_original, target, mode)
+        except PyCMSError as e:
+            # palette and grayscale images whose profile cannot transform
+            # them as they are (16-bit grayscale, or no profile of their
+            # own) are converted to RGB first
+            if str(e) == 'cannot build transform' and mode != 'RGB':
+                mode = 'RGB'
+                tx = self._get_transform(
+                    profile_key, profile_original, target, mode)
+            else:
+                raise
+        self.log(
+            'Original ICC profile ({}) was converted to the standard '
+            'target ({}).', DEBUG,
+            profile_original_name, _ProfileName(profile_target))
+        return (tx, mode)
+
+    def _get_transform(self, profile_key, profile_original, target, mode):
+        def build():
+            with self._stage('build_transform'):
+                return buildTransform(
                     profile_original,
-                    profile_target,
-                    self.original.mode,
+                    self._get_profile_from_file(target),
+                    mode,
                     'RGB',
                     renderingIntent=INTENT_PERCEPTUAL)
-            except PyCMSError as e:
-                if str(e) == 'cannot build transform':
-                    if self.original.mode == 'P':
-                        im = self.original.convert('RGB')
-                        tx = buildTransform(
-                            profile_original,
-                            profile_target,
-                            im.mode,
-                            'RGB',
-                            renderingIntent=INTENT_PERCEPTUAL)
-                else:
-                    raise
-            else:
-                im = self.original
-            self.master = applyTransform(im, tx, inPlace=False)
-            self.log(
-                'Original ICC profile ({}) was converted to the standard '
-                'target ({}).'
-                ''.format(
-                    profile_original_name,
-                    profile_target_name))
+        return TRANSFORM_CACHE.get((profile_key, mode, target), build)
 
     def _get_profile_from_file(self, profile_name):
-        fn = join(
-            dirname(realpath(__file__)),
-            'icc',
-            '{}.icc'.format(profile_name))
-        return getOpenProfile(fn)
+        # bundled profiles are kept for the life of the maker, however many
+        # embedded profiles pass through the shared cache
+        try:
+            return self.profiles[profile_name]
+        except KeyError:
+            profile = self.profiles[profile_name] = get_profile(profile_name)
+            return profile
 
     def _get_original_profile(self):
+        """
+        return a (cache key, profile, profile name) tuple for the original
+        """
         try:
-            raw_profile = getOpenProfile(
-                BytesIO(self.original.info['icc_profile']))
+            raw = self.original.info['icc_profile']
         except KeyError:
-            raw_profile = self._get_profile_from_file(
-                'sRGB_IEC61966-2-1_black_scaled')
+            key = DEFAULT_PROFILE
+            raw_profile = self._get_profile_from_file(DEFAULT_PROFILE)
+            name = getProfileName(raw_profile).strip()
             self.log(
                 'Original image does not have an internal ICC color profile.'
-                '{} has been assigned.'
-                ''.format(getProfileName(raw_profile).strip()))
+                '{} has been assigned.', DEBUG,
+                name)
         else:
+            key = sha1(raw).hexdigest()
+            raw_profile = PROFILE_CACHE.get(
+                key, lambda: getOpenProfile(BytesIO(raw)))
+            name = getProfileName(raw_profile).strip()
             self.log(
-                'Detected internal ICC color profile in original image: {}.'
-                ''.format(getProfileName(raw_profile).strip()))
-        return raw_profile
+                'Detected internal ICC color profile in original image: {}.',
+                DEBUG, name)
+        return (key, raw_profile, name)
+
+
+def get_profile(profile_name):
+    """
+    return one of the ICC profiles bundled in isaw/awib/icc, by file name
+    without extension
+    """
+    return PROFILE_CACHE.get(
+        profile_name, lambda: getOpenProfile(_icc_path(profile_name)))
+
+
+def embedded_metadata(im):
+    """
+    return a PIL.TiffImagePlugin.ImageFileDirectory_v2 of the metadata
+    embedded in im, such as a master carries: the CARRIED_TAGS of its EXIF,
+    its Exif and GPS IFDs, and its XMP packet and IPTC-NAA records, from
+    wherever im's format keeps them
+
+    Maker notes are left out, as the offsets in them would not survive the
+    move.
+    """
+    metadata = ImageFileDirectory_v2()
+    exif = im.getexif()
+    for tag in CARRIED_TAGS:
+        if tag in exif:
+            metadata[tag] = exif[tag]
+    for tag in (EXIF_IFD, GPS_IFD):
+        ifd = dict(exif.get_ifd(tag))
+        ifd.pop(MAKERNOTE, None)
+        if INTEROP_IFD in ifd:
+            ifd[INTEROP_IFD] = dict(exif.get_ifd(INTEROP_IFD))
+        if len(ifd) > 0:
+            metadata[tag] = ifd
+    xmp = _embedded_xmp(im)
+    if xmp:
+        metadata[XMP] = xmp
+    iptc = _embedded_iptc(im)
+    if iptc:
+        metadata[IPTC] = iptc
+    return metadata
+
+
+def open_trusted(src, max_pixels=None):
+    """
+    open the image file src (a filename or binary file object) as
+    Image.open does, but limit it to max_pixels pixels (None for no limit)
+    instead of Image.MAX_IMAGE_PIXELS, which is not changed, as other
+    threads may be opening untrusted images at the same time
+    """
+    try:
+        im = Image.open(src)
+    except Image.DecompressionBombError:
+        # Pillow identified the image and then refused it; open it again
+        # with the plugin that accepts it, which does no size check
+        im = _open_unchecked(src)
+    if max_pixels is not None and im.width * im.height > max_pixels:
+        im.close()
+        raise Image.DecompressionBombError(
+            'image size ({} pixels) exceeds limit of {} pixels'.format(
+                im.width * im.height, max_pixels))
+    return im
+
+
+def _embedded_xmp(im):
+    tags = getattr(im, 'tag_v2', {})
+    if XMP in tags:
+        return tags[XMP]
+    for marker, content in getattr(im, 'applist', []):
+        if marker == 'APP1' and content.startswith(XMP_MARKER):
+            return content[len(XMP_MARKER):]
+    xmp = im.info.get('xmp', im.info.get('XML:com.adobe.xmp'))
+    if isinstance(xmp, str):
+        xmp = xmp.encode('utf-8')
+    return xmp
+
+
+def _embedded_iptc(im):
+    tags = getattr(im, 'tag_v2', {})
+    if isinstance(tags.get(IPTC), bytes):
+        return tags[IPTC]
+    return im.info.get('photoshop', {}).get(0x0404)
+
+
+def _open_unchecked(src):
+    # the loop of Image.open without its decompression bomb check; the
+    # plugins are already registered, as Image.open has run
+    if isinstance(src, (str, os.PathLike)):
+        filename = os.fspath(src)
+        fp = open(filename, 'rb')
+    else:
+        filename = ''
+        fp = src
+    fp.seek(0)
+    prefix = fp.read(16)
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        result = not accept or accept(prefix)
+        if not result or isinstance(result, (str, bytes)):
+            continue
+        fp.seek(0)
+        try:
+            im = factory(fp, filename)
+        except (IndexError, SyntaxError, TypeError, struct.error):
+            continue
+        im._exclusive_fp = fp is not src
+        return im
+    if fp is not src:
+        fp.close()
+    raise Image.UnidentifiedImageError(
+        'cannot identify image file {!r}'.format(src))
+
+
+def _convert(im, mode):
+    # im converted to mode; 16-bit grayscale is scaled to 8 bits rather than
+    # clipped (Pillow opens 16-bit grayscale PNGs in mode I)
+    if im.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N') and mode != im.mode:
+        im = im.convert('I').point(lambda i: i * (1 / 256))
+    return im.convert(mode)
+
+
+def _pixel_bytes(im):
+    # approximate size of the decoded pixels of im
+    bits = {'1': 1, 'I;16': 16, 'I': 32, 'F': 32}.get(im.mode, 8)
+    return im.width * im.height * len(im.getbands()) * bits // 8
+
 
+def _icc_path(profile_name):
+    return join(
+        dirname(realpath(__file__)),
+        'icc',
+        '{}.icc'.format(profile_name))
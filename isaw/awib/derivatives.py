@@ -0,0 +1,151 @@
+"""
+Make access copies and thumbnails from a master in one pass
+"""
+
+from hashlib import sha1
+from io import BytesIO
+from isaw.awib.conversions import (get_profile, PROFILE_CACHE,
+                                   TRANSFORM_CACHE)
+from isaw.awib.preview import load_reduced
+import os
+from os.path import join
+from PIL import Image
+from PIL.ImageCms import (applyTransform, buildTransform, getOpenProfile,
+                          INTENT_PERCEPTUAL)
+
+WEB_PROFILE = 'sRGB2014'
+# file extensions for the formats derivatives are usually written in
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'TIFF': 'tif', 'WEBP': 'webp'}
+
+
+class Derivative():
+    """
+    a kind of derivative: an image no larger than max_size pixels on its
+    longer side, saved as name.<extension> in format with the given quality
+    (for lossy formats) and any other Pillow save options; if srgb is True
+    it is converted to sRGB for the web
+    """
+
+    def __init__(
+            self, name, max_size, format='JPEG', quality=85, srgb=True,
+            **options):
+        self.name = name
+        self.max_size = max_size
+        self.format = format
+        self.quality = quality
+        self.srgb = srgb
+        self.options = options
+
+    def __repr__(self):
+        return 'Derivative({!r}, {}, {!r})'.format(
+            self.name, self.max_size, self.format)
+
+    @property
+    def filename(self):
+        extension = EXTENSIONS.get(self.format, self.format.lower())
+        return '{}.{}'.format(self.name, extension)
+
+    def fit(self, size):
+        """
+        return the size of this derivative of an image of size, keeping its
+        aspect ratio and never enlarging it
+        """
+        width, height = size
+        scale = min(1.0, self.max_size / max(width, height))
+        return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+DEFAULT_DERIVATIVES = [
+    Derivative('access', 2048, quality=90),
+    Derivative('preview', 800),
+    Derivative('thumbnail', 200)]
+
+
+def make_derivatives(
+        master, dest, derivatives=DEFAULT_DERIVATIVES,
+        resample=Image.LANCZOS):
+    """
+    write derivatives of master, an image (such as MasterMaker.make()
+    returns) or the path of one, to directory dest and return a dictionary
+    of their paths by name
+
+    Derivatives are made largest first. The image is halved with a cheap box
+    filter (Image.reduce) for as long as it stays at least twice the size of
+    the next derivative, and that reduced image is kept and reduced further
+    for the derivatives after it, so the full-size image is only ever read
+    once. Only the last step to the exact size is resampled. A path is
+    decoded at the smallest pyramid level, or JPEG or JPEG 2000 reduction,
+    that is large enough for the largest derivative
+    (isaw.awib.preview.load_reduced).
+    """
+    derivatives = sorted(
+        derivatives, key=lambda d: d.max_size, reverse=True)
+    if len(derivatives) == 0:
+        return {}
+    if isinstance(master, Image.Image):
+        size = master.size
+    else:
+        with Image.open(master) as im:
+            size = im.size
+        master = load_reduced(master, derivatives[0].fit(size))
+    current = master
+    if current.mode not in ('RGB', 'L'):
+        current = current.convert('RGB')
+    paths = {}
+    for d in derivatives:
+        target = d.fit(size)
+        factor = 1
+        while (current.width // (factor * 2) >= target[0] and
+                current.height // (factor * 2) >= target[1]):
+            factor *= 2
+        if factor > 1:
+            current = current.reduce(factor)
+        if current.size == target:
+            im = current
+        else:
+            im = current.resize(target, resample)
+        path = join(dest, d.filename)
+        save_derivative(im, path, d, current.info.get('icc_profile'))
+        paths[d.name] = path
+    return paths
+
+
+def save_derivative(im, path, derivative, icc_profile=None):
+    """
+    save im, which has the ICC profile icc_profile (bytes), as derivative
+    """
+    if derivative.srgb and icc_profile is not None:
+        im, icc_profile = to_srgb(im, icc_profile)
+    if derivative.format == 'JPEG' and im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+    options = dict(derivative.options)
+    options['quality'] = derivative.quality
+    if icc_profile is not None:
+        options['icc_profile'] = icc_profile
+    tmp_path = path + '.tmp'
+    try:
+        im.save(tmp_path, derivative.format, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def to_srgb(im, icc_profile):
+    """
+    return (im converted to sRGB, the sRGB profile as bytes); im is
+    returned unchanged if icc_profile is already sRGB or im is not RGB
+    """
+    target = get_profile(WEB_PROFILE)
+    target_bytes = target.tobytes()
+    if icc_profile == target_bytes or im.mode != 'RGB':
+        return (im, icc_profile)
+    key = sha1(icc_profile).hexdigest()
+    source = PROFILE_CACHE.get(
+        key, lambda: getOpenProfile(BytesIO(icc_profile)))
+    tx = TRANSFORM_CACHE.get(
+        (key, 'RGB', WEB_PROFILE),
+        lambda: buildTransform(
+            source, target, 'RGB', 'RGB', renderingIntent=INTENT_PERCEPTUAL))
+    return (applyTransform(im, tx), target_bytes)
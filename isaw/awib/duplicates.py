@@ -0,0 +1,217 @@
+"""
+Find originals that are already in the image bank, even if re-encoded or
+resized, by comparing perceptual hashes
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from isaw.awib.preview import preview
+from isaw.awib.validate import find_packages
+import logging
+import numpy as np
+import os
+from os.path import abspath, getsize, join
+from PIL import Image
+
+HASH_SIZE = 8  # hashes are HASH_SIZE x HASH_SIZE bits
+PHASH_SIZE = 32  # side of the image whose DCT gives the pHash
+PREVIEW_SIZE = 128  # pixels on the longer side of the decode hashed
+# hashes of this many bits or fewer apart are near duplicates
+DEFAULT_MAX_DISTANCE = 10
+HASH_DTYPE = np.dtype([('dhash', '<u8'), ('phash', '<u8')])
+# number of set bits in each byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+CHUNK_SIZE = 16  # packages sent to each worker at a time by update()
+
+
+def dhash(im):
+    """
+    return the difference hash of im: whether each pixel of a grayscale
+    (HASH_SIZE + 1) x HASH_SIZE thumbnail is brighter than the one to its
+    left
+    """
+    pixels = np.asarray(
+        im.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS),
+        dtype=np.int16)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(im):
+    """
+    return the perceptual hash of im: whether each of the lowest frequency
+    HASH_SIZE x HASH_SIZE DCT coefficients of a grayscale PHASH_SIZE x
+    PHASH_SIZE thumbnail is above their median (not counting the DC term)
+    """
+    pixels = np.asarray(
+        im.convert('L').resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS),
+        dtype=np.float64)
+    dct = _dct_matrix(PHASH_SIZE)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+def image_hashes(src, trusted=False):
+    """
+    return (dhash, phash) of the image file src, decoded at reduced size
+    and normalized to sRGB; a trusted src is opened without Pillow's
+    decompression bomb limit (see isaw.awib.preview.open_reduced)
+    """
+    im = preview(src, PREVIEW_SIZE, trusted=trusted)
+    return (dhash(im), phash(im))
+
+
+def hamming(hashes, h):
+    """
+    return an array of the number of bits by which each of hashes (an array
+    of uint64) differs from h
+    """
+    x = np.bitwise_xor(hashes, np.uint64(h))
+    if hasattr(np, 'bitwise_count'):  # NumPy 2.0 and later
+        return np.bitwise_count(x)
+    return POPCOUNT[x.view(np.uint8)].reshape(-1, 8).sum(
+        axis=1, dtype=np.uint8)
+
+
+def package_image(path):
+    """
+    return the path of the image in package directory path that is hashed:
+    its original, or its master if the original is missing
+    """
+    for fn in sorted(os.listdir(path)):
+        if fn.startswith('original.') and not fn.endswith('.sha512'):
+            return join(path, fn)
+    return join(path, 'master.tif')
+
+
+class HashIndex():
+    """
+    perceptual hashes of the packages in the image bank, kept in directory
+
+    The hashes are an array of HASH_DTYPE records in hashes.bin, which is
+    memory-mapped for queries, and the package paths are the lines of
+    names.txt, in the same order. Both files are only ever appended to.
+    """
+
+    def __init__(self, directory):
+        self.directory = abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.hashes_path = join(self.directory, 'hashes.bin')
+        self.names_path = join(self.directory, 'names.txt')
+        self.names = []
+        if os.path.exists(self.names_path):
+            with open(self.names_path, encoding='utf-8') as f:
+                self.names = f.read().splitlines()
+        # an interrupted add() may leave a record or a name without the
+        # other, so the longer file is cut back to match
+        size = 0
+        if os.path.exists(self.hashes_path):
+            size = getsize(self.hashes_path)
+        count = min(size // HASH_DTYPE.itemsize, len(self.names))
+        if len(self.names) > count:
+            self.names = self.names[:count]
+            with open(self.names_path, 'w', encoding='utf-8') as f:
+                f.writelines(['{}\n'.format(n) for n in self.names])
+        if size > count * HASH_DTYPE.itemsize:
+            os.truncate(self.hashes_path, count * HASH_DTYPE.itemsize)
+        self.known = set(self.names)
+        self._hashes = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.known
+
+    @property
+    def hashes(self):
+        """
+        the array of hashes, memory-mapped read-only
+        """
+        if self._hashes is None:
+            if len(self.names) == 0:
+                self._hashes = np.zeros(0, dtype=HASH_DTYPE)
+            else:
+                self._hashes = np.memmap(
+                    self.hashes_path, dtype=HASH_DTYPE, mode='r',
+                    shape=(len(self.names),))
+        return self._hashes
+
+    def add(self, name, hashes):
+        """
+        add the (dhash, phash) hashes of package name
+        """
+        record = np.array([hashes], dtype=HASH_DTYPE)
+        with open(self.hashes_path, 'ab') as f:
+            f.write(record.tobytes())
+        with open(self.names_path, 'a', encoding='utf-8') as f:
+            f.write('{}\n'.format(name))
+        self.names.append(name)
+        self.known.add(name)
+        self._hashes = None
+
+    def update(self, collection, jobs=1):
+        """
+        hash and add every package in directory collection that is not yet
+        in the index, using jobs worker processes, and return the number
+        added; packages whose image cannot be read are logged and skipped
+        """
+        paths = [p for p in find_packages(collection) if p not in self.known]
+        images = [package_image(p) for p in paths]
+        if jobs <= 1:
+            results = map(_hash_package, images)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            results = executor.map(
+                _hash_package, images, chunksize=CHUNK_SIZE)
+        added = 0
+        try:
+            for path, hashes in zip(paths, results):
+                if hashes is not None:
+                    self.add(path, hashes)
+                    added += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return added
+
+    def query(self, hashes, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        return a list of (name, dhash distance, phash distance) tuples for
+        the packages whose hashes are both within max_distance bits of
+        hashes (dhash, phash), closest first
+        """
+        d = hamming(self.hashes['dhash'], hashes[0])
+        p = hamming(self.hashes['phash'], hashes[1])
+        matches = np.flatnonzero((d <= max_distance) & (p <= max_distance))
+        matches = matches[np.lexsort((d[matches], p[matches]))]
+        return [(self.names[i], int(d[i]), int(p[i])) for i in matches]
+
+    def find(self, src, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        return query() results for the image file src
+        """
+        return self.query(image_hashes(src), max_distance)
+
+
+def _hash_package(image):
+    try:
+        # package images are archive files, however large
+        return image_hashes(image, trusted=True)
+    except (OSError, ValueError) as e:
+        logging.getLogger(__name__).warning(
+            'cannot hash {}: {}'.format(image, e))
+        return None
+
+
+def _dct_matrix(n):
+    # orthonormal DCT-II matrix, so that dct @ x is the DCT of column x
+    k = np.arange(n).reshape(-1, 1)
+    i = np.arange(n).reshape(1, -1)
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+def _pack(bits):
+    # pack an array of HASH_SIZE x HASH_SIZE booleans into an int
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
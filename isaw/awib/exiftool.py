@@ -0,0 +1,236 @@
+"""
+Run many exiftool commands through long-lived exiftool processes, one
+(ExifTool) or several shared between threads (ExifToolPool)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from lxml import etree
+import os
+import queue
+import subprocess
+
+EXIFTOOL = 'exiftool'
+READ_SIZE = 64 * 1024
+# options with which reports are extracted, as accession has always used
+REPORT_OPTIONS = ['-X', '-struct', '-u']
+
+
+class ExifToolError(Exception):
+    pass
+
+
+class ExifTool():
+    """
+    an exiftool process started with -stay_open, which reads the arguments
+    of each command from its standard input, so that Perl and exiftool are
+    only loaded once however many commands are run
+    """
+
+    def __init__(self, executable=EXIFTOOL):
+        self.executable = executable
+        self.logger = logging.getLogger(__name__)
+        self.count = 0
+        try:
+            self.process = subprocess.Popen(
+                [executable, '-stay_open', 'True', '-@', '-'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        except OSError as e:
+            raise ExifToolError(
+                'cannot run {}: {}'.format(executable, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, *args):
+        """
+        run exiftool with args (strings, one per argument) and return its
+        output as bytes; raises ExifToolError if it reports an error
+        """
+        if self.process is None:
+            raise ExifToolError('exiftool has been closed')
+        for arg in args:
+            if '\n' in arg:
+                raise ValueError(
+                    'exiftool arguments cannot contain newlines: {!r}'
+                    ''.format(arg))
+        self.count += 1
+        sentinel = '{{ready{}}}'.format(self.count)
+        lines = list(args) + [
+            '-echo4', sentinel, '-execute{}'.format(self.count)]
+        try:
+            self.process.stdin.write(
+                ''.join(['{}\n'.format(a) for a in lines]).encode('utf-8'))
+            self.process.stdin.flush()
+            output = self._read_until(self.process.stdout, sentinel)
+            errors = self._read_until(self.process.stderr, sentinel)
+        except (BrokenPipeError, EOFError) as e:
+            self.close()
+            raise ExifToolError('exiftool stopped unexpectedly: {}'.format(e))
+        errors = errors.decode('utf-8', 'replace').strip()
+        if 'Error' in errors:
+            raise ExifToolError(errors)
+        elif errors != '':
+            self.logger.warning(errors)
+        return output
+
+    def extract(self, path):
+        """
+        return exiftool's XML report (-X -struct -u) on the file path as a
+        tree, as make_metadata reads it
+        """
+        return etree.fromstring(self.report(path)).getroottree()
+
+    def report(self, path):
+        """
+        return exiftool's XML report (-X -struct -u) on the file path as
+        bytes, to be saved as accession saves it
+        """
+        return self.execute('-q', *REPORT_OPTIONS, path)
+
+    def read_tags(self, *paths):
+        """
+        return a list of dictionaries of the tags of the files paths, as
+        reported by exiftool -j, with the path of each in 'SourceFile'
+        """
+        return json.loads(self.execute('-q', '-j', *paths).decode('utf-8'))
+
+    def write_tags(self, path, **tags):
+        """
+        set the tags of the file path to the values given, such as
+        write_tags(path, DigitalImageGUID=urn), overwriting it in place
+        """
+        self.execute(
+            '-q', '-overwrite_original',
+            *['-{}={}'.format(k, v) for k, v in sorted(tags.items())], path)
+
+    def copy_tags(self, src, dest):
+        """
+        copy all the tags of the file src to the file dest, overwriting it
+        in place
+        """
+        self.execute(
+            '-q', '-overwrite_original', '-tagsfromfile', src, '-all:all',
+            dest)
+
+    def close(self):
+        """
+        ask exiftool to exit and wait for it
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.write(b'-stay_open\nFalse\n')
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            pass
+        try:
+            self.process.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.communicate()
+        self.process = None
+
+    @staticmethod
+    def _read_until(stream, sentinel):
+        # read from stream until the output ends with sentinel on a line of
+        # its own and return what came before it
+        end = '{}\n'.format(sentinel).encode('utf-8')
+        data = bytearray()
+        while not (data == end or data.endswith(b'\n' + end)):
+            chunk = os.read(stream.fileno(), READ_SIZE)
+            if chunk == b'':
+                raise EOFError('no {} from exiftool'.format(sentinel))
+            data.extend(chunk)
+        return bytes(data[:-len(end)])
+
+
+class ExifToolPool():
+    """
+    size ExifTool processes (default one per CPU) shared by any number of
+    threads: each command is run by whichever process is free, and map()
+    runs many commands on all of them at once
+
+    It has the methods of ExifTool. A process that stops unexpectedly is
+    replaced before the next command.
+    """
+
+    def __init__(self, size=None, executable=EXIFTOOL):
+        self.size = size or os.cpu_count() or 1
+        self.executable = executable
+        self.idle = queue.Queue()
+        self.closed = False
+        for i in range(self.size):
+            try:
+                self.idle.put(ExifTool(executable))
+            except ExifToolError:
+                while not self.idle.empty():
+                    self.idle.get().close()
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, *args):
+        return self._run(ExifTool.execute, *args)
+
+    def extract(self, path):
+        return self._run(ExifTool.extract, path)
+
+    def report(self, path):
+        return self._run(ExifTool.report, path)
+
+    def read_tags(self, *paths):
+        return self._run(ExifTool.read_tags, *paths)
+
+    def write_tags(self, path, **tags):
+        return self._run(ExifTool.write_tags, path, **tags)
+
+    def copy_tags(self, src, dest):
+        return self._run(ExifTool.copy_tags, src, dest)
+
+    def map(self, func, *iterables):
+        """
+        return a list of the results of func(exiftool, *items) for the
+        items of iterables, in order, run on all the processes at once;
+        func is an ExifTool method, such as ExifTool.extract, or a function
+        taking an ExifTool as its first argument
+        """
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            futures = [
+                executor.submit(self._run, func, *items)
+                for items in zip(*iterables)]
+        return [f.result() for f in futures]
+
+    def close(self):
+        """
+        wait for the commands being run to finish and close every process
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for i in range(self.size):
+            self.idle.get().close()
+
+    def _run(self, func, *args, **kwargs):
+        if self.closed:
+            raise ExifToolError('exiftool pool has been closed')
+        exiftool = self.idle.get()
+        try:
+            return func(exiftool, *args, **kwargs)
+        finally:
+            if exiftool.process is None:
+                try:
+                    exiftool = ExifTool(self.executable)
+                except ExifToolError as e:
+                    logging.getLogger(__name__).error(
+                        'cannot restart exiftool: {}'.format(e))
+            self.idle.put(exiftool)
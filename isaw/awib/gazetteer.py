@@ -0,0 +1,258 @@
+"""
+Look up places in the Pleiades and GeoNames gazetteers over pooled,
+keep-alive HTTP connections
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import re
+import requests
+from requests.adapters import HTTPAdapter
+import sqlite3
+from threading import Lock
+import time
+from urllib3.util.retry import Retry
+
+GEONAMES_API = 'http://api.geonames.org'
+DEFAULT_TIMEOUT = (5, 30)  # seconds to connect, seconds to read
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 8
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_TTL = 30 * 24 * 60 * 60  # seconds
+DEFAULT_MAX_ENTRIES = 100000
+# decimal places of latitude and longitude used for nearby-place lookups;
+# 3 places is about 110 m, so photographs taken close together share a result
+DEFAULT_LATLON_PRECISION = 3
+RX_GEONAMES = re.compile(
+    r'^https?:\/\/(www|sws)\.geonames\.org\/(?P<geoid>\d+)(|\/|\/.*)$')
+RX_PLEIADES = re.compile(r'^https?:\/\/pleiades\.stoa\.org\/places\/')
+
+
+class GazetteerError(Exception):
+    pass
+
+
+def pleiades_urls(url):
+    """
+    return (json url, place url) for a Pleiades place url or its json url
+    """
+    if url.endswith('/json'):
+        return (url, '/'.join(url.split('/')[:-1]))
+    else:
+        return ('{}/json'.format(url), url)
+
+
+class ResponseCache():
+    """
+    persistent SQLite store of gazetteer JSON responses
+
+    Entries older than ttl seconds are stale; once there are more than
+    max_entries, the least recently used are evicted.
+    """
+
+    def __init__(
+            self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = Lock()
+        # shared by the threads of GazetteerClient.resolve_many, under _lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, body TEXT, fetched REAL, accessed REAL)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed '
+            'ON responses (accessed)')
+        self.connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, key, stale=False):
+        """
+        return the cached JSON text for key, or None if there is none or it
+        has expired (unless stale is True)
+        """
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT body, fetched FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is None or (not stale and now - row[1] > self.ttl):
+                return None
+            self.connection.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+        return row[0]
+
+    def put(self, key, body):
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, body, now, now))
+            count = self.connection.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM responses WHERE key IN ('
+                    'SELECT key FROM responses ORDER BY accessed LIMIT ?)',
+                    (count - self.max_entries,))
+            self.connection.commit()
+
+    def expire(self):
+        """
+        delete all stale entries
+        """
+        with self._lock:
+            self.connection.execute(
+                'DELETE FROM responses WHERE fetched < ?',
+                (time.time() - self.ttl,))
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class GazetteerClient():
+    """
+    HTTP client for gazetteer lookups
+
+    All requests share one requests.Session, so connections are kept alive
+    and reused. Every request has a timeout, and connection failures and
+    transient server errors are retried with exponential backoff.
+
+    Responses are kept in memory for the life of the client and, if cache
+    is a ResponseCache, on disk. In offline mode only cached responses
+    (however old) are used.
+    """
+
+    def __init__(
+            self, geonames_user='', timeout=DEFAULT_TIMEOUT,
+            retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+            pool_size=DEFAULT_POOL_SIZE, geonames_api=GEONAMES_API,
+            cache=None, offline=False,
+            latlon_precision=DEFAULT_LATLON_PRECISION):
+        self.geonames_user = geonames_user
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.geonames_api = geonames_api
+        self.cache = cache
+        self.offline = offline
+        self.latlon_precision = latlon_precision
+        self.responses = {}
+        self.logger = logging.getLogger(__name__)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def get_json(self, url):
+        """
+        return the parsed JSON at url, or None if the server does not answer
+        with status 200; raises GazetteerError if no answer can be had
+        """
+        key = self.safe_url(url)
+        try:
+            return self.responses[key]
+        except KeyError:
+            pass
+        body = None
+        if self.cache is not None:
+            body = self.cache.get(key, stale=self.offline)
+        if body is None:
+            if self.offline:
+                raise GazetteerError(
+                    'offline and no cached response for {}'.format(key))
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                raise GazetteerError(
+                    'request for {} failed: {}'.format(key, e))
+            if r.status_code != 200:
+                self.logger.warning(
+                    'HTTP status {} for {}'.format(r.status_code, key))
+                return None
+            body = r.text
+            if self.cache is not None:
+                self.cache.put(key, body)
+        j = json.loads(body)
+        self.responses[key] = j
+        return j
+
+    def json_url(self, url):
+        """
+        return the url of the JSON for a Pleiades or GeoNames place url
+        """
+        if RX_PLEIADES.match(url):
+            return pleiades_urls(url)[0]
+        m = RX_GEONAMES.match(url)
+        if m is not None:
+            return self.geonames_url(m.group('geoid'))
+        raise NotImplementedError(
+            'no support for gazetteer url {}'.format(url))
+
+    def geonames_url(self, geoid):
+        return '&'.join([
+            '{}/getJSON?geonameId={}'.format(self.geonames_api, geoid),
+            'username={}'.format(self.geonames_user),
+            'style=full'])
+
+    def geonames_nearby_url(self, lat, lon):
+        """
+        coordinates are rounded to latlon_precision decimal places, so that
+        nearby points make the same request and share its cached response
+        """
+        lat, lon = ['{:.{}f}'.format(float(c), self.latlon_precision)
+                    for c in (lat, lon)]
+        return '&'.join([
+            '{}/findNearbyJSON?lat={}'.format(self.geonames_api, lat),
+            'lng={}'.format(lon),
+            'username={}'.format(self.geonames_user),
+            'style=full'])
+
+    def resolve_many(self, urls):
+        """
+        fetch the JSON for many place urls at once on a thread pool and
+        return a dictionary mapping each url to its JSON (None for urls that
+        could not be resolved)
+        """
+        urls = list(dict.fromkeys(urls))
+
+        def resolve(url):
+            try:
+                return self.get_json(self.json_url(url))
+            except (GazetteerError, NotImplementedError) as e:
+                self.logger.warning(str(e))
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            return dict(zip(urls, executor.map(resolve, urls)))
+
+    @staticmethod
+    def safe_url(url):
+        return '&'.join([p for p in url.split('&') if 'username' not in p])
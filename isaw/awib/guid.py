@@ -0,0 +1,67 @@
+"""
+Make GUIDs for AWIB image packages and assign them
+"""
+
+from isaw.awib.metadata import read_metadata, set_value, write_metadata
+import logging
+from lxml import etree
+from os.path import join, realpath
+from slugify import slugify
+import uuid
+
+DEFAULT_HOSTNAME = 'images.isaw.nyu.edu'
+
+
+def make_guid(name, hostname=DEFAULT_HOSTNAME):
+    """
+    return the UUID of the image called name, made from its URL on hostname
+    """
+    logger = logging.getLogger(__name__)
+    logger.debug('raw name: "{}"'.format(name))
+    name = 'https://{}/{}'.format(hostname, name)
+    logger.debug('full name: "{}"'.format(name))
+    guid = uuid.uuid5(uuid.NAMESPACE_URL, name)
+    logger.debug('guid: "{}"'.format(guid))
+    return guid
+
+
+def package_guid(pkg_path, name='', hostname=DEFAULT_HOSTNAME):
+    """
+    return the GUID of the package at pkg_path, made from name or, if it is
+    empty, from the iptc_name in its metadata.xml
+    """
+    return _package_guid(realpath(pkg_path), name, hostname)[0]
+
+
+def assign_guid(
+        pkg_path, exiftool, name='', hostname=DEFAULT_HOSTNAME,
+        agent='script'):
+    """
+    make the GUID of the package at pkg_path (as package_guid does), write it
+    to the DigitalImageGUID tag of its master.tif with exiftool, an
+    isaw.awib.exiftool ExifTool or ExifToolPool, and to its metadata.xml,
+    and return it
+    """
+    pkg_path = realpath(pkg_path)
+    guid, meta = _package_guid(pkg_path, name, hostname)
+    exiftool.write_tags(
+        join(pkg_path, 'master.tif'), DigitalImageGUID=guid.urn)
+    metapath = join(pkg_path, 'metadata.xml')
+    if meta is None:
+        meta = read_metadata(metapath)
+    set_value(meta, 'guid', guid.urn, agent)
+    write_metadata(meta, metapath)
+    return guid
+
+
+def _package_guid(pkg_path, name, hostname):
+    # the GUID and, if it had to be read for the name, the metadata tree
+    meta = None
+    if name != '':
+        name = slugify(name.lower())
+    else:
+        meta = read_metadata(join(pkg_path, 'metadata.xml'))
+        name = ' '.join(etree.tostring(
+            meta.xpath('//iptc_name')[0], method='text',
+            encoding='unicode').split())
+    return make_guid(name, hostname), meta
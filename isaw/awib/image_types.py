@@ -47,7 +47,8 @@ IMAGETYPES = {
         'mimetype': 'image/jp2',
         'description': 'JPEG-2000 File Format',
         'write': True,
-        'extensions': ['jp2']},
+        'extensions': ['jp2', 'jpf', 'jpx'],
+        'write_extension': 'jp2'},
     'JPEG': {
         'mimetype': 'image/jpeg',
         'description': 'JPEG - JFIF Compliant',
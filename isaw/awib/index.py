@@ -0,0 +1,261 @@
+"""
+Keep a SQLite index of the packages in a collection, so that they can be
+found by GUID, name, status or checksum without reading every metadata.xml
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from io import BytesIO
+from isaw.awib.checksums import read_sidecar
+from isaw.awib.conversions import open_trusted, PROFILE_CACHE
+from isaw.awib.validate import find_packages
+import logging
+from lxml import etree
+import os
+from os.path import abspath, join
+from PIL.ImageCms import getOpenProfile, getProfileDescription, PyCMSError
+import sqlite3
+import time
+
+# package files whose changes are indexed; the package directory itself is
+# also checked, so that added and removed files are noticed
+WATCHED_FILES = [
+    'master.sha512',
+    'master.tif',
+    'metadata.sha512',
+    'metadata.xml',
+    'original.sha512']
+# columns of the packages table that find() can match
+COLUMNS = [
+    'path', 'collection', 'iptc_name', 'guid', 'status', 'width', 'height',
+    'profile', 'mtime_ns', 'indexed']
+CHUNK_SIZE = 16  # packages sent to each worker at a time by update()
+
+
+def package_mtime(path):
+    """
+    return the latest modification time (ns) of package directory path and
+    the WATCHED_FILES in it
+    """
+    mtime = os.stat(path).st_mtime_ns
+    for fn in WATCHED_FILES:
+        try:
+            mtime = max(mtime, os.stat(join(path, fn)).st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    return mtime
+
+
+def read_package(path):
+    """
+    return a dictionary of the indexed values of package directory path,
+    with the sha512 of each file that has a .sha512 sidecar in 'checksums'
+    """
+    record = {
+        'path': path,
+        'iptc_name': None,
+        'guid': None,
+        'status': None,
+        'width': None,
+        'height': None,
+        'profile': None,
+        'mtime_ns': package_mtime(path),
+        'checksums': {}}
+    try:
+        meta = etree.parse(join(path, 'metadata.xml'))
+    except (OSError, etree.XMLSyntaxError) as e:
+        logging.getLogger(__name__).warning(
+            'cannot read metadata.xml in {}: {}'.format(path, e))
+    else:
+        for k in ('iptc_name', 'guid', 'status'):
+            record[k] = _get_text(meta, k)
+    try:
+        # only the header is read, so the size of the master is no risk
+        with open_trusted(join(path, 'master.tif')) as im:
+            record['width'], record['height'] = im.size
+            record['profile'] = _profile_description(
+                im.info.get('icc_profile'))
+    except OSError as e:
+        logging.getLogger(__name__).warning(
+            'cannot read master.tif in {}: {}'.format(path, e))
+    for entry in os.scandir(path):
+        if entry.name.endswith('.sha512'):
+            fn = entry.name[:-len('.sha512')]
+            try:
+                record['checksums'][fn] = read_sidecar(entry.path)
+            except (OSError, IndexError):
+                pass
+    return record
+
+
+class PackageIndex():
+    """
+    SQLite index of packages: their path, collection, iptc_name, guid,
+    status, master dimensions and ICC profile, and the checksums recorded
+    in their .sha512 files
+
+    update() only reads packages that are new or whose WATCHED_FILES have
+    changed since they were last indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS packages ('
+            'path TEXT PRIMARY KEY, collection TEXT, iptc_name TEXT, '
+            'guid TEXT, status TEXT, width INTEGER, height INTEGER, '
+            'profile TEXT, mtime_ns INTEGER, indexed REAL)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checksums ('
+            'package TEXT, filename TEXT, sha512 TEXT, '
+            'PRIMARY KEY (package, filename))')
+        for table, column in [
+                ('packages', 'collection'),
+                ('packages', 'iptc_name'),
+                ('packages', 'guid'),
+                ('packages', 'status'),
+                ('checksums', 'sha512')]:
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1})'.format(
+                    table, column))
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM packages').fetchone()[0]
+
+    def update(self, collection, jobs=1):
+        """
+        index the new and changed packages in directory collection, using
+        jobs worker processes, and drop those that are gone; return a
+        dictionary counting the packages added, updated, removed and
+        unchanged
+        """
+        collection = abspath(collection)
+        known = {
+            row['path']: row['mtime_ns'] for row in self.connection.execute(
+                'SELECT path, mtime_ns FROM packages WHERE collection = ?',
+                (collection,))}
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        changed = []
+        for path in find_packages(collection):
+            if path not in known:
+                counts['added'] += 1
+                changed.append(path)
+            elif package_mtime(path) != known[path]:
+                counts['updated'] += 1
+                changed.append(path)
+            else:
+                counts['unchanged'] += 1
+            known.pop(path, None)
+        if jobs <= 1:
+            records = map(read_package, changed)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            records = executor.map(read_package, changed, chunksize=CHUNK_SIZE)
+        try:
+            with self.connection:
+                for record in records:
+                    self._put(collection, record)
+                for path in known:
+                    self._delete(path)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        counts['removed'] = len(known)
+        return counts
+
+    def get(self, path):
+        """
+        return the record for package directory path, or None
+        """
+        results = self.find(path=abspath(path))
+        return results[0] if len(results) > 0 else None
+
+    def find(self, **criteria):
+        """
+        return a list of the records of packages whose COLUMNS have the
+        values given, such as find(status='draft'); each record is a
+        dictionary like read_package returns
+        """
+        for k in criteria:
+            if k not in COLUMNS:
+                raise ValueError('cannot search packages by {}'.format(k))
+        sql = 'SELECT * FROM packages'
+        if len(criteria) > 0:
+            sql += ' WHERE ' + ' AND '.join(
+                ['{} = ?'.format(k) for k in sorted(criteria)])
+        rows = self.connection.execute(
+            sql + ' ORDER BY path',
+            [criteria[k] for k in sorted(criteria)])
+        return [self._record(row) for row in rows]
+
+    def find_checksum(self, sha512):
+        """
+        return a list of the records of packages with a file whose sha512 is
+        sha512
+        """
+        rows = self.connection.execute(
+            'SELECT packages.* FROM packages JOIN checksums '
+            'ON packages.path = checksums.package '
+            'WHERE checksums.sha512 = ? ORDER BY path', (sha512,))
+        return [self._record(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+    def _put(self, collection, record):
+        self._delete(record['path'])
+        self.connection.execute(
+            'INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (record['path'], collection, record['iptc_name'],
+                record['guid'], record['status'], record['width'],
+                record['height'], record['profile'], record['mtime_ns'],
+                time.time()))
+        self.connection.executemany(
+            'INSERT INTO checksums VALUES (?, ?, ?)',
+            [(record['path'], fn, sha512)
+                for fn, sha512 in sorted(record['checksums'].items())])
+
+    def _delete(self, path):
+        self.connection.execute('DELETE FROM packages WHERE path = ?', (path,))
+        self.connection.execute(
+            'DELETE FROM checksums WHERE package = ?', (path,))
+
+    def _record(self, row):
+        record = dict(row)
+        record['checksums'] = {
+            fn: sha512 for fn, sha512 in self.connection.execute(
+                'SELECT filename, sha512 FROM checksums WHERE package = ?',
+                (record['path'],))}
+        return record
+
+
+def _get_text(tree, tag):
+    # normalized text of the first element named tag, or None if there is
+    # none or it is empty
+    elements = tree.xpath('//{}'.format(tag))
+    if len(elements) == 0:
+        return None
+    text = ' '.join(''.join(elements[0].itertext()).split())
+    return text or None
+
+
+def _profile_description(raw):
+    if raw is None:
+        return None
+    try:
+        profile = PROFILE_CACHE.get(
+            sha1(raw).hexdigest(), lambda: getOpenProfile(BytesIO(raw)))
+        return getProfileDescription(profile).strip()
+    except PyCMSError:
+        return None
@@ -0,0 +1,345 @@
+"""
+Make and update metadata.xml files in Python, as the XSLT stylesheets in
+scripts/ (exiftool2meta.xsl, update_metadata.xsl and setmetaval.xsl) do,
+without starting a Java process for each one
+"""
+
+from datetime import datetime
+from lxml import etree
+import logging
+import os
+from os.path import dirname
+import tempfile
+
+IPTC_NAME_PREFIX = 'isawi'
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+FILE = 'http://ns.exiftool.ca/File/1.0/'
+SYSTEM = 'http://ns.exiftool.ca/File/System/1.0/'
+IFD0 = 'http://ns.exiftool.ca/EXIF/IFD0/1.0/'
+EXIF_IFD = 'http://ns.exiftool.ca/EXIF/ExifIFD/1.0/'
+GPS = 'http://ns.exiftool.ca/EXIF/GPS/1.0/'
+COMPOSITE = 'http://ns.exiftool.ca/Composite/1.0/'
+# JHOVE 1.14 and earlier, and later versions
+JHOVE = [
+    'http://hul.harvard.edu/ois/xml/ns/jhove',
+    'http://schema.openpreservation.org/ois/xml/ns/jhove']
+# exiftool tags copied into the original info section, by the name of the
+# element they become
+ORIGINAL_TAGS = {
+    '{{{}}}FileType'.format(FILE): 'file_type',
+    '{{{}}}ImageWidth'.format(FILE): 'width',
+    '{{{}}}ImageHeight'.format(FILE): 'height',
+    '{{{}}}Orientation'.format(IFD0): 'orientation'}
+GPS_TAGS = {
+    '{{{}}}GPSLatitude'.format(COMPOSITE): 'latitude',
+    '{{{}}}GPSLongitude'.format(COMPOSITE): 'longitude',
+    '{{{}}}GPSAltitude'.format(COMPOSITE): 'altitude',
+    '{{{}}}GPSHPositioningError'.format(GPS): 'error'}
+SKELETON = """
+<image-info>
+    <iptc_name/>
+    <guid/>
+    <status>draft</status>
+    <license-release-verified>no</license-release-verified>
+    <isaw-publish-cleared>no</isaw-publish-cleared>
+    <review-notes/>
+    <image-files>
+        <image type="original" href="original.jpg"/>
+        <image type="master" href="master.tif"/>
+    </image-files>
+    <info type="original"/>
+    <info type="isaw">
+        <title/>
+        <photographer>
+            <first-name/>
+            <last-name/>
+            <orcid/>
+        </photographer>
+        <authority/>
+        <description/>
+        <date-photographed/>
+        <date-scanned/>
+        <copyright-holder/>
+        <copyright-date/>
+        <copyright-contact/>
+        <license/>
+        <orientation/>
+        <width/>
+        <height/>
+        <source-url href=""/>
+        <dissemination-urls/>
+        <geography>
+            <photographed-place/>
+            <find-place/>
+            <original-place/>
+        </geography>
+        <chronology/>
+        <prosopography/>
+        <typology/>
+        <notes/>
+    </info>
+    <change-history/>
+</image-info>
+"""
+PARSER = etree.XMLParser(remove_blank_text=True)
+
+
+def make_metadata(
+        exiftool, jhove=None, agent='script', iptc_name='',
+        iptc_name_prefix=IPTC_NAME_PREFIX, original_fn='original.jpg',
+        now=None):
+    """
+    return a new metadata.xml tree for an original from its exiftool report
+    (made with -X; a path or a tree) and, optionally, its jhove report, as
+    exiftool2meta.xsl does
+
+    If iptc_name is empty, one is made from iptc_name_prefix and the time.
+    now (an aware datetime; default the current time) is recorded as the
+    date of the change.
+    """
+    now = _now(now)
+    exiftool = _parse(exiftool)
+    meta = etree.fromstring(SKELETON, PARSER).getroottree()
+    if iptc_name == '':
+        iptc_name = '{}-{}{:04d}'.format(
+            iptc_name_prefix, now.strftime('%Y%m%d%H%M%S'),
+            now.microsecond // 100)
+    meta.find('iptc_name').text = iptc_name
+    meta.find("image-files/image[@type='original']").set('href', original_fn)
+    info = meta.find("info[@type='original']")
+    info.extend(_original_info(exiftool))
+    if jhove is not None:
+        try:
+            jhove = _parse(jhove)
+        except (OSError, etree.XMLSyntaxError) as e:
+            logging.getLogger(__name__).warning(
+                'cannot read jhove report: {}'.format(e))
+        else:
+            info.extend(_jhove_info(jhove.getroot()))
+    filenames = list(
+        exiftool.getroot().iter('{{{}}}FileName'.format(SYSTEM)))
+    _record_change(
+        meta, agent, now,
+        'Metadata file created from embedded metadata extracted from {} '
+        'using isaw.awib.metadata.'.format(
+            _text(filenames[0]) if len(filenames) > 0 else ''))
+    return meta
+
+
+def update_metadata(meta, operator='script', now=None):
+    """
+    bring metadata tree meta (an old-style metadata.xml) up to date in
+    place, as update_metadata.xsl does: image-files lists original and
+    master first, images from outside the package become old-* images,
+    thumbnail and review images are dropped, Pleiades URIs use https, text
+    is normalized, and the change history is sorted newest first
+    """
+    root = meta.getroot()
+    for element in root.iter():
+        if not isinstance(element.tag, str):
+            continue
+        element.text = _normalize(element.text)
+        element.tail = _normalize(element.tail)
+    for comment in root.xpath('//comment() | //processing-instruction()'):
+        comment.getparent().remove(comment)
+    for image_files in root.iter('image-files'):
+        originals = image_files.xpath("image[@type = 'original'][1]")
+        extension = ''
+        if len(originals) > 0:
+            extension = originals[0].get('href', '').split('.')[-1]
+        images = [
+            image for image in image_files.findall('image')
+            if image.get('type') not in (None, 'thumbnail', 'review')]
+        for image in images:
+            href = image.get('href', '')
+            if href.startswith('../'):
+                attributes = {
+                    'type': 'old-{}'.format(image.get('type')),
+                    'href': 'old_{}.{}'.format(
+                        image.get('type'), href.split('.')[-1])}
+                image.attrib.clear()
+                image.attrib.update(attributes)
+        for child in list(image_files):
+            image_files.remove(child)
+        etree.SubElement(
+            image_files, 'image', type='original',
+            href='original.{}'.format(extension))
+        etree.SubElement(
+            image_files, 'image', type='master', href='master.tif')
+        image_files.extend(images)
+    for uri in root.iter('uri'):
+        text = ' '.join(''.join(uri.itertext()).split())
+        if text.startswith('http://pleiades.stoa.org'):
+            for child in list(uri):
+                uri.remove(child)
+            uri.text = 'https:' + text[len('http:'):]
+    for change_history in root.iter('change-history'):
+        changes = sorted(
+            list(change_history),
+            key=lambda c: (c.findtext('date') or '')[:10], reverse=True)
+        for change in changes:
+            change_history.append(change)
+    _record_change(
+        meta, operator, _now(now),
+        'This metadata file was updated using isaw.awib.metadata.')
+    return meta
+
+
+def set_value(meta, target, value, agent='script', now=None):
+    """
+    set the content of every element named target in metadata tree meta,
+    except in the original info section, to value and record the change,
+    as setmetaval.xsl does
+    """
+    for element in meta.xpath(
+            "//*[local-name() = $target and "
+            "not(ancestor::info[@type = 'original'])]", target=target):
+        for child in list(element):
+            element.remove(child)
+        element.text = value
+    _record_change(
+        meta, agent, _now(now),
+        'Set value of "{}" to "{}" using isaw.awib.metadata.'.format(
+            target, value))
+    return meta
+
+
+def read_metadata(path):
+    """
+    parse the metadata.xml file at path, ignoring indentation
+    """
+    return etree.parse(path, PARSER)
+
+
+def write_metadata(meta, path):
+    """
+    write metadata tree meta to path, replacing any file there atomically
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname(os.path.abspath(path)), prefix='.metadata',
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(etree.tostring(
+                meta, pretty_print=True, xml_declaration=True,
+                encoding='UTF-8'))
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _original_info(exiftool):
+    # the elements of the original info section, in the order of the tags
+    # they come from in the exiftool report
+    root = exiftool.getroot()
+    photo = any([
+        _text(e) == 'Directly photographed'
+        for e in root.iter('{{{}}}SceneType'.format(EXIF_IFD))])
+    gps_date = root.find('.//{{{}}}GPSDateTime'.format(COMPOSITE)) is not None
+    gps = list(root.iter('{{{}}}*'.format(GPS)))
+    elements = []
+    for tag in _rdf_children(root):
+        name = ORIGINAL_TAGS.get(tag.tag)
+        if name is not None:
+            elements.append(_element(name, _text(tag)))
+        elif tag.tag == '{{{}}}GPSDateTime'.format(COMPOSITE):
+            elements.append(
+                _element('date-photographed', _text(tag), source='gps'))
+        elif tag.tag == '{{{}}}CreateDate'.format(EXIF_IFD):
+            if not photo:
+                elements.append(
+                    _element('date-scanned', _text(tag), source='exif'))
+            elif not gps_date:
+                elements.append(
+                    _element('date-photographed', _text(tag), source='exif'))
+        elif len(gps) > 0 and tag is gps[0]:
+            elements.append(_gps_data(root, gps))
+    return elements
+
+
+def _gps_data(root, gps):
+    gps_data = etree.Element('gps-data')
+    composite = [
+        e for e in root.iter('{{{}}}*'.format(COMPOSITE))
+        if etree.QName(e).localname.startswith('GPS')]
+    for tag in composite + gps:
+        name = GPS_TAGS.get(tag.tag)
+        if name is not None:
+            gps_data.append(_element(name, _text(tag)))
+        elif tag.tag == '{{{}}}GPSImgDirection'.format(GPS):
+            ref = tag.getparent().find(
+                '{{{}}}GPSImgDirectionRef'.format(GPS))
+            gps_data.append(_element(
+                'bearing', '{} {}'.format(
+                    _text(tag), '' if ref is None else _text(ref))))
+    return gps_data
+
+
+def _jhove_info(element):
+    elements = []
+    namespace = etree.QName(element).namespace
+    if namespace not in JHOVE:
+        return elements
+    name = etree.QName(element).localname
+    if name in ('jhove', 'repInfo'):
+        for child in element:
+            if isinstance(child.tag, str):
+                elements.extend(_jhove_info(child))
+    elif name in ('format', 'status'):
+        elements.append(_element('jhove-{}'.format(name), _text(element)))
+    return elements
+
+
+def _rdf_children(element):
+    # the elements in and below element that the stylesheet reaches through
+    # rdf elements
+    if etree.QName(element).namespace != RDF:
+        return
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue
+        if etree.QName(child).namespace == RDF:
+            yield from _rdf_children(child)
+        else:
+            yield child
+
+
+def _record_change(meta, agent, now, description):
+    change = etree.Element('change')
+    change.append(_element('date', now.isoformat()))
+    change.append(_element('agent', agent))
+    change.append(_element('description', description))
+    for change_history in meta.getroot().iter('change-history'):
+        change_history.insert(0, change)
+        change = etree.fromstring(etree.tostring(change))
+
+
+def _element(name, text, **attributes):
+    element = etree.Element(name, **attributes)
+    element.text = text
+    return element
+
+
+def _normalize(text):
+    if text is None:
+        return None
+    return ' '.join(text.split()) or None
+
+
+def _now(now):
+    return datetime.now().astimezone() if now is None else now
+
+
+def _parse(source):
+    if isinstance(source, etree._ElementTree):
+        return source
+    return etree.parse(source, PARSER)
+
+
+def _text(element):
+    return ''.join(element.itertext())
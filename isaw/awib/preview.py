@@ -0,0 +1,164 @@
+"""
+Decode small versions of originals cheaply, for identification, duplicate
+detection and thumbnail previews
+"""
+
+from hashlib import sha1
+from io import BytesIO
+from isaw.awib.conversions import (DEFAULT_PROFILE, get_profile,
+                                   open_trusted, PROFILE_CACHE,
+                                   TRANSFORM_CACHE)
+from isaw.awib.streaming import seek_level
+import logging
+from PIL import Image
+from PIL.ImageCms import (applyTransform, buildTransform, getOpenProfile,
+                          INTENT_PERCEPTUAL, PyCMSError)
+
+# reductions that JPEG and JPEG 2000 decoders can make while decoding
+SCALES = (1, 2, 4, 8)
+PREVIEW_SIZE = 512  # pixels on the longer side
+PREVIEW_PROFILE = 'sRGB2014'
+
+
+def reduction(size, target):
+    """
+    return the largest of SCALES by which an image of size can be reduced
+    and still be at least target (width, height)
+    """
+    for scale in reversed(SCALES):
+        if all([(s + scale // 2) // scale >= t for s, t in zip(size, target)]):
+            return scale
+    return 1
+
+
+def open_reduced(src, size=None, scale=None, trusted=False):
+    """
+    open src, a filename, so that it will be decoded at 1/scale of its full
+    size or, if scale is None, at the smallest reduction that is at least
+    size (width, height); scale is one of SCALES. A trusted src, such as a
+    package's original, is opened without Pillow's decompression bomb limit
+    (see isaw.awib.conversions.open_trusted).
+
+    JPEGs are decoded at reduced scale (Image.draft), JPEG 2000 images
+    discard resolution levels, and TIFFs written with a pyramid are opened
+    at the smallest large enough level; other images decode at full size.
+    The image is returned unloaded (see load_reduced).
+    """
+    im = _open(src, trusted)
+    if scale is None:
+        scale = 1 if size is None else reduction(im.size, size)
+    if scale not in SCALES:
+        raise ValueError('unsupported scale: {}'.format(scale))
+    while scale > min(im.size):
+        scale //= 2
+    if scale == 1:
+        return im
+    reduced = tuple([max(1, s // scale) for s in im.size])
+    if im.format == 'JPEG':
+        im.draft(im.mode, reduced)
+    elif im.format == 'JPEG2000':
+        im.reduce = scale.bit_length() - 1
+        # the decoder makes each side ceil(side / scale) pixels, but Pillow
+        # rounds to nearest when it works out the size to expect, so decoding
+        # fails unless the sides it rounds are whole multiples of scale
+        im._size = tuple([-(-s // scale) * scale for s in im.size])
+    elif im.format == 'TIFF':
+        im = seek_level(im, reduced)
+    return im
+
+
+def load_reduced(src, size=None, scale=None, trusted=False):
+    """
+    return src opened with open_reduced and loaded; a JPEG 2000 image that
+    cannot be decoded at that reduction, because it has fewer resolution
+    levels than asked for, is decoded at the next larger one that it can
+    """
+    im = open_reduced(src, size, scale, trusted)
+    while True:
+        try:
+            im.load()
+            return im
+        except (OSError, ValueError):
+            if im.format != 'JPEG2000' or not im.reduce:
+                raise
+            scale = 1 << (im.reduce - 1)
+            im.close()
+            im = open_reduced(src, scale=scale, trusted=trusted)
+
+
+def preview(
+        src, max_size=PREVIEW_SIZE, scale=None, profile=PREVIEW_PROFILE,
+        trusted=False):
+    """
+    return a small RGB version of src, a filename, no larger than max_size
+    pixels on its longer side, converted to the bundled ICC profile profile;
+    trusted is as for open_reduced
+
+    It is decoded at the smallest reduction that is still large enough (see
+    open_reduced and load_reduced) and then resized. If max_size is None it
+    is decoded at 1/scale of its full size and not resized. Images without
+    an embedded profile are taken to be sRGB, as by MasterMaker.
+    """
+    if max_size is None:
+        im = load_reduced(src, scale=scale or 1, trusted=trusted)
+        target = None
+    else:
+        with _open(src, trusted) as full:
+            ratio = min(1.0, max_size / max(full.size))
+            target = tuple([max(1, round(s * ratio)) for s in full.size])
+        im = load_reduced(src, target, scale, trusted)
+    icc_profile = im.info.get('icc_profile')
+    if im.mode != 'CMYK' or icc_profile is None:
+        im = _to_rgb(im)
+    if target is not None and im.size != target:
+        im = im.resize(target, Image.LANCZOS, reducing_gap=2.0)
+    return normalize_profile(im, icc_profile, profile)
+
+
+def normalize_profile(im, icc_profile, profile=PREVIEW_PROFILE):
+    """
+    return im, an RGB or CMYK image with the ICC profile icc_profile
+    (bytes, or None for sRGB), converted to RGB in the bundled ICC profile
+    profile and carrying it
+    """
+    target = get_profile(profile)
+    if icc_profile is None:
+        key = DEFAULT_PROFILE
+        source = get_profile(DEFAULT_PROFILE)
+    else:
+        key = sha1(icc_profile).hexdigest()
+        source = PROFILE_CACHE.get(
+            key, lambda: getOpenProfile(BytesIO(icc_profile)))
+    try:
+        tx = TRANSFORM_CACHE.get(
+            (key, im.mode, profile),
+            lambda: buildTransform(
+                source, target, im.mode, 'RGB',
+                renderingIntent=INTENT_PERCEPTUAL))
+    except PyCMSError as e:
+        # such as a grayscale or CMYK profile left on pixels now RGB
+        logging.getLogger(__name__).warning(
+            'cannot convert from embedded profile, assuming {}: {}'.format(
+                profile, e))
+        im = _to_rgb(im)
+    else:
+        im = applyTransform(im, tx)
+    im.info['icc_profile'] = target.tobytes()
+    return im
+
+
+def _to_rgb(im):
+    # 16- and 32-bit grayscale are scaled to 8 bits rather than clipped
+    if im.mode in ('I;16', 'I;16B', 'I;16L', 'I;16N'):
+        im = im.convert('I').point(lambda i: i * (1 / 256))
+    elif im.mode == 'I':
+        im = im.point(lambda i: i * (1 / 65536))
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    return im
+
+
+def _open(src, trusted):
+    if trusted:
+        return open_trusted(src)
+    return Image.open(src)
@@ -0,0 +1,561 @@
+from fractions import Fraction
+from io import BytesIO
+import logging
+import mmap
+from os import remove
+from PIL import Image
+from PIL.TiffImagePlugin import COMPRESSION_INFO_REV
+from struct import pack, unpack
+
+# Pillow keeps every pixel of an RGB image in four bytes
+BYTES_PER_PIXEL = 4
+DEFAULT_BAND_SIZE = 64 * 1024 * 1024
+STRIP_SIZE = 64 * 1024
+MAX_CLASSIC_TIFF_OFFSET = 2 ** 32 - 1
+# room left for the IFD and ICC profile when deciding whether a master
+# needs to be a BigTIFF
+BIGTIFF_MARGIN = 16 * 1024 * 1024
+# pyramids are halved until the longer side is at most this many pixels
+PYRAMID_MIN_SIZE = 256
+
+# lossless compressions for masters, by our name and Pillow's; zstd and lzma
+# are only available if libtiff was built with them
+COMPRESSIONS = {
+    'lzw': 'tiff_lzw',
+    'deflate': 'tiff_deflate',
+    'adobe_deflate': 'tiff_adobe_deflate',
+    'zstd': 'zstd',
+    'lzma': 'lzma',
+    'packbits': 'packbits'}
+# compressions that work better on horizontally differenced samples
+PREDICTOR_COMPRESSIONS = ('lzw', 'deflate', 'adobe_deflate', 'zstd', 'lzma')
+NO_PREDICTOR = 1
+HORIZONTAL_PREDICTOR = 2
+
+# TIFF tag numbers and field types used by TiffWriter
+NEWSUBFILETYPE = 254
+REDUCED_RESOLUTION = 1
+IMAGEWIDTH = 256
+IMAGELENGTH = 257
+BITSPERSAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC_INTERPRETATION = 262
+STRIPOFFSETS = 273
+SAMPLESPERPIXEL = 277
+ROWSPERSTRIP = 278
+STRIPBYTECOUNTS = 279
+X_RESOLUTION = 282
+Y_RESOLUTION = 283
+PLANAR_CONFIGURATION = 284
+RESOLUTION_UNIT = 296
+PREDICTOR = 317
+TILEWIDTH = 322
+TILELENGTH = 323
+TILEOFFSETS = 324
+TILEBYTECOUNTS = 325
+ICCPROFILE = 34675
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+UNDEFINED = 7
+LONG8 = 16
+TYPE_FORMATS = {
+    SHORT: 'H', LONG: 'I', RATIONAL: 'II', UNDEFINED: 's', LONG8: 'Q'}
+
+_available_compressions = {}
+
+
+def band_height(im, band_size=DEFAULT_BAND_SIZE):
+    """
+    number of rows of im that fit in band_size bytes (at least one)
+    """
+    return max(1, band_size // (im.size[0] * BYTES_PER_PIXEL))
+
+
+def iter_bands(im, band_size=DEFAULT_BAND_SIZE):
+    """
+    generate full-width horizontal bands of im, top to bottom, each holding
+    at most band_size bytes of pixels
+
+    Uncompressed TIFF files that have not yet been loaded (see is_raw_tiff)
+    are memory-mapped and each band is unpacked straight from the mapped
+    pages, so only one band is ever decoded, the file is never copied into
+    a read buffer, and processes reading the same file share its pages in
+    the page cache. Anything else is decoded in full once and then cropped
+    into bands.
+    """
+    rows = band_height(im, band_size)
+    width, height = im.size
+    if is_raw_tiff(im):
+        with open(im.filename, 'rb') as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for y in range(0, height, rows):
+                yield _read_raw_band(im, mapped, y, min(y + rows, height))
+    else:
+        im.load()
+        for y in range(0, height, rows):
+            yield im.crop((0, y, width, min(y + rows, height)))
+
+
+def is_raw_tiff(im):
+    """
+    whether im is a TIFF file, not yet loaded, whose pixels are stored
+    uncompressed and contiguous (chunky, unrotated strips or tiles), so
+    that iter_bands can read them in place
+    """
+    if im.format != 'TIFF' or getattr(im, 'im', None) is not None:
+        return False
+    if not getattr(im, 'filename', None) or len(im.tile) == 0:
+        return False
+    if im.tag_v2.get(PLANAR_CONFIGURATION, 1) != 1:
+        return False
+    if im.tag_v2.get(0x0112, 1) != 1:  # orientation
+        return False
+    return all(t[0] == 'raw' and t[3][2] == 1 for t in im.tile)
+
+
+def _read_raw_band(im, mapped, y0, y1):
+    bits = sum(im.tag_v2[BITSPERSAMPLE])
+    band = None
+    for decoder, extents, offset, args in im.tile:
+        x0, ty0, x1, ty1 = extents
+        if ty1 <= y0 or ty0 >= y1:
+            continue
+        rawmode, stride, ystep = args
+        if stride == 0:
+            stride = ((x1 - x0) * bits + 7) // 8
+        r0 = max(ty0, y0) - ty0
+        r1 = min(ty1, y1) - ty0
+        start = offset + r0 * stride
+        # the view is released before the next band, so that the map can
+        # be closed once the last band has been read
+        with memoryview(mapped) as view:
+            with view[start:start + (r1 - r0) * stride] as data:
+                piece = Image.frombytes(
+                    im.mode, (x1 - x0, r1 - r0), data, 'raw', rawmode,
+                    stride, 1)
+        if (x1 - x0, r1 - r0) == (im.size[0], y1 - y0):
+            band = piece
+        else:
+            if band is None:
+                band = Image.new(im.mode, (im.size[0], y1 - y0))
+            band.paste(piece, (x0, ty0 + r0 - y0))
+    if im.mode in ['P', 'PA']:
+        band.putpalette(im.palette)
+    band.info = dict(im.info)
+    return band
+
+
+def compression_available(compression):
+    """
+    whether this Pillow and libtiff can write TIFFs with compression (a key
+    of COMPRESSIONS)
+    """
+    try:
+        return _available_compressions[compression]
+    except KeyError:
+        pass
+    try:
+        _encode_segment(
+            Image.new('RGB', (16, 16)), COMPRESSIONS[compression],
+            NO_PREDICTOR)
+    except OSError:
+        available = False
+    else:
+        available = True
+    _available_compressions[compression] = available
+    return available
+
+
+def needs_bigtiff(size, tile_size=None, pyramid=False):
+    """
+    whether the uncompressed pixels of an 8-bit RGB image of size (padded
+    to whole tiles if tile_size is given, with all its reduced levels if
+    pyramid is True) are too many for a classic TIFF
+    """
+    sizes = pyramid_sizes(size) if pyramid else [size]
+    total = 0
+    for width, height in sizes:
+        if tile_size is not None:
+            width = -(-width // tile_size) * tile_size
+            height = -(-height // tile_size) * tile_size
+        total += width * height * 3
+    return total > MAX_CLASSIC_TIFF_OFFSET - BIGTIFF_MARGIN
+
+
+def pyramid_sizes(size, min_size=PYRAMID_MIN_SIZE):
+    """
+    return the sizes of the levels of a pyramid for an image of size, from
+    full size down, each half the size of the one before (rounded up)
+    """
+    sizes = [tuple(size)]
+    while max(sizes[-1]) > min_size:
+        width, height = sizes[-1]
+        sizes.append((-(-width // 2), -(-height // 2)))
+    return sizes
+
+
+def open_level(path, size=None):
+    """
+    open a TIFF written with a pyramid at the smallest level that is at
+    least size (width, height), or at full size if size is None or no
+    level is smaller; other images are simply opened
+    """
+    im = Image.open(path)
+    if size is None:
+        return im
+    return seek_level(im, size)
+
+
+def seek_level(im, size):
+    """
+    move im, an open image, to its smallest pyramid level that is at least
+    size (width, height), as open_level does, and return it
+    """
+    best = 0
+    for frame in range(1, getattr(im, 'n_frames', 1)):
+        im.seek(frame)
+        if im.size[0] < size[0] or im.size[1] < size[1]:
+            break
+        best = frame
+    im.seek(best)
+    return im
+
+
+def _encode_segment(im, compression, predictor):
+    # have libtiff write im as a single-strip TIFF in memory and return the
+    # compressed strip
+    f = BytesIO()
+    im.save(
+        f, 'TIFF', compression=compression, tiffinfo={PREDICTOR: predictor},
+        strip_size=im.size[0] * im.size[1] * 4)
+    f.seek(0)
+    with Image.open(f) as segment:
+        offset = segment.tag_v2[STRIPOFFSETS][0]
+        count = segment.tag_v2[STRIPBYTECOUNTS][0]
+    return f.getvalue()[offset:offset + count]
+
+
+class _Level():
+    """
+    the state of one resolution of the image being written by TiffWriter
+    """
+
+    def __init__(self, size, dpi, rows_per_segment):
+        self.size = size
+        self.dpi = dpi
+        self.row_bytes = size[0] * 3
+        self.rows_per_segment = rows_per_segment
+        self.rows_written = 0
+        self.offsets = []
+        self.byte_counts = []
+        self.pending = bytearray()
+        # a row held back so that rows can be halved in pairs
+        self.carry = None
+
+
+class TiffWriter():
+    """
+    write an 8-bit RGB TIFF one band of rows at a time, so that the whole
+    image never has to be held in memory
+
+    compression is None or a key of COMPRESSIONS; all are lossless.
+    predictor defaults to horizontal differencing for the compressions that
+    benefit from it. If tile_size (a multiple of 16) is given the image is
+    written in square tiles, otherwise in strips of about STRIP_SIZE bytes.
+    If pyramid is True, reduced-resolution copies at halving scales (down
+    to PYRAMID_MIN_SIZE) are made from the same bands and written as further
+    pages of the file. bigtiff may be True, False or None, in which case a
+    BigTIFF is written only if the pixels alone would not fit in a classic
+    TIFF. Rows left over from one band are held back and written with the
+    next.
+
+    metadata is a PIL.TiffImagePlugin.ImageFileDirectory_v2 of further tags
+    for the full-resolution image, such as embedded_metadata in
+    isaw.awib.conversions returns; Pillow lays out their values, so they
+    can only be written to classic TIFFs.
+    """
+
+    def __init__(
+            self, path, size, icc_profile=None, dpi=None, compression=None,
+            predictor=None, tile_size=None, bigtiff=None, pyramid=False,
+            metadata=None):
+        if compression == 'none':
+            compression = None
+        if compression is not None:
+            if compression not in COMPRESSIONS:
+                raise ValueError(
+                    'unknown TIFF compression: {}'.format(compression))
+            if not compression_available(compression):
+                raise ValueError(
+                    '{} compression is not available'.format(compression))
+        if predictor is None:
+            if compression in PREDICTOR_COMPRESSIONS:
+                predictor = HORIZONTAL_PREDICTOR
+            else:
+                predictor = NO_PREDICTOR
+        if predictor not in (NO_PREDICTOR, HORIZONTAL_PREDICTOR):
+            raise ValueError('unsupported predictor: {}'.format(predictor))
+        if predictor != NO_PREDICTOR and (
+                compression not in PREDICTOR_COMPRESSIONS):
+            raise ValueError(
+                'a predictor cannot be used with {} compression'
+                ''.format(compression or 'no'))
+        if tile_size is not None and (tile_size <= 0 or tile_size % 16):
+            raise ValueError(
+                'tile size must be a positive multiple of 16, not {}'
+                ''.format(tile_size))
+        if metadata is not None and metadata.prefix != b'II':
+            raise ValueError('metadata must be laid out little-endian')
+        self.path = path
+        self.size = size
+        self.icc_profile = icc_profile
+        self.dpi = dpi
+        self.metadata = metadata
+        self.compression = compression
+        self.predictor = predictor
+        self.tile_size = tile_size
+        self.levels = []
+        sizes = pyramid_sizes(size) if pyramid else [size]
+        for i, level_size in enumerate(sizes):
+            if dpi is not None:
+                dpi = tuple(d / 2 for d in dpi) if i > 0 else dpi
+            if tile_size is None:
+                rows = max(1, STRIP_SIZE // (level_size[0] * 3))
+            else:
+                rows = tile_size
+            self.levels.append(_Level(level_size, dpi, rows))
+        if bigtiff is None:
+            bigtiff = needs_bigtiff(size, tile_size, pyramid)
+        self.bigtiff = bigtiff
+        self._f = open(path, 'wb')
+        # header: little-endian, magic number, IFD offset patched in close()
+        if bigtiff:
+            self._f.write(b'II' + pack('<HHHQ', 43, 8, 0, 0))
+        else:
+            self._f.write(b'II' + pack('<HI', 42, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            remove(self.path)
+
+    @property
+    def rows_written(self):
+        return self.levels[0].rows_written
+
+    @property
+    def offsets(self):
+        return self.levels[0].offsets
+
+    @property
+    def byte_counts(self):
+        return self.levels[0].byte_counts
+
+    def write(self, band):
+        if band.mode != 'RGB':
+            raise ValueError(
+                'TiffWriter can only write RGB bands, not {}'
+                ''.format(band.mode))
+        if band.size[0] != self.size[0]:
+            raise ValueError(
+                'band width ({}) does not match image width ({})'
+                ''.format(band.size[0], self.size[0]))
+        if self.rows_written + band.size[1] > self.size[1]:
+            raise ValueError('more rows written than the image height')
+        self._write_band(0, band)
+
+    def close(self):
+        if self.rows_written != self.size[1]:
+            raise ValueError(
+                '{} of {} rows were written'
+                ''.format(self.rows_written, self.size[1]))
+        for i, level in enumerate(self.levels):
+            if level.carry is not None:
+                self._write_band(i + 1, level.carry.reduce(2))
+                level.carry = None
+            if len(level.pending) > 0:
+                self._write_rows(level, level.pending)
+                level.pending = bytearray()
+        # the header, and then each IFD, points to the next IFD
+        next_pointer = 8 if self.bigtiff else 4
+        for i, level in enumerate(self.levels):
+            ifd_offset, pointer = self._write_ifd(level, i > 0)
+            self._f.seek(next_pointer)
+            self._f.write(pack('<Q' if self.bigtiff else '<I', ifd_offset))
+            self._f.seek(0, 2)
+            next_pointer = pointer
+        self._f.close()
+
+    def _write_band(self, i, band):
+        level = self.levels[i]
+        level.pending.extend(band.tobytes())
+        level.rows_written += band.size[1]
+        segment_bytes = level.rows_per_segment * level.row_bytes
+        start = 0
+        while len(level.pending) - start >= segment_bytes:
+            self._write_rows(level, level.pending[start:start + segment_bytes])
+            start += segment_bytes
+        del level.pending[:start]
+        if i + 1 == len(self.levels):
+            return
+        # halve pairs of rows for the next level, holding back an odd one
+        if level.carry is not None:
+            rows = Image.new('RGB', (band.size[0], band.size[1] + 1))
+            rows.paste(level.carry, (0, 0))
+            rows.paste(band, (0, 1))
+            band = rows
+            level.carry = None
+        if band.size[1] % 2:
+            level.carry = band.crop(
+                (0, band.size[1] - 1, band.size[0], band.size[1]))
+            band = band.crop((0, 0, band.size[0], band.size[1] - 1))
+        if band.size[1] > 0:
+            self._write_band(i + 1, band.reduce(2))
+
+    def _write_rows(self, level, data):
+        if self.tile_size is None and self.compression is None:
+            self._write_segment(level, data)
+            return
+        rows = len(data) // level.row_bytes
+        im = Image.frombytes('RGB', (level.size[0], rows), bytes(data))
+        if self.tile_size is None:
+            self._write_segment(level, self._encode(im))
+            return
+        t = self.tile_size
+        for x in range(0, level.size[0], t):
+            # cropping past the edges pads the tile with black
+            tile = im.crop((x, 0, x + t, t))
+            if self.compression is None:
+                self._write_segment(level, tile.tobytes())
+            else:
+                self._write_segment(level, self._encode(tile))
+
+    def _encode(self, im):
+        return _encode_segment(
+            im, COMPRESSIONS[self.compression], self.predictor)
+
+    def _write_segment(self, level, data):
+        offset = self._f.tell()
+        if not self.bigtiff and offset + len(data) > MAX_CLASSIC_TIFF_OFFSET:
+            raise ValueError(
+                'image is too large for a classic TIFF file; write a BigTIFF')
+        level.offsets.append(offset)
+        level.byte_counts.append(len(data))
+        self._f.write(data)
+
+    def _write_ifd(self, level, reduced):
+        """
+        write the IFD for level at the end of the file and return its offset
+        and the offset of its pointer to the next IFD
+        """
+        offset_type = LONG8 if self.bigtiff else LONG
+        if self.compression is None:
+            compression = 1
+        else:
+            compression = COMPRESSION_INFO_REV[COMPRESSIONS[self.compression]]
+        tags = {
+            IMAGEWIDTH: (LONG, [level.size[0]]),
+            IMAGELENGTH: (LONG, [level.size[1]]),
+            BITSPERSAMPLE: (SHORT, [8, 8, 8]),
+            COMPRESSION: (SHORT, [compression]),
+            PHOTOMETRIC_INTERPRETATION: (SHORT, [2]),
+            SAMPLESPERPIXEL: (SHORT, [3]),
+            PLANAR_CONFIGURATION: (SHORT, [1])}
+        if reduced:
+            tags[NEWSUBFILETYPE] = (LONG, [REDUCED_RESOLUTION])
+        if self.tile_size is None:
+            tags[STRIPOFFSETS] = (offset_type, level.offsets)
+            tags[ROWSPERSTRIP] = (LONG, [level.rows_per_segment])
+            tags[STRIPBYTECOUNTS] = (offset_type, level.byte_counts)
+        else:
+            tags[TILEWIDTH] = (LONG, [self.tile_size])
+            tags[TILELENGTH] = (LONG, [self.tile_size])
+            tags[TILEOFFSETS] = (offset_type, level.offsets)
+            tags[TILEBYTECOUNTS] = (offset_type, level.byte_counts)
+        if self.predictor != NO_PREDICTOR:
+            tags[PREDICTOR] = (SHORT, [self.predictor])
+        if level.dpi is not None:
+            for tag, value in zip((X_RESOLUTION, Y_RESOLUTION), level.dpi):
+                value = Fraction(value).limit_denominator(10000)
+                tags[tag] = (
+                    RATIONAL, [(value.numerator, value.denominator)])
+            tags[RESOLUTION_UNIT] = (SHORT, [2])  # inches
+        if self.icc_profile is not None:
+            tags[ICCPROFILE] = (UNDEFINED, [self.icc_profile])
+        raw_entries = {}
+        if not reduced and self.metadata is not None:
+            raw_entries = {
+                tag: entry
+                for tag, entry in self._write_metadata().items()
+                if tag not in tags}
+        if self.bigtiff:
+            # 8-byte entry counts, value counts, values and offsets
+            count_format, entry_format, value_size = '<Q', '<HHQ', 8
+        else:
+            count_format, entry_format, value_size = '<H', '<HHI', 4
+        offset_format = '<Q' if self.bigtiff else '<I'
+        if self._f.tell() % 2:
+            self._f.write(b'\0')
+        ifd_offset = self._f.tell()
+        next_pointer = (
+            ifd_offset + len(pack(count_format, 0)) +
+            (4 + 2 * value_size) * (len(tags) + len(raw_entries)))
+        extra_offset = next_pointer + value_size
+        entries = []
+        extra = bytearray()
+        for tag in sorted(list(tags.keys()) + list(raw_entries.keys())):
+            if tag in raw_entries:
+                entries.append(raw_entries[tag])
+                continue
+            field_type, values = tags[tag]
+            if field_type == UNDEFINED:
+                data = values[0]
+                count = len(data)
+            elif field_type == RATIONAL:
+                data = b''.join(pack('<II', *v) for v in values)
+                count = len(values)
+            else:
+                data = pack(
+                    '<{}{}'.format(len(values), TYPE_FORMATS[field_type]),
+                    *values)
+                count = len(values)
+            if len(data) <= value_size:
+                value = data.ljust(value_size, b'\0')
+            else:
+                value = pack(offset_format, extra_offset + len(extra))
+                extra.extend(data)
+                if len(extra) % 2:
+                    extra.extend(b'\0')
+            entries.append(pack(entry_format, tag, field_type, count) + value)
+        self._f.write(pack(count_format, len(entries)))
+        self._f.write(b''.join(entries))
+        self._f.write(pack(offset_format, 0))
+        self._f.write(extra)
+        return (ifd_offset, next_pointer)
+
+    def _write_metadata(self):
+        """
+        write the metadata directory, as Pillow lays it out, at the end of the
+        file and return its IFD entries by tag; their values point into what
+        was written
+        """
+        if len(self.metadata) == 0:
+            return {}
+        if self.bigtiff:
+            logging.getLogger(__name__).warning(
+                'embedded metadata cannot be written to a BigTIFF; '
+                'it is left out of {}'.format(self.path))
+            return {}
+        if self._f.tell() % 2:
+            self._f.write(b'\0')
+        data = self.metadata.tobytes(self._f.tell())
+        self._f.write(data)
+        count = unpack('<H', data[:2])[0]
+        entries = [data[2 + 12 * i:14 + 12 * i] for i in range(count)]
+        return {unpack('<H', entry[:2])[0]: entry for entry in entries}
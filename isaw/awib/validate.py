@@ -0,0 +1,210 @@
+"""
+Validate AWIB image packages, many at once
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from isaw.awib.checksums import CHUNK_SIZE, hash_file, read_sidecar
+import os
+from os.path import abspath, isdir, isfile, join, splitext
+from PIL import Image
+import sqlite3
+import time
+
+EXPECTED_FILES = [
+    'history.log',
+    'master.sha512',
+    'master.tif',
+    'master_exiftool.sha512',
+    'master_exiftool.xml',
+    'master_jhove.sha512',
+    'master_jhove.xml',
+    'metadata.sha512',
+    'metadata.xml',
+    'original.sha512',
+    'original_exiftool.sha512',
+    'original_exiftool.xml',
+    'original_jhove.sha512',
+    'original_jhove.xml']
+# number of queued packages per worker process; bounds the memory used for
+# pending reports and cache entries
+JOB_QUEUE_DEPTH = 4
+
+
+class ChecksumCache():
+    """
+    SQLite store of (size, mtime, inode, sha512) for files whose checksums
+    have been verified, so that unchanged files need not be hashed again
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checksums ('
+            'path TEXT PRIMARY KEY, package TEXT, size INTEGER, '
+            'mtime_ns INTEGER, inode INTEGER, sha512 TEXT, verified REAL)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS checksums_package '
+            'ON checksums (package)')
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_package(self, package):
+        """
+        return {path: (size, mtime_ns, inode, sha512)} for files in package
+        """
+        rows = self.connection.execute(
+            'SELECT path, size, mtime_ns, inode, sha512 FROM checksums '
+            'WHERE package = ?', (package,))
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def update(self, package, entries):
+        now = time.time()
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(path, package) + tuple(entry) + (now,)
+                for path, entry in entries.items()])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def find_packages(collection):
+    """
+    return the package directories immediately inside collection
+    """
+    paths = []
+    for entry in sorted(os.scandir(collection), key=lambda e: e.name):
+        if entry.is_dir() and isfile(join(entry.path, 'history.log')):
+            paths.append(abspath(entry.path))
+    return paths
+
+
+def validate_package(path, cached=None, fast=False, chunk_size=CHUNK_SIZE):
+    """
+    validate one package directory and return a report dictionary
+
+    cached is a dictionary like ChecksumCache.get_package() returns; in fast
+    mode, files whose size, mtime and inode match their cache entry, and
+    whose cached checksum matches their .sha512 file, are not hashed again.
+    The report's 'verified' entry holds the cache entries for every file
+    whose checksum was verified.
+    """
+    start = time.time()
+    path = abspath(path)
+    cached = cached or {}
+    report = {
+        'package': path,
+        'valid': False,
+        'errors': [],
+        'hashed': 0,
+        'cached': 0,
+        'bytes_hashed': 0,
+        'verified': {}}
+    errors = report['errors']
+    if not isdir(path):
+        errors.append('{} must be a directory'.format(path))
+        return _finish(report, start)
+
+    # verify that minimum expected content is present
+    for fn in EXPECTED_FILES:
+        if not isfile(join(path, fn)):
+            errors.append(
+                '{} must be a regular file in the package directory'
+                ''.format(fn))
+
+    # verify that master.tif and original.* are image files
+    filenames = sorted(os.listdir(path))
+    images = [
+        fn for fn in filenames
+        if fn == 'master.tif' or (
+            fn.startswith('original.') and not fn.endswith('.sha512'))]
+    for fn in images:
+        try:
+            with Image.open(join(path, fn)):
+                pass
+        except Image.DecompressionBombError:
+            # raised only once the header has been read, so it is an image,
+            # just larger than Pillow accepts from untrusted sources
+            pass
+        except (IOError, SyntaxError):
+            errors.append('{} is not an image file'.format(fn))
+
+    # verify all checksums
+    for hash_fn in [fn for fn in filenames if fn.endswith('.sha512')]:
+        hash_name, hash_ext = splitext(hash_fn)
+        try:
+            old_sum = read_sidecar(join(path, hash_fn))
+        except (IndexError, UnicodeDecodeError):
+            errors.append('{} is not a checksum file'.format(hash_fn))
+            continue
+        matching = [
+            fn for fn in filenames
+            if splitext(fn)[0] == hash_name and fn != hash_fn]
+        for match_fn in matching:
+            match_path = join(path, match_fn)
+            st = os.stat(match_path)
+            key = (st.st_size, st.st_mtime_ns, st.st_ino)
+            entry = cached.get(match_path)
+            if fast and entry is not None and (
+                    tuple(entry[:3]) == key and entry[3] == old_sum):
+                report['cached'] += 1
+                new_sum = old_sum
+            else:
+                new_sum = hash_file(
+                    match_path, ('sha512',), chunk_size)['sha512']
+                report['hashed'] += 1
+                report['bytes_hashed'] += st.st_size
+            if new_sum != old_sum:
+                errors.append(
+                    'checksum verification on {} failed'.format(match_fn))
+            else:
+                report['verified'][match_path] = key + (new_sum,)
+    report['valid'] = len(errors) == 0
+    return _finish(report, start)
+
+
+def validate_packages(paths, jobs=1, cache=None, fast=False):
+    """
+    generate a report for each package in paths, in order of completion,
+    using jobs worker processes; cache is an optional ChecksumCache that is
+    consulted in fast mode and updated with every verified checksum
+    """
+    def submit(executor, path):
+        cached = cache.get_package(abspath(path)) if cache else None
+        return executor.submit(validate_package, path, cached, fast)
+
+    def finish(report):
+        if cache is not None and len(report['verified']) > 0:
+            cache.update(report['package'], report['verified'])
+        return report
+
+    if jobs <= 1:
+        for path in paths:
+            cached = cache.get_package(abspath(path)) if cache else None
+            yield finish(validate_package(path, cached, fast))
+        return
+    pending = set()
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for path in paths:
+                pending.add(submit(executor, path))
+                if len(pending) >= jobs * JOB_QUEUE_DEPTH:
+                    break
+            if len(pending) == 0:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield finish(future.result())
+
+
+def _finish(report, start):
+    report['seconds'] = round(time.time() - start, 3)
+    return report
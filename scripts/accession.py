@@ -0,0 +1,124 @@
+"""
+Accession an original image as an AWIB package
+"""
+
+import argparse
+from isaw.awib.accession import accession, AccessionError
+import logging
+import os
+import re
+import sys
+import traceback
+
+DEFAULT_LOG_LEVEL = logging.ERROR
+POSITIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR'],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)'],
+    ['-n', '--name', '', 'name for the image package'],
+    ['-t', '--notools', False,
+        'only copy, checksum and make the master; do not run exiftool or '
+        'jhove or make metadata.xml'],
+    ['-q', '--quiet', False, 'suppress all messages to stdout']
+]
+
+
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(1)
+
+
+def main(args):
+    """
+    main function
+    """
+    if not args.notools and 'JHOVEHOME' not in os.environ:
+        erexit('the JHOVEHOME environment variable is not set')
+    try:
+        package = accession(
+            args.original, args.destination, args.name,
+            external_tools=not args.notools)
+    except AccessionError as e:
+        erexit(str(e))
+    if not args.quiet:
+        print('created new image package at {}'.format(package.path))
+
+
+if __name__ == "__main__":
+    log_level = DEFAULT_LOG_LEVEL
+    log_level_name = logging.getLevelName(log_level)
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+    try:
+        parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        for p in POSITIONAL_ARGUMENTS:
+            d = {
+                'help': p[3]
+            }
+            if isinstance(p[2], bool):
+                if p[2] is False:
+                    d['action'] = 'store_true'
+                    d['default'] = False
+                else:
+                    d['action'] = 'store_false'
+                    d['default'] = True
+            else:
+                d['default'] = p[2]
+            parser.add_argument(
+                p[0],
+                p[1],
+                **d)
+        parser.add_argument(
+            'original',
+            type=str,
+            help='path to original image file')
+        parser.add_argument(
+            'destination',
+            type=str,
+            help='path to directory in which to create the package')
+        args = parser.parse_args()
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
+            try:
+                log_level = getattr(logging, args_log_level)
+            except AttributeError:
+                logging.error(
+                    "command line option to set log_level failed "
+                    "because '%s' is not a valid level name; using %s"
+                    % (args_log_level, log_level_name))
+        elif args.veryverbose:
+            log_level = logging.INFO
+        elif args.verbose:
+            log_level = logging.WARNING
+        elif args.quiet:
+            log_level = logging.CRITICAL
+        log_level_name = logging.getLevelName(log_level)
+        if not args.quiet:
+            print('log level is {}'.format(log_level_name))
+        logging.basicConfig(level=log_level)
+        if log_level != DEFAULT_LOG_LEVEL:
+            logging.warning(
+                "logging level changed to %s via command line option"
+                % log_level_name)
+        else:
+            logging.info("using default logging level: %s" % log_level_name)
+        logging.debug("command line: '%s'" % ' '.join(sys.argv))
+        main(args)
+        sys.exit(0)
+    except KeyboardInterrupt as e:  # Ctrl-C
+        raise e
+    except SystemExit as e:  # sys.exit()
+        raise e
+    except Exception as e:
+        print("ERROR, UNEXPECTED EXCEPTION")
+        print(str(e))
+        traceback.print_exc()
+        os._exit(1)
@@ -0,0 +1,192 @@
+"""
+Benchmark making masters from synthetic originals and write the results as
+JSON
+"""
+
+import argparse
+from isaw.awib import benchmark
+import json
+import logging
+import os
+import re
+import sys
+import traceback
+
+DEFAULT_LOG_LEVEL = logging.ERROR
+POSITIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR'],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)'],
+    ['-f', '--formats', ','.join(benchmark.writable_formats()),
+        'comma-separated image formats (keys of image_types.IMAGETYPES)'],
+    ['-m', '--modes', ','.join(benchmark.MODES),
+        'comma-separated modes of the originals'],
+    ['-s', '--sizes', ','.join([str(s) for s in benchmark.SIZES]),
+        'comma-separated sizes of the originals in megapixels'],
+    ['-r', '--repeat', 1,
+        'number of times to make each master (the fastest run is kept)'],
+    ['-t', '--tmpdir', '',
+        'directory for originals and masters (default: system temporary '
+        'directory)'],
+    ['-c', '--compare', '',
+        'path to the JSON results of an earlier run to check for '
+        'regressions'],
+    ['-S', '--saveoptions', False,
+        'instead, compare file size and encode time of masters saved with '
+        'different compressions and layouts'],
+    ['-i', '--images', '',
+        'with --saveoptions, comma-separated paths of originals to use '
+        'instead of synthetic images'],
+    ['-q', '--quiet', False, 'suppress progress messages']
+]
+
+
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(1)
+
+
+def split_list(value):
+    return [v.strip() for v in value.split(',') if v.strip() != '']
+
+
+def progress(result):
+    if 'options' in result:
+        case = result.get('original', '{} MP'.format(result.get('megapixels')))
+        if 'error' in result:
+            msg = result['error']
+        else:
+            msg = '{:.3f}s {} bytes (ratio {:.2f})'.format(
+                result['seconds'], result['bytes'], result['ratio'])
+        print(
+            '{} {}: {}'.format(case, json.dumps(result['options']), msg),
+            file=sys.stderr)
+        return
+    if 'error' in result:
+        msg = result['error']
+    else:
+        msg = 'make {:.3f}s save {:.3f}s peak RSS {:.0f} MiB'.format(
+            result['make_seconds'], result['save_seconds'],
+            result['peak_rss'] / 2**20)
+    print(
+        '{format} {mode} {megapixels} MP: {msg}'.format(msg=msg, **result),
+        file=sys.stderr)
+
+
+def main(args):
+    """
+    main function
+    """
+    formats = split_list(args.formats)
+    unknown = set(formats) - set(benchmark.writable_formats())
+    if len(unknown) > 0:
+        erexit('Cannot benchmark formats: {}'.format(
+            ', '.join(sorted(unknown))))
+    try:
+        sizes = [float(s) for s in split_list(args.sizes)]
+    except ValueError:
+        erexit('Sizes must be numbers of megapixels')
+    if args.saveoptions:
+        report = benchmark.run_save_options(
+            sizes, originals=split_list(args.images) or None,
+            directory=args.tmpdir or None,
+            progress=None if args.quiet else progress)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        return
+    modes = split_list(args.modes)
+    unknown = set(modes) - set(benchmark.MODES)
+    if len(unknown) > 0:
+        erexit('Unknown modes: {}'.format(', '.join(sorted(unknown))))
+    report = benchmark.run(
+        formats, modes, sizes, args.repeat, args.tmpdir or None,
+        None if args.quiet else progress)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare != '':
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = benchmark.compare(baseline, report)
+        for fmt, mode, megapixels, measure, old, new in regressions:
+            print(
+                'REGRESSION: {} {} {} MP {}: {:.6g} -> {:.6g}'
+                ''.format(fmt, mode, megapixels, measure, old, new))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    log_level = DEFAULT_LOG_LEVEL
+    log_level_name = logging.getLevelName(log_level)
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+    try:
+        parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        for p in POSITIONAL_ARGUMENTS:
+            d = {
+                'help': p[3]
+            }
+            if isinstance(p[2], bool):
+                if p[2] is False:
+                    d['action'] = 'store_true'
+                    d['default'] = False
+                else:
+                    d['action'] = 'store_false'
+                    d['default'] = True
+            elif isinstance(p[2], int):
+                d['type'] = int
+                d['default'] = p[2]
+            else:
+                d['default'] = p[2]
+            parser.add_argument(
+                p[0],
+                p[1],
+                **d)
+        parser.add_argument(
+            'output',
+            type=str,
+            help='path to JSON results file')
+        args = parser.parse_args()
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
+            try:
+                log_level = getattr(logging, args_log_level)
+            except AttributeError:
+                logging.error(
+                    "command line option to set log_level failed "
+                    "because '%s' is not a valid level name; using %s"
+                    % (args_log_level, log_level_name))
+        elif args.veryverbose:
+            log_level = logging.INFO
+        elif args.verbose:
+            log_level = logging.WARNING
+        elif args.quiet:
+            log_level = logging.CRITICAL
+        log_level_name = logging.getLevelName(log_level)
+        logging.basicConfig(level=log_level)
+        if log_level != DEFAULT_LOG_LEVEL:
+            logging.warning(
+                "logging level changed to %s via command line option"
+                % log_level_name)
+        else:
+            logging.info("using default logging level: %s" % log_level_name)
+        logging.debug("command line: '%s'" % ' '.join(sys.argv))
+        main(args)
+        sys.exit(0)
+    except KeyboardInterrupt as e:  # Ctrl-C
+        raise e
+    except SystemExit as e:  # sys.exit()
+        raise e
+    except Exception as e:
+        print("ERROR, UNEXPECTED EXCEPTION")
+        print(str(e))
+        traceback.print_exc()
+        os._exit(1)
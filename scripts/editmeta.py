@@ -2,20 +2,23 @@ import argparse
 import better_exceptions
 import colorama
 from colorama import Fore, Style
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 import csv
 from datetime import datetime, timezone
 from dateutil import parser as date_parser
 from decimal import Decimal, getcontext, ROUND_HALF_EVEN
+from isaw.awib.gazetteer import (GazetteerClient, GazetteerError,
+                                 pleiades_urls, ResponseCache)
 import json
 import logging
 from lxml import etree
 import os
-from os.path import realpath
+from os.path import dirname, isdir, join, realpath
 import pwd
 import re
-import requests
 import sys
+import tempfile
 import traceback
 import io
 import chardet
@@ -25,6 +28,9 @@ import codecs
 colorama.init(autoreset=True)
 
 MODIFIED = []
+CLIENT = GazetteerClient()
+INTERACTIVE = True
+BATCH_CHUNK_SIZE = 16
 
 DEFAULT_LOG_LEVEL = logging.ERROR
 OPTIONAL_ARGUMENTS = [
@@ -37,7 +43,21 @@ OPTIONAL_ARGUMENTS = [
     ['-g', '--geonames_user', '', 'username for geonames api'],
     ['-p', '--photographer', '',
         'value, registry ID, or copy: for photographer'],
-    ['-ch', '--copyright_holder', '', 'value or copy: for copyright holder']
+    ['-ch', '--copyright_holder', '', 'value or copy: for copyright holder'],
+    ['-gc', '--gazetteer_cache', '',
+        'path to persistent cache of gazetteer responses'],
+    ['-gt', '--gazetteer_ttl', 30,
+        'days before a cached gazetteer response expires'],
+    ['-gp', '--gazetteer_precision', 3,
+        'decimal places to which coordinates are rounded for nearby-place '
+        'lookups'],
+    ['-o', '--offline', False, 'only use cached gazetteer responses'],
+    ['-b', '--batch', '',
+        'path to CSV or JSONL file of field assignments for many packages '
+        '(non-interactive)'],
+    ['-j', '--jobs', 1, 'number of worker processes in batch mode'],
+    ['-r', '--registry', '',
+        'path to people registry file (in place of people_registry)']
 ]
 PEOPLE_REGISTER = {}
 
@@ -69,6 +89,14 @@ def set_text(element, value):
         s = value
         fail = True
         while fail:
+            if not INTERACTIVE:
+                try:
+                    date_val = date_parser.parse(s)
+                except (ValueError, OverflowError) as e:
+                    raise EditBailout(
+                        '{}: invalid date "{}": {}'.format(
+                            element.tag, s, e))
+                break
             while len(s) < 3:
                 print(Fore.RED + '>>>>>>>>>> ERROR: "{}": {}'.format(
                     s, 'Unrecognized datetime format'))
@@ -131,8 +159,8 @@ def dms2dd(dms: str, precision=7):
     handheld GPS)
     """
     rxdms = re.compile(
-        '^(?P<degrees>\d+)\s+deg\s+(?P<minutes>\d+)\'\s+(?P<seconds>[\d\.]+)'
-        '(\"|\')\s*(?P<hemisphere>.)$')
+        '^(?P<degrees>\d+)\s+(deg\s+)?(?P<minutes>\d+)\'?\s+'
+        '(?P<seconds>[\d\.]+)(\"|\')?\s*(?P<hemisphere>.)$')
     m = rxdms.match(dms)
     if m is not None:
         getcontext().prec = precision
@@ -155,7 +183,7 @@ def set_with_registry(element, id):
     try:
         p = PEOPLE_REGISTER[id]
     except KeyError:
-        return ''
+        return None
     else:
         for child in element:
             element.remove(child)
@@ -170,10 +198,11 @@ def set_with_gps(tree, element):
     srcxp = "//info[@type='original']/gps-data/*"
     src = tree.xpath(srcxp)
     if len(src) == 0:
-        print(
-            Fore.RED +
-            '>>>>>>>>>> ERROR IGNORED: no original gps data found in metadata '
-            'file.')
+        if INTERACTIVE:
+            print(
+                Fore.RED +
+                '>>>>>>>>>> ERROR IGNORED: no original gps data found in '
+                'metadata file.')
     else:
         rxerror = re.compile('^(?P<value>\d+)(?P<units>.+)$')
         d = {}
@@ -207,25 +236,35 @@ def set_with_gps(tree, element):
                 d['longitude'])
 
 
-def set_with_url(element, url):
+def set_with_url(tree, element, url):
     if url.startswith('https://pleiades.stoa.org/places/'):
-        return set_with_pleiades(element, url)
+        return set_with_pleiades(tree, element, url)
     elif url.startswith('http://www.geonames.org/'):
-        return set_with_geonames(element, url)
+        return set_with_geonames(tree, element, url)
     elif url.startswith('http://sws.geonames.org/'):
-        return set_with_geonames(element, url)
+        return set_with_geonames(tree, element, url)
     else:
         raise NotImplementedError('no support for set with url {}'.format(url))
 
 
-def parse_geonames_response(element, url, response):
-    url_safe = '&'.join([p for p in url.split('&') if 'username' not in p])
+def fetch_json(url):
+    try:
+        return CLIENT.get_json(url)
+    except GazetteerError as e:
+        if not INTERACTIVE:
+            raise EditBailout(str(e))
+        print(Fore.RED + '>>>>>>>>>> ERROR IGNORED: {}'.format(e))
+        return None
+
+
+def parse_geonames_response(element, url, data):
+    url_safe = CLIENT.safe_url(url)
     element.set('source', url_safe)
     element.set('vintage', datetime.now(timezone.utc).isoformat())
     try:
-        j = response.json()['geonames'][0]
+        j = data['geonames'][0]
     except KeyError:
-        j = response.json()
+        j = data
     s = etree.SubElement(element, 'geonames_id')
     geoid = j['geonameId']
     set_text(s, geoid)
@@ -260,16 +299,11 @@ def parse_geonames_response(element, url, response):
 
 
 def set_with_geonames_latlon(element, lat, lon):
-    url_parts = [
-        'http://api.geonames.org/findNearbyJSON?lat={}'.format(lat),
-        'lng={}'.format(lon),
-        'username={}'.format(GEONAMES_USER),
-        'style=full']
-    url_json = '&'.join(url_parts)
-    r = requests.get(url_json)
-    if r.status_code != 200:
+    url_json = CLIENT.geonames_nearby_url(lat, lon)
+    data = fetch_json(url_json)
+    if data is None:
         return
-    return parse_geonames_response(element, url_json, r)
+    return parse_geonames_response(element, url_json, data)
 
 
 def set_with_geonames(tree, element, url):
@@ -282,33 +316,22 @@ def set_with_geonames(tree, element, url):
     if m is None:
         return
     geoid = m.group('geoid')
-    url_parts = [
-        'http://api.geonames.org/getJSON?geonameId={}'.format(geoid),
-        'username={}'.format(GEONAMES_USER),
-        'style=full'
-        ]
-    url_json = '&'.join(url_parts)
-    r = requests.get(url_json)
-    if r.status_code != 200:
+    url_json = CLIENT.geonames_url(geoid)
+    data = fetch_json(url_json)
+    if data is None:
         return
-    return parse_geonames_response(element, url_json, r)
+    return parse_geonames_response(element, url_json, data)
 
 
 def set_with_pleiades(tree, element, url):
     if 'place' not in element.tag:
         raise NotImplementedError(
             "can't set {} from Pleiades".format(element.tag))
-    if url.endswith('/json'):
-        url_json = url
-        url_place = '/'.join(url.split('/')[:-1])
-    else:
-        url_place = url
-        url_json = '{}/json'.format(url)
-    r = requests.get(url_json)
-    if r.status_code != 200:
+    url_json, url_place = pleiades_urls(url)
+    j = fetch_json(url_json)
+    if j is None:
         return
     element.set('source', url_json)
-    j = r.json()
     modern = False
     title = ''
     for name in j['names']:
@@ -336,22 +359,51 @@ def set_with_pleiades(tree, element, url):
     return etree.tostring(element, pretty_print=True, encoding="unicode")
 
 
+def not_set(element, cmd):
+    """
+    report a value or directive that could not be applied: in batch mode
+    this fails the package, interactively the field is left alone
+    """
+    msg = '{}: could not set from "{}"'.format(element.tag, cmd)
+    if not INTERACTIVE:
+        raise EditBailout(msg)
+    print(Fore.RED + '>>>>>>>>>> ERROR IGNORED: {}'.format(msg))
+
+
 def force_it(tree, element, cmd):
     result = None
     directives = {}
-    print(
-        '>>>>>>>>>> INPUT OVERRIDE: detected command-line option --{}="{}"'
-        ''.format(element.tag.replace('-', '_'), cmd))
+    if INTERACTIVE:
+        print(
+            '>>>>>>>>>> INPUT OVERRIDE: detected command-line option --{}="{}"'
+            ''.format(element.tag.replace('-', '_'), cmd))
     if cmd.startswith('http'):
-        result = set_with_url(element, cmd)
-        MODIFIED.append(tree.getpath(element))
+        result = set_with_url(tree, element, cmd)
+        if result is None:
+            not_set(element, cmd)
+        else:
+            MODIFIED.append(tree.getpath(element))
     elif cmd == 'copy:original':
         pass
     elif cmd.startswith('registry:'):
         result = set_with_registry(element, cmd[9:])
-        MODIFIED.append(tree.getpath(element))
+        if result is None:
+            not_set(element, cmd)
+        else:
+            MODIFIED.append(tree.getpath(element))
     elif cmd.startswith('copy:'):
         directives[element.tag] = cmd
+    elif cmd in ['=gps', '=gpsgeonames'] and 'place' in element.tag:
+        gps = set_with_gps(tree, element)
+        if gps is None:
+            not_set(element, cmd)
+        else:
+            result, lat, lon = gps
+            MODIFIED.append(tree.getpath(element))
+            if cmd == '=gpsgeonames':
+                result = set_with_geonames_latlon(element, lat, lon)
+                if result is None:
+                    not_set(element, cmd)
     else:
         set_text(element, cmd)
         MODIFIED.append(tree.getpath(element))
@@ -409,7 +461,7 @@ def handle_input(tree, element, orig, suggestion, pad):
         result = set_with_geonames_latlon(element, lat, lon)
         MODIFIED.append(tree.getpath(element))
     elif s.startswith('http'):
-        result = set_with_url(element, s)
+        result = set_with_url(tree, element, s)
         MODIFIED.append(tree.getpath(element))
     elif len(s) > 1 and s[0] == '=':
         directives[element.tag] = 'copy:{}'.format(s[1:])
@@ -488,21 +540,14 @@ def get_val(tree, element, args):
     return directives
 
 
-def main(args):
-    populate_registry(args.people_registry)
-    meta_path = realpath(args.meta_file)
-    lxml_parser = etree.XMLParser(remove_blank_text=True)
-    meta = etree.parse(meta_path, lxml_parser)
-    isaw_info = meta.xpath("//info[@type='isaw']")[0]
-    try:
-        directives = get_val(meta, isaw_info, args)
-    except EditBailout:
-        print('fine, be that way')
-    else:
-        for dest_tag, directive in directives.items():
-            cmd, src_tag = directive.split(':')
-            if cmd == 'copy':
-                do_copy(meta, src_tag, dest_tag)
+def apply_directives(tree, directives):
+    for dest_tag, directive in directives.items():
+        cmd, src_tag = directive.split(':')
+        if cmd == 'copy':
+            do_copy(tree, src_tag, dest_tag)
+
+
+def record_change(meta):
     change = etree.Element('change')
     e = etree.SubElement(change, 'date')
     e.text = datetime.now(timezone.utc).isoformat()
@@ -517,10 +562,183 @@ def main(args):
                     for x in MODIFIED])))
     change_history = meta.xpath('//change-history')[0]
     change_history.insert(0, change)
+
+
+def write_atomically(meta, meta_path):
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname(meta_path), prefix='.metadata', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding="UTF-8") as f:
+            f.write(
+                etree.tostring(meta, pretty_print=True, encoding="unicode"))
+        os.chmod(tmp_path, os.stat(meta_path).st_mode)
+        os.replace(tmp_path, meta_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def set_vals(tree, element, assignments):
+    """
+    non-interactive counterpart of get_val: apply assignments (a dictionary
+    of values or directives keyed like the command-line options) to the
+    first matching elements in and below element
+    """
+    directives = {}
+    attr = element.tag.replace('-', '_')
+    if attr in assignments:
+        result, d = force_it(tree, element, assignments[attr])
+        directives.update(d)
+    else:
+        for child in element:
+            directives.update(set_vals(tree, child, assignments))
+    return directives
+
+
+def read_batch(path):
+    """
+    return a list of (metadata path, assignments) tuples from a CSV or JSONL
+    batch file; each row names a metadata file ("meta_file") or package
+    directory ("package"), relative to the batch file, and gives values or
+    directives for fields, keyed like the command-line options
+    """
+    here = dirname(realpath(path))
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip() != '']
+    batch = []
+    for row in rows:
+        row = {
+            k: str(v) for k, v in row.items() if v is not None and v != ''}
+        try:
+            meta_path = row.pop('meta_file')
+        except KeyError:
+            meta_path = join(row.pop('package'), 'metadata.xml')
+        meta_path = join(here, meta_path)
+        if isdir(meta_path):
+            meta_path = join(meta_path, 'metadata.xml')
+        batch.append((realpath(meta_path), row))
+    return batch
+
+
+def edit_package(job):
+    """
+    apply one batch row to its metadata file; returns (path, modified fields,
+    error message or None)
+    """
+    meta_path, assignments = job
+    del MODIFIED[:]
+    try:
+        lxml_parser = etree.XMLParser(remove_blank_text=True)
+        meta = etree.parse(meta_path, lxml_parser)
+        isaw_info = meta.xpath("//info[@type='isaw']")[0]
+        directives = set_vals(meta, isaw_info, assignments)
+        apply_directives(meta, directives)
+        if len(MODIFIED) > 0:
+            record_change(meta)
+            write_atomically(meta, meta_path)
+    except Exception as e:
+        return (meta_path, [], '{}: {}'.format(type(e).__name__, e))
+    return (meta_path, list(MODIFIED), None)
+
+
+def make_client(args):
+    client = GazetteerClient(
+        args.geonames_user,
+        offline=args.offline,
+        latlon_precision=args.gazetteer_precision)
+    if args.gazetteer_cache != '':
+        client.cache = ResponseCache(
+            realpath(args.gazetteer_cache),
+            ttl=args.gazetteer_ttl * 24 * 60 * 60)
+    return client
+
+
+def init_batch(args):
+    """
+    set up globals for batch editing, in this process or a worker
+    """
+    global CLIENT, INTERACTIVE
+    INTERACTIVE = False
+    if len(PEOPLE_REGISTER) == 0:
+        populate_registry(registry_path(args))
+    # a fresh client (and cache connection) per process, keeping responses
+    # already fetched by the parent
+    client = make_client(args)
+    client.responses = CLIENT.responses
+    CLIENT = client
+
+
+def registry_path(args):
+    if args.registry != '':
+        return args.registry
+    return args.people_registry
+
+
+def batch_main(args):
+    if args.meta_file is not None:
+        raise ValueError(
+            'metadata files are named in the batch file; use --registry to '
+            'give the people registry with --batch')
+    init_batch(args)
+    batch = read_batch(args.batch)
+    urls = [
+        v for meta_path, assignments in batch for v in assignments.values()
+        if v.startswith('http')]
+    if len(urls) > 0:
+        # look up every place once, in parallel, before editing
+        CLIENT.resolve_many(urls)
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=init_batch, initargs=(args,))
+        results = executor.map(edit_package, batch, chunksize=BATCH_CHUNK_SIZE)
+    else:
+        executor = None
+        results = map(edit_package, batch)
+    failures = 0
+    try:
+        for meta_path, modified, error in results:
+            if error is not None:
+                failures += 1
+                print(Fore.RED + 'FAILED: {}: {}'.format(meta_path, error))
+            elif len(modified) > 0:
+                print('modified: {} ({} fields)'.format(
+                    meta_path, len(modified)))
+            else:
+                print('unchanged: {}'.format(meta_path))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print('{} packages processed, {} failed'.format(
+        len(batch) - failures, failures))
+    if failures > 0:
+        sys.exit(1)
+
+
+def main(args):
+    if args.batch != '':
+        return batch_main(args)
+    if args.meta_file is None:
+        raise ValueError('a metadata file is required unless --batch is used')
+    populate_registry(registry_path(args))
+    meta_path = realpath(args.meta_file)
+    lxml_parser = etree.XMLParser(remove_blank_text=True)
+    meta = etree.parse(meta_path, lxml_parser)
+    isaw_info = meta.xpath("//info[@type='isaw']")[0]
+    try:
+        directives = get_val(meta, isaw_info, args)
+    except EditBailout:
+        print('fine, be that way')
+    else:
+        apply_directives(meta, directives)
+    record_change(meta)
     os.rename(meta_path, meta_path+".bak")
     with open(meta_path, 'w', encoding="UTF-8") as f:
         f.write(etree.tostring(meta, pretty_print=True, encoding="unicode"))
 
+
 if __name__ == "__main__":
     log_level = DEFAULT_LOG_LEVEL
     log_level_name = logging.getLevelName(log_level)
@@ -533,38 +751,35 @@ if __name__ == "__main__":
             d = {
                 'help': p[3]
             }
-            if type(p[2]) == bool:
+            if isinstance(p[2], bool):
                 if p[2] is False:
                     d['action'] = 'store_true'
                     d['default'] = False
                 else:
                     d['action'] = 'store_false'
                     d['default'] = True
+            elif isinstance(p[2], int):
+                d['type'] = int
+                d['default'] = p[2]
             else:
                 d['default'] = p[2]
             parser.add_argument(
                 p[0],
                 p[1],
                 **d)
-        # example positional argument
-        # parser.add_argument(
-        #     'foo',
-        #     metavar='N',
-        #     type=str,
-        #     nargs='1',
-        #     help="foo is better than bar except when it isn't")
         parser.add_argument(
             'meta_file',
             type=str,
-            help='path to metadata xml file')
+            nargs='?',
+            help='path to metadata xml file (not used with --batch)')
         parser.add_argument(
             'people_registry',
             type=str,
             nargs='?',
             help='path to people registry file')
         args = parser.parse_args()
-        if args.loglevel is not 'NOTSET':
-            args_log_level = re.sub('\s+', '', args.loglevel.strip().upper())
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
             try:
                 log_level = getattr(logging, args_log_level)
             except AttributeError:
@@ -585,7 +800,7 @@ if __name__ == "__main__":
         else:
             logging.info("using default logging level: %s" % log_level_name)
         logging.debug("command line: '%s'" % ' '.join(sys.argv))
-        GEONAMES_USER = args.geonames_user
+        CLIENT = make_client(args)
         main(args)
         sys.exit(0)
     except KeyboardInterrupt as e:  # Ctrl-C
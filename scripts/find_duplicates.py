@@ -0,0 +1,143 @@
+"""
+Find originals that are already in the image bank as near duplicates
+"""
+
+import argparse
+from isaw.awib.duplicates import DEFAULT_MAX_DISTANCE, HashIndex
+import json
+import logging
+import os
+import re
+import sys
+import traceback
+
+DEFAULT_LOG_LEVEL = logging.ERROR
+POSITIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR'],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)'],
+    ['-u', '--update', '',
+        'first add the packages in this collection directory that are not '
+        'yet in the index'],
+    ['-j', '--jobs', 1, 'number of worker processes for --update'],
+    ['-d', '--distance', DEFAULT_MAX_DISTANCE,
+        'greatest number of bits by which the hashes of near duplicates '
+        'differ'],
+    ['-q', '--quiet', False, 'only report originals that have duplicates']
+]
+
+
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(1)
+
+
+def main(args):
+    """
+    main function
+    """
+    index = HashIndex(args.index)
+    if args.update != '':
+        if not os.path.isdir(args.update):
+            erexit('collection directory not found: {}'.format(args.update))
+        added = index.update(args.update, args.jobs)
+        logging.info(
+            'added {} packages to the index ({} in all)'.format(
+                added, len(index)))
+    found = 0
+    for original in args.originals:
+        matches = index.find(original, args.distance)
+        if len(matches) > 0:
+            found += 1
+        elif args.quiet:
+            continue
+        print(json.dumps({
+            'original': original,
+            'duplicates': [
+                {'package': m[0], 'dhash_distance': m[1],
+                    'phash_distance': m[2]}
+                for m in matches]}, sort_keys=True))
+    if found > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    log_level = DEFAULT_LOG_LEVEL
+    log_level_name = logging.getLevelName(log_level)
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+    try:
+        parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        for p in POSITIONAL_ARGUMENTS:
+            d = {
+                'help': p[3]
+            }
+            if isinstance(p[2], bool):
+                if p[2] is False:
+                    d['action'] = 'store_true'
+                    d['default'] = False
+                else:
+                    d['action'] = 'store_false'
+                    d['default'] = True
+            elif isinstance(p[2], int):
+                d['type'] = int
+                d['default'] = p[2]
+            else:
+                d['default'] = p[2]
+            parser.add_argument(
+                p[0],
+                p[1],
+                **d)
+        parser.add_argument(
+            'index',
+            type=str,
+            help='directory of the hash index (created if it does not exist)')
+        parser.add_argument(
+            'originals',
+            type=str,
+            nargs='*',
+            help='image files to look for in the index')
+        args = parser.parse_args()
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
+            try:
+                log_level = getattr(logging, args_log_level)
+            except AttributeError:
+                logging.error(
+                    "command line option to set log_level failed "
+                    "because '%s' is not a valid level name; using %s"
+                    % (args_log_level, log_level_name))
+        elif args.veryverbose:
+            log_level = logging.INFO
+        elif args.verbose:
+            log_level = logging.WARNING
+        elif args.quiet:
+            log_level = logging.CRITICAL
+        log_level_name = logging.getLevelName(log_level)
+        logging.basicConfig(level=log_level)
+        if log_level != DEFAULT_LOG_LEVEL:
+            logging.warning(
+                "logging level changed to %s via command line option"
+                % log_level_name)
+        else:
+            logging.info("using default logging level: %s" % log_level_name)
+        logging.debug("command line: '%s'" % ' '.join(sys.argv))
+        main(args)
+        sys.exit(0)
+    except KeyboardInterrupt as e:  # Ctrl-C
+        raise e
+    except SystemExit as e:  # sys.exit()
+        raise e
+    except Exception as e:
+        print("ERROR, UNEXPECTED EXCEPTION")
+        print(str(e))
+        traceback.print_exc()
+        os._exit(1)
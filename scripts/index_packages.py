@@ -0,0 +1,145 @@
+"""
+Index the packages in a collection and look them up in the index
+"""
+
+import argparse
+from isaw.awib.index import PackageIndex
+import json
+import logging
+import os
+import re
+import sys
+import traceback
+
+DEFAULT_LOG_LEVEL = logging.ERROR
+POSITIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR'],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)'],
+    ['-u', '--update', '',
+        'first index the new and changed packages in this collection '
+        'directory'],
+    ['-j', '--jobs', 1, 'number of worker processes for --update'],
+    ['-g', '--guid', '', 'find the package with this GUID'],
+    ['-n', '--name', '', 'find the package with this iptc_name'],
+    ['-s', '--status', '', 'find the packages with this status'],
+    ['-c', '--checksum', '',
+        'find the packages with a file that has this sha512 checksum'],
+    ['-p', '--package', '', 'show the index entry for this package'],
+    ['-q', '--quiet', False, 'do not report update counts']
+]
+
+
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(1)
+
+
+def main(args):
+    """
+    main function
+    """
+    criteria = {}
+    for option, column in [
+            ('guid', 'guid'), ('name', 'iptc_name'), ('status', 'status')]:
+        value = getattr(args, option)
+        if value != '':
+            criteria[column] = value
+    with PackageIndex(args.database) as index:
+        if args.update != '':
+            if not os.path.isdir(args.update):
+                erexit(
+                    'collection directory not found: {}'.format(args.update))
+            counts = index.update(args.update, args.jobs)
+            if not args.quiet:
+                print(json.dumps(counts, sort_keys=True), file=sys.stderr)
+        if args.checksum != '':
+            records = index.find_checksum(args.checksum)
+        elif args.package != '':
+            record = index.get(args.package)
+            records = [] if record is None else [record]
+        elif len(criteria) > 0:
+            records = index.find(**criteria)
+        else:
+            return
+        for record in records:
+            print(json.dumps(record, sort_keys=True))
+    if len(records) == 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    log_level = DEFAULT_LOG_LEVEL
+    log_level_name = logging.getLevelName(log_level)
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+    try:
+        parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        for p in POSITIONAL_ARGUMENTS:
+            d = {
+                'help': p[3]
+            }
+            if isinstance(p[2], bool):
+                if p[2] is False:
+                    d['action'] = 'store_true'
+                    d['default'] = False
+                else:
+                    d['action'] = 'store_false'
+                    d['default'] = True
+            elif isinstance(p[2], int):
+                d['type'] = int
+                d['default'] = p[2]
+            else:
+                d['default'] = p[2]
+            parser.add_argument(
+                p[0],
+                p[1],
+                **d)
+        parser.add_argument(
+            'database',
+            type=str,
+            help='path to the index database (created if it does not exist)')
+        args = parser.parse_args()
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
+            try:
+                log_level = getattr(logging, args_log_level)
+            except AttributeError:
+                logging.error(
+                    "command line option to set log_level failed "
+                    "because '%s' is not a valid level name; using %s"
+                    % (args_log_level, log_level_name))
+        elif args.veryverbose:
+            log_level = logging.INFO
+        elif args.verbose:
+            log_level = logging.WARNING
+        elif args.quiet:
+            log_level = logging.CRITICAL
+        log_level_name = logging.getLevelName(log_level)
+        logging.basicConfig(level=log_level)
+        if log_level != DEFAULT_LOG_LEVEL:
+            logging.warning(
+                "logging level changed to %s via command line option"
+                % log_level_name)
+        else:
+            logging.info("using default logging level: %s" % log_level_name)
+        logging.debug("command line: '%s'" % ' '.join(sys.argv))
+        main(args)
+        sys.exit(0)
+    except KeyboardInterrupt as e:  # Ctrl-C
+        raise e
+    except SystemExit as e:  # sys.exit()
+        raise e
+    except Exception as e:
+        print("ERROR, UNEXPECTED EXCEPTION")
+        print(str(e))
+        traceback.print_exc()
+        os._exit(1)
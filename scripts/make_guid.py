@@ -1,17 +1,17 @@
 """
-Make a master image for an existing original
+Make GUIDs for image packages and, optionally, assign them
 """
 
 import argparse
+from isaw.awib.accession import get_agent
+from isaw.awib.exiftool import ExifTool, ExifToolError
+from isaw.awib.guid import assign_guid, DEFAULT_HOSTNAME, package_guid
 import logging
 from lxml import etree
 import os
-from os.path import isfile, isdir, join, realpath, split, splitext
 import re
-from slugify import slugify
 import sys
 import traceback
-import uuid
 
 DEFAULT_LOG_LEVEL = logging.ERROR
 POSITIONAL_ARGUMENTS = [
@@ -21,40 +21,83 @@ POSITIONAL_ARGUMENTS = [
     ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
     ['-w', '--veryverbose', False,
         'very verbose output (logging level == DEBUG)'],
-    ['-m', '--hostname', 'images.isaw.nyu.edu', 'url hostname'],
-    ['-n', '--name', '', 'shortname for image']
+    ['-m', '--hostname', DEFAULT_HOSTNAME, 'url hostname'],
+    ['-n', '--name', '', 'shortname for image (only for a single package)'],
+    ['-f', '--list', '',
+        'file listing more package paths, one per line'],
+    ['-a', '--assign', False,
+        'write each GUID to the DigitalImageGUID tag of master.tif and to '
+        'metadata.xml']
 ]
 
 RX_WHITESPACE = re.compile(r'\s+')
 
 
-def get_text(tree, xpath):
-    return ' '.join(
-        etree.tostring(
-            tree.xpath(xpath)[0],
-            method="text",
-            encoding="unicode"
-        ).split())
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(1)
+
+
+def read_list(path):
+    """
+    return the package paths listed in file path, skipping blank lines and
+    comments
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line != '' and not line.startswith('#')]
+
+
+def process_package(pkg_path, args, exiftool=None, agent=None):
+    """
+    return the GUID of the package at pkg_path and, if exiftool (an ExifTool
+    session) is given, assign it
+    """
+    if exiftool is None:
+        return package_guid(pkg_path, args.name, args.hostname)
+    return assign_guid(pkg_path, exiftool, args.name, args.hostname, agent)
 
 
 def main(args):
     """
     main function
     """
-    logger = logging.getLogger(sys._getframe().f_code.co_name)
-    if args.name != '':
-        name = slugify(args.name.lower())
-    else:
-        pkg_path = realpath(args.pkg_path)
-        metapath = join(pkg_path, 'metadata.xml')
-        meta = etree.parse(metapath)
-        name = get_text(meta, "//iptc_name")
-    logger.debug('raw name: "{}"'.format(name))
-    name = 'https://{}/{}'.format(args.hostname, name)
-    logger.debug('full name: "{}"'.format(name))
-    guid = uuid.uuid5(uuid.NAMESPACE_URL, name)
-    logger.debug('guid: "{}"'.format(guid))
-    print(guid.urn)
+    pkg_paths = list(args.pkg_paths)
+    if args.list != '':
+        pkg_paths.extend(read_list(args.list))
+    if len(pkg_paths) == 0:
+        erexit('no packages given')
+    if args.name != '' and len(pkg_paths) > 1:
+        erexit('--name can only be used with a single package')
+    exiftool = None
+    agent = None
+    if args.assign:
+        agent = get_agent()
+        try:
+            exiftool = ExifTool()
+        except ExifToolError as e:
+            erexit(str(e))
+    failed = 0
+    try:
+        for pkg_path in pkg_paths:
+            try:
+                guid = process_package(pkg_path, args, exiftool, agent)
+            except (
+                    ExifToolError, IndexError, OSError,
+                    etree.XMLSyntaxError) as e:
+                eprint('{}: {}'.format(pkg_path, e))
+                failed += 1
+                continue
+            print(guid.urn)
+    finally:
+        if exiftool is not None:
+            exiftool.close()
+    if failed > 0:
+        erexit('{} of {} packages failed'.format(failed, len(pkg_paths)))
 
 
 if __name__ == "__main__":
@@ -69,7 +112,7 @@ if __name__ == "__main__":
             d = {
                 'help': p[3]
             }
-            if type(p[2]) == bool:
+            if isinstance(p[2], bool):
                 if p[2] is False:
                     d['action'] = 'store_true'
                     d['default'] = False
@@ -82,20 +125,14 @@ if __name__ == "__main__":
                 p[0],
                 p[1],
                 **d)
-        # example positional argument
-        # parser.add_argument(
-        #     'foo',
-        #     metavar='N',
-        #     type=str,
-        #     nargs='1',
-        #     help="foo is better than bar except when it isn't")
         parser.add_argument(
-            'pkg_path',
+            'pkg_paths',
             type=str,
-            help='path to image package')
+            nargs='*',
+            help='paths to image packages')
         args = parser.parse_args()
-        if args.loglevel is not 'NOTSET':
-            args_log_level = re.sub('\s+', '', args.loglevel.strip().upper())
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
             try:
                 log_level = getattr(logging, args_log_level)
             except AttributeError:
@@ -15,19 +15,11 @@ then
 fi
 pkgpath="$1"
 name="${2// }"
-metapath="$pkgpath"'/metadata.xml'
-realname=$(finger `whoami` | awk -F: '{ print $3 }' | head -n1 | sed 's/^ //')
 
-here="$(dirname "${BASH_SOURCE[0]}")"
 if [ "$name" ]; then
-    guid=$(python "$PYTHONPATH"'/scripts/make_guid.py' "$pkgpath")
+    guid=$(python "$PYTHONPATH"'/scripts/make_guid.py' -a -n "$name" "$pkgpath")
 else
-    guid=$(python "$PYTHONPATH"'/scripts/make_guid.py' -n "$name" "$pkgpath")
+    guid=$(python "$PYTHONPATH"'/scripts/make_guid.py' -a "$pkgpath")
 fi
-exiftool -q -DigitalImageGUID="$guid" "$pkgpath"'/master.tif'
-rm "$pkgpath"'/master.tif_original'
-cp -p "$metapath" "$metapath".bak
-saxon -s:"$metapath" -xsl:"$here"/setmetaval.xsl -o:"$metapath" agent="$realname" target=guid value="$guid"
-rm "$metapath".bak
 echo 'assigned unique identifier (GUID): '"$guid"
 exit
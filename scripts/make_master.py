@@ -3,8 +3,11 @@ Make a master image for an existing original
 """
 
 import argparse
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
 from functools import wraps
-from isaw.awib.conversions import MasterMaker
+from isaw.awib.conversions import MasterMaker, StageStats, summarize_stages
+from isaw.awib.streaming import COMPRESSIONS, compression_available
 from isaw.awib import image_types
 import logging
 import os
@@ -22,8 +25,40 @@ POSITIONAL_ARGUMENTS = [
     ['-w', '--veryverbose', False,
         'very verbose output (logging level == DEBUG)'],
     ['-x', '--overwrite', False, 'overwite existing destination file'],
-    ['-q', '--quiet', False, 'suppress all messages to stdout']
+    ['-q', '--quiet', False, 'suppress all messages to stdout'],
+    ['-j', '--jobs', 1,
+        'number of worker processes to use when original is a directory'],
+    ['-b', '--bandsize', 0,
+        'convert and write the master in bands of at most this many MiB '
+        'instead of decoding the whole original at once (0 = off)'],
+    ['-p', '--profile-stages', False,
+        'print percentiles of the time taken by each stage of making the '
+        'masters'],
+    ['-c', '--compression', 'none',
+        'lossless compression of the master: none, lzw, adobe_deflate, '
+        'deflate, zstd, lzma or packbits'],
+    ['-t', '--tilesize', 0,
+        'write the master in square tiles of this many pixels (a multiple of '
+        '16) instead of strips (0 = strips)'],
+    ['-B', '--bigtiff', False,
+        'always write a BigTIFF (masters too large for a classic TIFF are '
+        'written as BigTIFF anyway)'],
+    ['-y', '--pyramid', False,
+        'follow the master with reduced-resolution copies at halving scales '
+        '(a pyramidal TIFF)'],
+    ['-m', '--metadata', False,
+        'carry the EXIF, XMP and IPTC metadata embedded in the original '
+        'into the master']
 ]
+# number of queued files per worker process in batch mode; bounds how many
+# decoded images can be in flight at once
+JOB_QUEUE_DEPTH = 2
+# the MasterMaker that makes every master in this process (see get_maker)
+_maker = None
+
+
+class MasterError(Exception):
+    pass
 
 
 def arglogger(func):
@@ -47,16 +82,138 @@ def erexit(msg):
     sys.exit(1)
 
 
-def make_masters(src, dest, overwrite):
+def make_masters(
+        src, dest, overwrite, jobs=1, quiet=False, band_size=None,
+        profile_stages=False, save_options=None):
     if isfile(dest):
         erexit('Destination must be a directory if source is a directory')
     file_list = [fn for fn in os.listdir(src) if isfile(join(src, fn))]
     file_list = [fn for fn in file_list if image_types.is_valid_filename(fn)]
+    file_list = [join(src, fn) for fn in sorted(file_list)]
+    # originals that differ only by extension would race to write the same
+    # master when handled in parallel, so only the first of them is made
+    seen = set()
+    unique = []
+    duplicates = []
     for fn in file_list:
-        make_a_master(join(src, fn), dest, overwrite)
+        name, extension = splitext(split(fn)[1])
+        if name in seen:
+            duplicates.append(fn)
+        else:
+            seen.add(name)
+            unique.append(fn)
+    file_list = unique
+    for fn in duplicates:
+        eprint(
+            '{}: skipped because another original has the same name'
+            ''.format(fn))
+    if jobs > 1:
+        results = _make_masters_parallel(
+            file_list, dest, overwrite, jobs, band_size, save_options)
+    else:
+        results = (
+            _make_a_master_job(fn, dest, overwrite, band_size, save_options)
+            for fn in file_list)
+    failures = 0
+    stats = []
+    for fn, outf, error, stage_stats in results:
+        if error is None:
+            stats.append(stage_stats)
+            if not quiet:
+                print('OK: {} -> {}'.format(fn, outf))
+        else:
+            failures += 1
+            eprint('{}: {}'.format(fn, error))
+    if profile_stages:
+        print_stage_summary(stats)
+    failures += len(duplicates)
+    if failures > 0:
+        erexit(
+            '{} of {} files could not be converted'
+            ''.format(failures, len(file_list) + len(duplicates)))
 
 
-def make_a_master(src, dest, overwrite):
+def _make_masters_parallel(
+        file_list, dest, overwrite, jobs, band_size, save_options):
+    """
+    generate results from a process pool, keeping at most JOB_QUEUE_DEPTH
+    files per worker submitted at any one time
+    """
+    pending = set()
+    files = iter(file_list)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for fn in files:
+                pending.add(
+                    executor.submit(
+                        _make_a_master_job, fn, dest, overwrite, band_size,
+                        save_options))
+                if len(pending) >= jobs * JOB_QUEUE_DEPTH:
+                    break
+            if len(pending) == 0:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def _make_a_master_job(src, dest, overwrite, band_size, save_options):
+    """
+    make a master, returning a (src, outf, error, stage stats) tuple instead
+    of raising
+    """
+    stats = StageStats()
+    try:
+        outf = make_a_master(
+            src, dest, overwrite, band_size, stats, save_options)
+    except Exception as e:
+        return (src, None, '{}: {}'.format(type(e).__name__, e), None)
+    return (src, outf, None, stats.as_dict())
+
+
+def print_stage_summary(stats):
+    """
+    print per-stage percentiles of wall-clock and CPU seconds per master
+    """
+    summary = summarize_stages(stats)
+    print(
+        '{:<16} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10} {:>9}'
+        ''.format(
+            'stage', 'masters', 'calls', 'wall p50', 'wall p90', 'wall p99',
+            'wall max', 'wall total', 'cpu total', 'MiB/s'))
+    for stage, s in summary.items():
+        wall = s['wall']
+        if wall['total'] > 0 and s['bytes']['total'] > 0:
+            rate = '{:.1f}'.format(s['bytes']['total'] / wall['total'] / 2**20)
+        else:
+            rate = '-'
+        print(
+            '{:<16} {:>7} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>10.3f} '
+            '{:>10.3f} {:>9}'
+            ''.format(
+                stage, s['masters'], s['calls'], wall[50], wall[90], wall[99],
+                wall[100], wall['total'], s['cpu']['total'], rate))
+
+
+def get_maker():
+    """
+    return this process's MasterMaker, made on first use, so that its
+    profiles, transforms and buffers are reused from one original to the
+    next
+    """
+    global _maker
+    if _maker is None:
+        _maker = MasterMaker(discard_original=True)
+    return _maker
+
+
+def make_a_master(
+        src, dest, overwrite, band_size=None, stats=None, save_options=None):
+    """
+    make a master for src in dest; save_options are passed to
+    MasterMaker.save() or MasterMaker.stream()
+    """
+    save_options = save_options or {}
     head, tail = split(src)
     name, extension = splitext(tail)
     if isdir(dest):
@@ -64,19 +221,18 @@ def make_a_master(src, dest, overwrite):
     else:
         outf = dest
     if isfile(outf) and not overwrite:
-        erexit('Destination file exists: "{}"'.format(outf))
+        raise MasterError('Destination file exists: "{}"'.format(outf))
     else:
         logging.warning(
             'Destination file will be overwritten: "{}"'.format(outf))
     head, tail = split(outf)
     name, extension = splitext(tail)
     if extension != '.tif':
-        erexit(
+        raise MasterError(
             'Destination (output) must be a TIFF file ending in ".tif"')
-    m = MasterMaker(src)
-    m.make()
-    m.save(outf)
+    get_maker().process(src, outf, band_size, stats, **save_options)
     # logging.info('Saved master version of {} as {}'.format(src, outf))
+    return outf
 
 
 @arglogger
@@ -88,12 +244,39 @@ def main(args):
     src = realpath(args.original)
     dest = realpath(args.destination)
 
+    if args.jobs < 1:
+        erexit('Number of jobs must be at least 1')
+    band_size = args.bandsize * 1024 * 1024
+    save_options = {}
+    if args.compression != 'none':
+        if args.compression not in COMPRESSIONS:
+            erexit('Unknown compression: {}'.format(args.compression))
+        if not compression_available(args.compression):
+            erexit('{} compression is not available'.format(args.compression))
+        save_options['compression'] = args.compression
+    if args.tilesize:
+        save_options['tile_size'] = args.tilesize
+    if args.bigtiff:
+        save_options['bigtiff'] = True
+    if args.pyramid:
+        save_options['pyramid'] = True
+    if args.metadata:
+        save_options['carry_metadata'] = True
     if isdir(src):
-        make_masters(src, dest, args.overwrite)
+        make_masters(
+            src, dest, args.overwrite, args.jobs, args.quiet, band_size,
+            args.profile_stages, save_options)
     elif not isfile(src):
         erexit('Original (input) file not found: "{}"'.format(src))
     else:
-        make_a_master(src, dest, args.overwrite)
+        stats = StageStats()
+        try:
+            make_a_master(
+                src, dest, args.overwrite, band_size, stats, save_options)
+        except MasterError as e:
+            erexit(str(e))
+        if args.profile_stages:
+            print_stage_summary([stats])
 
 if __name__ == "__main__":
     log_level = DEFAULT_LOG_LEVEL
@@ -114,6 +297,9 @@ if __name__ == "__main__":
                 else:
                     d['action'] = 'store_false'
                     d['default'] = True
+            elif type(p[2]) == int:
+                d['type'] = int
+                d['default'] = p[2]
             else:
                 d['default'] = p[2]
             parser.add_argument(
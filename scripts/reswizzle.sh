@@ -68,27 +68,21 @@ extract_metadata() {
 }
 
 safecopy () {
-    cp -p $1 $2
-    local src_sum=$(gmd5sum -b "$1" | awk '{print $1;}')
-    local dest_sum=$(gmd5sum -b "$2" | awk '{print $1}')
-    if [ "$src_sum" != "$dest_sum" ]
-    then
-        echo "copy from $1 to $2 failed on checksum verification"
-        exit 40
-    fi
+    # copy, verify, and write the .sha512 checksum file in a single read pass
+    python "$PYTHONPATH/scripts/safecopy.py" -q "$1" "$2" || exit 40
+    local fn=$(basename "$2")
+    logit "$(dirname "$2")" 'generated checksum file '"${fn%.*}"'.sha512 for file '"$fn"
 }
 
 copy_master () {
     local from="${1}/masters/${2}-${3}-master.tif"
     local to="${4}/old_master.tif"
     safecopy $from $to
-    generate_checksums $to
     logit $4 "successfully copied $from to $(basename $to)"
     local from="${1}/masters/${2}-${3}-master-jhove.xml"
     local to="${4}/old_master_jhove.xml"
     safecopy $from $to
     logit $4 "copied $from to $(basename $to)"
-    generate_checksums $to
 }
 
 copy_meta () {
@@ -96,7 +90,6 @@ copy_meta () {
     local to="${4}/old_metadata.xml"
     safecopy $from $to
     logit $4 "copied $from to $(basename $to)"
-    generate_checksums $to
     saxon -s:"$to" -xsl:"$here"/update_metadata.xsl -o:"$4"/metadata.xml operator="$realname"
     # don't bother generating checksum now; wait till after guid generation 
 }
@@ -109,19 +102,16 @@ copy_original () {
         local from="${1}/originals/${2}-${3}-original.${ext}"
         local to="${4}/original.${ext}"
         safecopy $from $to
-        generate_checksums $to
         logit $4 "successfully copied $from to $(basename $to)"
     done
     local from="${1}/originals/${2}-${3}-original-jhove.xml"
     local to="${4}/original_jhove.xml"
     safecopy $from $to
     logit $4 "copied $from to $(basename $to)"
-    generate_checksums $to
     local from="${1}/originals/${2}-${3}-original-exiftool.xml"
     local to="${4}/original_exiftool.xml"
     safecopy $from $to
     logit $4 "copied $from to $(basename $to)"
-    generate_checksums $to
 }
 
 # loop through originals
@@ -0,0 +1,128 @@
+"""
+Copy a file, verify the copy and write its SHA-512 checksum file
+"""
+
+import argparse
+from isaw.awib.checksums import ChecksumError, safecopy, write_sidecar
+import logging
+import os
+import re
+import sys
+import traceback
+
+DEFAULT_LOG_LEVEL = logging.ERROR
+POSITIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR'],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)'],
+    ['-n', '--nosidecar', False, 'do not write a .sha512 checksum file'],
+    ['-f', '--fsync', False, 'flush the copy to disk before verifying it'],
+    ['-d', '--direct', False,
+        'flush the copy to disk and verify it with O_DIRECT reads'],
+    ['-q', '--quiet', False, 'suppress all messages to stdout']
+]
+
+
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(40)
+
+
+def main(args):
+    """
+    main function
+    """
+    if args.direct:
+        sync = 'direct'
+    elif args.fsync:
+        sync = 'fsync'
+    else:
+        sync = None
+    try:
+        digests = safecopy(args.source, args.destination, sync=sync)
+    except ChecksumError as e:
+        erexit(str(e))
+    if not args.nosidecar:
+        write_sidecar(args.destination, digests['sha512'])
+    if not args.quiet:
+        print(digests['sha512'])
+
+
+if __name__ == "__main__":
+    log_level = DEFAULT_LOG_LEVEL
+    log_level_name = logging.getLevelName(log_level)
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+    try:
+        parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        for p in POSITIONAL_ARGUMENTS:
+            d = {
+                'help': p[3]
+            }
+            if isinstance(p[2], bool):
+                if p[2] is False:
+                    d['action'] = 'store_true'
+                    d['default'] = False
+                else:
+                    d['action'] = 'store_false'
+                    d['default'] = True
+            else:
+                d['default'] = p[2]
+            parser.add_argument(
+                p[0],
+                p[1],
+                **d)
+        parser.add_argument(
+            'source',
+            type=str,
+            help='path to file to copy')
+        parser.add_argument(
+            'destination',
+            type=str,
+            help='path to copy')
+        args = parser.parse_args()
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
+            try:
+                log_level = getattr(logging, args_log_level)
+            except AttributeError:
+                logging.error(
+                    "command line option to set log_level failed "
+                    "because '%s' is not a valid level name; using %s"
+                    % (args_log_level, log_level_name))
+        elif args.veryverbose:
+            log_level = logging.INFO
+        elif args.verbose:
+            log_level = logging.WARNING
+        elif args.quiet:
+            log_level = logging.CRITICAL
+        log_level_name = logging.getLevelName(log_level)
+        if not args.quiet:
+            print('log level is {}'.format(log_level_name))
+        logging.basicConfig(level=log_level)
+        if log_level != DEFAULT_LOG_LEVEL:
+            logging.warning(
+                "logging level changed to %s via command line option"
+                % log_level_name)
+        else:
+            logging.info("using default logging level: %s" % log_level_name)
+        logging.debug("command line: '%s'" % ' '.join(sys.argv))
+        main(args)
+        sys.exit(0)
+    except KeyboardInterrupt as e:  # Ctrl-C
+        raise e
+    except SystemExit as e:  # sys.exit()
+        raise e
+    except Exception as e:
+        print("ERROR, UNEXPECTED EXCEPTION")
+        print(str(e))
+        traceback.print_exc()
+        os._exit(1)
@@ -0,0 +1,142 @@
+"""
+Validate one or more AWIB image packages
+"""
+
+import argparse
+from isaw.awib.validate import ChecksumCache, find_packages, validate_packages
+import json
+import logging
+import os
+import re
+import sys
+import traceback
+
+DEFAULT_LOG_LEVEL = logging.ERROR
+POSITIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR'],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)'],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)'],
+    ['-c', '--collection', False,
+        'treat each path as a collection of package directories'],
+    ['-j', '--jobs', 1, 'number of worker processes'],
+    ['-k', '--cache', '',
+        'path to checksum cache database (created if it does not exist)'],
+    ['-f', '--fast', False,
+        'skip hashing files that are unchanged since their checksums were '
+        'last verified (requires --cache)'],
+    ['-q', '--quiet', False, 'only report invalid packages']
+]
+
+
+def eprint(msg):
+    print('ERROR: {}'.format(msg), file=sys.stderr)
+
+
+def erexit(msg):
+    eprint(msg)
+    sys.exit(1)
+
+
+def main(args):
+    """
+    main function
+    """
+    if args.fast and args.cache == '':
+        erexit('--fast requires --cache')
+    if args.collection:
+        paths = []
+        for collection in args.paths:
+            paths.extend(find_packages(collection))
+    else:
+        paths = args.paths
+    cache = ChecksumCache(args.cache) if args.cache != '' else None
+    invalid = 0
+    try:
+        for report in validate_packages(paths, args.jobs, cache, args.fast):
+            del report['verified']
+            if not report['valid']:
+                invalid += 1
+            elif args.quiet:
+                continue
+            print(json.dumps(report, sort_keys=True))
+    finally:
+        if cache is not None:
+            cache.close()
+    if invalid > 0:
+        eprint('{} of {} packages are INVALID'.format(invalid, len(paths)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    log_level = DEFAULT_LOG_LEVEL
+    log_level_name = logging.getLevelName(log_level)
+    logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
+    try:
+        parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        for p in POSITIONAL_ARGUMENTS:
+            d = {
+                'help': p[3]
+            }
+            if isinstance(p[2], bool):
+                if p[2] is False:
+                    d['action'] = 'store_true'
+                    d['default'] = False
+                else:
+                    d['action'] = 'store_false'
+                    d['default'] = True
+            elif isinstance(p[2], int):
+                d['type'] = int
+                d['default'] = p[2]
+            else:
+                d['default'] = p[2]
+            parser.add_argument(
+                p[0],
+                p[1],
+                **d)
+        parser.add_argument(
+            'paths',
+            type=str,
+            nargs='+',
+            help='paths to package (or, with --collection, collection) '
+                 'directories')
+        args = parser.parse_args()
+        if args.loglevel != 'NOTSET':
+            args_log_level = re.sub(r'\s+', '', args.loglevel.strip().upper())
+            try:
+                log_level = getattr(logging, args_log_level)
+            except AttributeError:
+                logging.error(
+                    "command line option to set log_level failed "
+                    "because '%s' is not a valid level name; using %s"
+                    % (args_log_level, log_level_name))
+        elif args.veryverbose:
+            log_level = logging.INFO
+        elif args.verbose:
+            log_level = logging.WARNING
+        elif args.quiet:
+            log_level = logging.CRITICAL
+        log_level_name = logging.getLevelName(log_level)
+        logging.basicConfig(level=log_level)
+        if log_level != DEFAULT_LOG_LEVEL:
+            logging.warning(
+                "logging level changed to %s via command line option"
+                % log_level_name)
+        else:
+            logging.info("using default logging level: %s" % log_level_name)
+        logging.debug("command line: '%s'" % ' '.join(sys.argv))
+        main(args)
+        sys.exit(0)
+    except KeyboardInterrupt as e:  # Ctrl-C
+        raise e
+    except SystemExit as e:  # sys.exit()
+        raise e
+    except Exception as e:
+        print("ERROR, UNEXPECTED EXCEPTION")
+        print(str(e))
+        traceback.print_exc()
+        os._exit(1)
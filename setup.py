@@ -37,7 +37,9 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
         'Pillow',
-        'nose'
+        'nose',
+        'numpy',
+        'requests'
         ],
 
     # List additional groups of dependencies here (e.g. development
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+a stand-in for exiftool in -stay_open mode, for tests: tags written with
+-TAG=VALUE or copied with -tagsfromfile are kept in FILE.tags.json, and -X
+and -j report them
+"""
+
+import json
+import os
+import sys
+from xml.sax.saxutils import escape, quoteattr
+
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+SYSTEM = 'http://ns.exiftool.ca/File/System/1.0/'
+XMP = 'http://ns.exiftool.ca/XMP/XMP/1.0/'
+
+
+def read_tags(path):
+    sidecar = path + '.tags.json'
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return json.load(f)
+    return {}
+
+
+def run(args):
+    files = []
+    tags = {}
+    echo = []
+    source = None
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('-echo'):
+            echo.append((arg[-1], args[i + 1]))
+            i += 1
+        elif arg == '-tagsfromfile':
+            source = args[i + 1]
+            i += 1
+        elif arg.startswith('-') and '=' in arg:
+            tag, value = arg[1:].split('=', 1)
+            tags[tag] = value
+        elif not arg.startswith('-'):
+            files.append(arg)
+        i += 1
+    if source is not None:
+        tags.update(read_tags(source))
+    reports = []
+    for path in files:
+        if not os.path.isfile(path):
+            print('Error: File not found - {}'.format(path), file=sys.stderr)
+            continue
+        stored = read_tags(path)
+        if len(tags) > 0:
+            stored.update(tags)
+            with open(path + '.tags.json', 'w') as f:
+                json.dump(stored, f)
+        reports.append((path, stored))
+    if '-X' in args and len(reports) > 0:
+        print("<?xml version='1.0' encoding='UTF-8'?>")
+        print("<rdf:RDF xmlns:rdf='{}'>".format(RDF))
+        for path, stored in reports:
+            print(
+                '<rdf:Description rdf:about={} xmlns:System={} '
+                'xmlns:XMP={}>'.format(
+                    quoteattr(path), quoteattr(SYSTEM), quoteattr(XMP)))
+            print(' <System:FileName>{}</System:FileName>'.format(
+                escape(os.path.basename(path))))
+            for k, v in sorted(stored.items()):
+                print(' <XMP:{0}>{1}</XMP:{0}>'.format(k, escape(v)))
+            print('</rdf:Description>')
+        print('</rdf:RDF>')
+    elif '-j' in args and len(reports) > 0:
+        print(json.dumps(
+            [dict(stored, SourceFile=path) for path, stored in reports]))
+    for n, text in echo:
+        print(text, file=sys.stderr if n in '24' else sys.stdout)
+
+
+def main():
+    args = []
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        if line.startswith('-execute'):
+            run(args)
+            args = []
+            print('{{ready{}}}'.format(line[len('-execute'):]))
+            sys.stdout.flush()
+            sys.stderr.flush()
+        elif line == 'False' and args[-1:] == ['-stay_open']:
+            return
+        else:
+            args.append(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from isaw.awib.accession import accession, AccessionError
+from isaw.awib.checksums import sha512_file
+import logging
+from nose.tools import assert_equal, assert_in, assert_raises, assert_true
+from os import listdir, mkdir
+from os.path import dirname, isfile, join, realpath
+from shutil import rmtree
+
+
+class TestAccession():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_accession(self):
+        src = join(self.data_dir, 'cat_drawer.jpg')
+        package = accession(
+            src, self.scratch_dir, 'drawer test', agent='Test Agent',
+            external_tools=False)
+        assert_equal(package.path, join(self.scratch_dir, 'drawertest'))
+        assert_equal(
+            sorted(listdir(package.path)),
+            ['history.log', 'master.sha512', 'master.tif', 'original.jpg',
+                'original.sha512'])
+        for name, fn in [('original', 'original.jpg'),
+                         ('master', 'master.tif')]:
+            with open(package.join('{}.sha512'.format(name))) as f:
+                assert_equal(
+                    f.read(),
+                    '{}  {}\n'.format(sha512_file(package.join(fn)), fn))
+        assert_equal(sha512_file(src), sha512_file(package.join(
+            'original.jpg')))
+        with open(package.join('history.log')) as f:
+            history = f.read()
+        assert_in('created by Test Agent', history)
+        assert_in('ACCESSION COMPLETE', history)
+
+    def test_missing_original(self):
+        with assert_raises(AccessionError):
+            accession(
+                join(self.data_dir, 'nonesuch.jpg'), self.scratch_dir,
+                external_tools=False)
+        assert_true(not isfile(join(self.scratch_dir, 'nonesuch')))
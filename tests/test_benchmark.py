@@ -0,0 +1,92 @@
+from copy import deepcopy
+from isaw.awib import benchmark
+import json
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_true
+from os import listdir, mkdir
+from os.path import dirname, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+
+class TestBenchmark():
+
+    def setUp(self):
+        self.scratch_dir = join(dirname(realpath(__file__)), 'data', 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_writable_formats(self):
+        formats = benchmark.writable_formats()
+        for fmt in ['JPEG', 'PNG', 'TIFF']:
+            assert_in(fmt, formats)
+        for fmt in ['ICO', 'PSD', 'RAW']:
+            assert_not_in(fmt, formats)
+
+    def test_synthetic_image(self):
+        for mode, im_mode in [('8bit', 'RGB'), ('16bit', 'I;16'),
+                              ('palette', 'P')]:
+            im = benchmark.synthetic_image(0.01, mode)
+            assert_equal(im.mode, im_mode)
+            assert_equal(im.size, benchmark.dimensions(0.01))
+
+    def test_run(self):
+        report = benchmark.run(
+            ['JPEG', 'TIFF'], ['8bit', 'palette'], [0.01],
+            directory=self.scratch_dir)
+        json.dumps(report)
+        assert_equal(len(report['results']), 4)
+        results = {(r['format'], r['mode']): r for r in report['results']}
+        tiff = results[('TIFF', '8bit')]
+        assert_true(tiff['make_seconds'] > 0)
+        assert_true(tiff['peak_rss'] >= tiff['baseline_rss'] > 0)
+        assert_in('apply_transform', tiff['stages'])
+        assert_in('error', results[('JPEG', 'palette')])
+        assert_equal(listdir(self.scratch_dir), [])
+
+        assert_equal(benchmark.compare(report, report), [])
+        slower = deepcopy(report)
+        for r in slower['results']:
+            if 'error' not in r:
+                r['save_seconds'] *= 2
+        regressions = benchmark.compare(report, slower)
+        assert_equal(len(regressions), 3)
+        assert_equal(regressions[0][3], 'save_seconds')
+
+    def test_run_16bit(self):
+        report = benchmark.run(
+            ['PNG', 'TIFF'], ['16bit'], [0.01], directory=self.scratch_dir)
+        for r in report['results']:
+            assert_not_in('error', r)
+            assert_true(r['make_seconds'] > 0)
+
+    def test_measure_large(self):
+        # measure() as run for sizes over Pillow's pixel limit, which is
+        # lowered here so that the original can stay small
+        original = benchmark.write_original(
+            benchmark.synthetic_image(0.01, '8bit'), 'TIFF', self.scratch_dir)
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            result = benchmark.measure(
+                original, join(self.scratch_dir, 'master.tif'))
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        assert_true(result['make_seconds'] > 0)
+        assert_true(result['master_bytes'] > 0)
+
+    def test_save_options(self):
+        report = benchmark.run_save_options(
+            [0.01], [{}, {'compression': 'lzw'}], directory=self.scratch_dir)
+        results = report['save_results']
+        assert_equal([r['options'] for r in results],
+                     [{}, {'compression': 'lzw'}])
+        for r in results:
+            assert_equal(r['megapixels'], 0.01)
+            assert_true(r['bytes'] > 0)
+        assert_true(results[1]['bytes'] < results[0]['bytes'])
+        assert_equal(listdir(self.scratch_dir), [])
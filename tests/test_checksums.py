@@ -0,0 +1,53 @@
+from hashlib import md5, sha512
+from isaw.awib.checksums import (hash_file, read_sidecar, safecopy,
+                                 sidecar_path, write_sidecar)
+import logging
+from nose.tools import assert_equal
+from os import mkdir, stat
+from os.path import dirname, join, realpath
+from shutil import rmtree
+
+
+class TestChecksums():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+        self.src = join(self.data_dir, 'cat_drawer.tif')
+        with open(self.src, 'rb') as f:
+            data = f.read()
+        self.expected = {
+            'md5': md5(data).hexdigest(),
+            'sha512': sha512(data).hexdigest()}
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_hash_file(self):
+        assert_equal(hash_file(self.src, chunk_size=4096), self.expected)
+        assert_equal(hash_file(self.src, direct=True), self.expected)
+
+    def test_safecopy(self):
+        for sync in [None, 'fsync', 'direct']:
+            dest = join(self.scratch_dir, 'original.tif')
+            digests = safecopy(self.src, dest, chunk_size=10000, sync=sync)
+            assert_equal(digests, self.expected)
+            assert_equal(hash_file(dest), self.expected)
+            assert_equal(stat(dest).st_mtime, stat(self.src).st_mtime)
+
+    def test_sidecar(self):
+        dest = join(self.scratch_dir, 'original.tif')
+        safecopy(self.src, dest)
+        shapath = write_sidecar(dest)
+        assert_equal(shapath, join(self.scratch_dir, 'original.sha512'))
+        assert_equal(shapath, sidecar_path(dest))
+        with open(shapath) as f:
+            assert_equal(
+                f.read(), '{}  original.tif\n'.format(self.expected['sha512']))
+        assert_equal(read_sidecar(shapath), self.expected['sha512'])
@@ -1,9 +1,13 @@
-from io import BytesIO
-from isaw.awib.conversions import MasterMaker
+from io import BytesIO, StringIO
+from isaw.awib.conversions import (MasterMaker, open_trusted,
+                                   summarize_stages, TRANSFORM_CACHE)
+from isaw.awib.streaming import is_raw_tiff
+import json
 import logging
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_in, assert_raises, assert_true
 from os import listdir, mkdir
-from os.path import abspath, dirname, isfile, join, realpath, splitext
+from os.path import (abspath, dirname, getsize, isfile, join, realpath,
+                     splitext)
 from PIL import Image
 from PIL.ImageCms import getOpenProfile, getProfileName
 from PIL.ImageStat import Stat
@@ -116,3 +120,270 @@ class TestMakeConversions():
                 getProfileName(
                     getOpenProfile(BytesIO(master.info['icc_profile']))),
                 getProfileName(profile_target))
+
+    def test_transform_cache(self):
+        TRANSFORM_CACHE.clear()
+        for i in range(3):
+            maker = MasterMaker(join(self.data_dir, 'cat_drawer.tif'))
+            maker.make()
+        assert_equal(TRANSFORM_CACHE.misses, 1)
+        assert_equal(TRANSFORM_CACHE.hits, 2)
+        maker = MasterMaker(join(self.data_dir, 'cat_drawer_adobe.tif'))
+        maker.make()
+        assert_equal(TRANSFORM_CACHE.misses, 2)
+        assert_equal(len(TRANSFORM_CACHE), 2)
+
+    def test_master_maker_stream(self):
+        for fn in self.file_list:
+            self.logger.debug('stream test handling file {}'.format(fn))
+            master = MasterMaker(join(self.data_dir, fn)).make()
+            path_out = join(self.data_dir, 'scratch', 'stream.tif')
+            maker = MasterMaker(join(self.data_dir, fn))
+            maker.stream(path_out, band_size=100000)
+            im_out = Image.open(path_out)
+            assert_equal(im_out.format, 'TIFF')
+            assert_equal(im_out.size, master.size)
+            assert_equal(im_out.tobytes(), master.tobytes())
+            assert_equal(
+                im_out.info['icc_profile'], master.info['icc_profile'])
+            im_out.close()
+
+    def test_large_original(self):
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            path = join(self.data_dir, 'cat_drawer.tif')
+            path_out = join(self.data_dir, 'scratch', 'stream.tif')
+            maker = MasterMaker(path)
+            maker.stream(path_out, band_size=100000)
+            maker = MasterMaker(path)
+            master = maker.make()
+            assert_equal(Image.MAX_IMAGE_PIXELS, 1000)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        with Image.open(path_out) as im_out:
+            assert_equal(im_out.tobytes(), master.tobytes())
+
+    def test_open_trusted(self):
+        path = join(self.data_dir, 'cat_drawer.tif')
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            with open_trusted(path) as im:
+                assert_equal(Image.MAX_IMAGE_PIXELS, 1000)
+                assert_equal(im.format, 'TIFF')
+                assert_true(is_raw_tiff(im))
+                expected = Image.frombytes(
+                    im.mode, im.size, im.tobytes())
+            with open(path, 'rb') as f:
+                with open_trusted(f) as im:
+                    assert_equal(im.tobytes(), expected.tobytes())
+            with assert_raises(Image.UnidentifiedImageError):
+                open_trusted(
+                    join(self.data_dir, 'metadata', 'original_jhove.xml'))
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        with assert_raises(Image.DecompressionBombError):
+            open_trusted(path, max_pixels=1000)
+
+    def test_16bit_grayscale(self):
+        gradient = Image.linear_gradient('L').resize((64, 64))
+        im = gradient.convert('I').point(lambda i: i * 257)
+        for mode in ['I', 'I;16']:
+            master = MasterMaker(im.convert(mode)).make()
+            assert_equal(master.mode, 'RGB')
+            # scaled to 8 bits, not clipped
+            assert_equal(Stat(master).extrema[0], Stat(
+                MasterMaker(gradient).make()).extrema[0])
+
+    def test_discard_original(self):
+        for fn in ['cat_drawer.tif', 'cat_drawer_adobe.tif']:
+            expected = MasterMaker(join(self.data_dir, fn)).make()
+            im = Image.open(join(self.data_dir, fn))
+            im.load()
+            maker = MasterMaker(im, discard_original=True)
+            master = maker.make()
+            assert_true(master is maker.original)
+            assert_equal(master.tobytes(), expected.tobytes())
+            assert_equal(
+                master.info['icc_profile'], expected.info['icc_profile'])
+        im = self.images['cat_drawer.tif']
+        maker = MasterMaker(im)
+        master = maker.make()
+        assert_true(master is not im)
+
+    def test_history(self):
+        maker = MasterMaker(join(self.data_dir, 'cat_drawer_adobe.tif'))
+        maker.make()
+        history = maker.get_history()
+        assert_true(len(history) > 1)
+        assert_equal(
+            history[-1][1],
+            'Original ICC profile (Adobe RGB (1998)) was converted to the '
+            'standard target (ProPhoto - little cms).')
+        times = [t for t, msg, data in history]
+        assert_equal(times, sorted(times))
+        f = StringIO()
+        assert_equal(maker.export_history(f), len(history))
+        lines = [json.loads(line) for line in f.getvalue().splitlines()]
+        assert_equal([r['message'] for r in lines], [h[1] for h in history])
+        assert_equal(len(maker.get_history()), 0)
+        maker = MasterMaker(
+            join(self.data_dir, 'cat_drawer.tif'), history_size=2)
+        maker.make()
+        assert_equal(len(maker.get_history()), 2)
+
+    def test_log_level(self):
+        maker = MasterMaker(history_size=None)
+        maker.log('plain', logging.INFO)
+        maker.log('{} of {}', logging.WARNING, 1, 2, data={'n': 1})
+        maker.log('{} lazy', logging.DEBUG, 'still')
+        records = list(maker.history)
+        assert_equal(
+            [(r.level, r.message, r.data) for r in records],
+            [(logging.INFO, 'plain', None),
+             (logging.WARNING, '1 of 2', {'n': 1}),
+             (logging.DEBUG, 'still lazy', None)])
+
+    def test_stage_stats(self):
+        calls = []
+        maker = MasterMaker(
+            join(self.data_dir, 'cat_drawer_adobe.tif'),
+            stage_hook=lambda *args: calls.append(args))
+        maker.make()
+        maker.save(join(self.data_dir, 'scratch', 'stats.tif'))
+        stages = list(maker.stats)
+        for stage in ['open', 'decode', 'profile', 'apply_transform', 'save']:
+            assert_in(stage, stages)
+            assert_true(maker.stats[stage]['wall'] >= 0)
+        assert_equal(maker.stats['decode']['bytes'], 3 * 1024 * 721)
+        assert_equal([c[0] for c in calls], stages)
+        summary = summarize_stages([maker.stats, maker.stats.as_dict()])
+        assert_equal(summary['save']['masters'], 2)
+        assert_equal(
+            summary['save']['bytes']['total'],
+            2 * maker.stats['save']['bytes'])
+
+    def test_save_options(self):
+        maker = MasterMaker(join(self.data_dir, 'cat_drawer_adobe.tif'))
+        master = maker.make()
+        path = join(self.data_dir, 'scratch', 'options.tif')
+        maker.save(path)
+        size = getsize(path)
+        maker.save(path, compression='adobe_deflate', tile_size=256)
+        assert_true(getsize(path) < size)
+        im_out = Image.open(path)
+        assert_equal(im_out.tobytes(), master.tobytes())
+        assert_equal(im_out.info['icc_profile'], master.info['icc_profile'])
+        im_out.close()
+
+    def test_stream_pyramid(self):
+        path = join(self.data_dir, 'scratch', 'pyramid.tif')
+        master = MasterMaker(join(self.data_dir, 'cat_drawer.jpg')).make()
+        maker = MasterMaker(join(self.data_dir, 'cat_drawer.jpg'))
+        maker.stream(path, band_size=100000, tile_size=256, pyramid=True)
+        im_out = Image.open(path)
+        assert_equal(im_out.n_frames, 3)
+        assert_equal(im_out.tobytes(), master.tobytes())
+        im_out.seek(2)
+        assert_equal(im_out.tobytes(), master.reduce(2).reduce(2).tobytes())
+        assert_equal(im_out.info['icc_profile'], master.info['icc_profile'])
+        im_out.close()
+
+    def test_carry_metadata(self):
+        src = join(self.data_dir, 'cat_drawer.jpg')
+        original = Image.open(src)
+        exif = original.getexif()
+        master = MasterMaker(src).make()
+        for options in [{}, {'tile_size': 256, 'pyramid': True}]:
+            path = join(self.data_dir, 'scratch', 'metadata.tif')
+            maker = MasterMaker(src)
+            maker.make()
+            maker.save(path, carry_metadata=True, **options)
+            im_out = Image.open(path)
+            assert_equal(
+                dict(im_out.getexif().get_ifd(34665)),
+                dict(exif.get_ifd(34665)))
+            assert_equal(im_out.tobytes(), master.tobytes())
+            assert_equal(
+                im_out.info['icc_profile'], master.info['icc_profile'])
+            assert_equal(im_out.tag_v2[305], exif[305])
+            assert_true(im_out.tag_v2[700].startswith(b'<?xpacket'))
+            assert_equal(
+                im_out.tag_v2[33723], original.info['photoshop'][0x0404])
+            im_out.close()
+        maker = MasterMaker(src)
+        maker.stream(path, band_size=100000, carry_metadata=True)
+        im_out = Image.open(path)
+        assert_equal(im_out.tobytes(), master.tobytes())
+        assert_equal(im_out.tag_v2[306], exif[306])
+        im_out.close()
+        maker = MasterMaker(src)
+        maker.make()
+        maker.save(path)
+        im_out = Image.open(path)
+        assert_true(700 not in im_out.tag_v2)
+        im_out.close()
+        original.close()
+
+    def test_make_mapped(self):
+        for fn in ['cat_drawer.tif', 'cat_drawer_adobe.tif']:
+            path = join(self.data_dir, fn)
+            im = Image.open(path)
+            im.load()
+            expected = MasterMaker(im).make()
+            for discard_original in [False, True]:
+                maker = MasterMaker(path, discard_original=discard_original)
+                master = maker.make()
+                # the original was read through the map, never decoded in
+                # full
+                assert_true(maker.original.im is None)
+                assert_equal(master.tobytes(), expected.tobytes())
+                assert_equal(
+                    master.info['icc_profile'], expected.info['icc_profile'])
+
+    def test_process(self):
+        maker = MasterMaker()
+        scratch = join(self.data_dir, 'scratch')
+        fns = ['cat_drawer.tif', 'cat_drawer_adobe.tif', 'cat_drawer.jpg']
+        jobs = [
+            (join(self.data_dir, fn), join(scratch, '{}.tif'.format(i)))
+            for i, fn in enumerate(fns)]
+        jobs.append((join(self.data_dir, 'missing.tif'), join(scratch, 'x')))
+        results = list(maker.process_all(jobs))
+        assert_equal([r[0] for r in results], [j[0] for j in jobs])
+        for (src, dest), result in zip(jobs[:3], results):
+            assert_equal(result[1:3], (dest, None))
+            assert_equal(result[3]['open']['calls'], 1)
+            expected = MasterMaker(src).make()
+            im_out = Image.open(dest)
+            assert_equal(im_out.tobytes(), expected.tobytes())
+            assert_equal(
+                im_out.info['icc_profile'], expected.info['icc_profile'])
+            im_out.close()
+        assert_equal(results[3][1], None)
+        assert_in('FileNotFoundError', results[3][2])
+        assert_equal(
+            sorted(maker.profiles),
+            ['ProPhoto', 'sRGB2014'])
+        # the master of the JPEG is reused for one of the same size
+        maker.process(jobs[1][0], jobs[1][1])
+        messages = [m for t, m, d in maker.get_history()]
+        assert_in('Reusing the buffer of the previous master.', messages)
+        assert_equal(maker.stats['open']['calls'], 1)
+
+    def test_save_uncompressed(self):
+        scratch = join(self.data_dir, 'scratch')
+        im = Image.open(join(self.data_dir, 'cat_drawer_adobe.tif'))
+        for compression in ['jpeg', 'tiff_lzw']:
+            src = join(scratch, '{}.tif'.format(compression))
+            im.save(src, compression=compression)
+            for discard_original in [True, False]:
+                maker = MasterMaker(src, discard_original=discard_original)
+                maker.make()
+                path = join(scratch, 'master.tif')
+                maker.save(path)
+                im_out = Image.open(path)
+                assert_equal(im_out.info['compression'], 'raw')
+                im_out.close()
+        im.close()
@@ -0,0 +1,66 @@
+from isaw.awib.conversions import get_profile, MasterMaker
+from isaw.awib.derivatives import Derivative, make_derivatives, WEB_PROFILE
+import logging
+from nose.tools import assert_equal, assert_true
+from os import listdir, mkdir
+from os.path import dirname, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+
+class TestDerivatives():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_fit(self):
+        d = Derivative('preview', 800)
+        assert_equal(d.fit((1600, 1200)), (800, 600))
+        assert_equal(d.fit((300, 1200)), (200, 800))
+        assert_equal(d.fit((400, 300)), (400, 300))
+        assert_equal(Derivative('t', 100, 'PNG').filename, 't.png')
+
+    def test_make_derivatives(self):
+        maker = MasterMaker(join(self.data_dir, 'cat_drawer_adobe.tif'))
+        master = maker.make()
+        derivatives = [
+            Derivative('thumbnail', 200, 'PNG'),
+            Derivative('preview', 800),
+            Derivative('large', 5000, 'TIFF', srgb=False)]
+        paths = make_derivatives(master, self.scratch_dir, derivatives)
+        assert_equal(
+            sorted(listdir(self.scratch_dir)),
+            ['large.tif', 'preview.jpg', 'thumbnail.png'])
+        srgb = get_profile(WEB_PROFILE).tobytes()
+        for name, size, icc_profile in [
+                ('thumbnail', (200, 141), srgb),
+                ('preview', (800, 563), srgb),
+                ('large', master.size, master.info['icc_profile'])]:
+            im = Image.open(paths[name])
+            assert_equal(im.size, size)
+            assert_equal(im.info['icc_profile'], icc_profile)
+
+    def test_from_path(self):
+        # a JPEG is decoded at reduced scale and a pyramid read from its
+        # smallest large enough level; both give the same size as from memory
+        src = join(self.data_dir, 'cat_drawer.jpg')
+        pyramid = join(self.scratch_dir, 'pyramid.tif')
+        MasterMaker(src).stream(pyramid, pyramid=True)
+        for path in (src, pyramid):
+            paths = make_derivatives(
+                path, self.scratch_dir, [Derivative('preview', 300)])
+            im = Image.open(paths['preview'])
+            assert_equal(im.size, (300, 211))
+            assert_equal(im.mode, 'RGB')
+        assert_true(all(not fn.endswith('.tmp')
+                        for fn in listdir(self.scratch_dir)))
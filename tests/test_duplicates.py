@@ -0,0 +1,80 @@
+from isaw.awib.accession import accession
+from isaw.awib.duplicates import dhash, HASH_DTYPE, hamming, HashIndex, phash
+import logging
+import numpy as np
+from nose.tools import assert_equal, assert_true
+from os import mkdir
+from os.path import dirname, getsize, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+
+class TestDuplicates():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_hashes(self):
+        im = Image.open(join(self.data_dir, 'cat_drawer.jpg'))
+        small = im.resize((300, 211))
+        for f in (dhash, phash):
+            assert_true(0 <= f(im) < 2 ** 64)
+            assert_true(bin(f(im) ^ f(small)).count('1') <= 4)
+        hashes = np.array([0, 1, 3, 2 ** 64 - 1], dtype=np.uint64)
+        assert_equal(list(hamming(hashes, 1)), [1, 0, 1, 63])
+
+    def test_index(self):
+        collection = join(self.scratch_dir, 'collection')
+        mkdir(collection)
+        for fn in ['cat_drawer.jpg', 'morning-alley-2010.jpg']:
+            accession(
+                join(self.data_dir, fn), collection, external_tools=False)
+        index_dir = join(self.scratch_dir, 'index')
+        index = HashIndex(index_dir)
+        assert_equal(index.update(collection), 2)
+        assert_equal(index.update(collection), 0)
+        # a smaller, more compressed copy under another name is found
+        im = Image.open(join(self.data_dir, 'cat_drawer.jpg'))
+        copy = join(self.scratch_dir, 'copy.jpg')
+        im.resize((400, 282)).save(copy, quality=50)
+        matches = HashIndex(index_dir).find(copy)
+        assert_equal(len(matches), 1)
+        assert_equal(matches[0][0], join(collection, 'cat_drawer'))
+        assert_equal(
+            HashIndex(index_dir).find(join(self.data_dir, 'cat_drawer.tif'))
+            [0][0], join(collection, 'cat_drawer'))
+        # an interrupted add leaves a record without a name, which is dropped
+        with open(index.hashes_path, 'ab') as f:
+            f.write(np.zeros(1, dtype=HASH_DTYPE).tobytes())
+        index = HashIndex(index_dir)
+        assert_equal(len(index), 2)
+        assert_equal(getsize(index.hashes_path), 2 * HASH_DTYPE.itemsize)
+
+    def test_index_large(self):
+        # package images over Pillow's pixel limit are indexed too
+        collection = join(self.scratch_dir, 'collection')
+        mkdir(collection)
+        accession(
+            join(self.data_dir, 'cat_drawer_adobe.tif'), collection,
+            external_tools=False)
+        index = HashIndex(join(self.scratch_dir, 'index'))
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            assert_equal(index.update(collection), 1)
+            assert_equal(index.update(collection), 0)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        assert_equal(
+            index.find(join(self.data_dir, 'cat_drawer.tif'))[0][0],
+            join(collection, 'cat_drawer_adobe'))
@@ -0,0 +1,171 @@
+from importlib.util import module_from_spec, spec_from_file_location
+from isaw.awib.gazetteer import ResponseCache
+from isaw.awib.metadata import make_metadata, read_metadata, write_metadata
+import json
+import logging
+from nose.tools import assert_equal, assert_in, assert_is_none
+import os
+from os import mkdir
+from os.path import dirname, join, realpath
+from shutil import rmtree
+import subprocess
+import sys
+
+TESTS_DIR = dirname(realpath(__file__))
+SCRIPT = join(dirname(TESTS_DIR), 'scripts', 'editmeta.py')
+PLACE = 'https://pleiades.stoa.org/places/579885'
+PLACE_JSON = {
+    'title': 'Athenae',
+    'placeTypes': ['settlement'],
+    'names': [{
+        'language': 'en',
+        'attested': 'Athens',
+        'romanized': 'Athens',
+        'attestations': [{'timePeriod': 'modern'}]}]}
+
+
+def load_editmeta():
+    spec = spec_from_file_location('editmeta', SCRIPT)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestEditmeta():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(TESTS_DIR, 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+        self.packages = []
+        for i in range(2):
+            path = join(self.scratch_dir, 'package{}'.format(i))
+            mkdir(path)
+            meta = make_metadata(
+                join(self.data_dir, 'metadata', 'original_exiftool.xml'),
+                iptc_name='isawi-{}'.format(i))
+            write_metadata(meta, join(path, 'metadata.xml'))
+            self.packages.append(path)
+        self.registry = join(self.scratch_dir, 'registry.csv')
+        with open(self.registry, 'w', encoding='utf-8') as f:
+            f.write('id,first_name,last_name,orcid\njd,Jane,Doe,\n')
+        self.editmeta = load_editmeta()
+        self.editmeta.INTERACTIVE = False
+        self.editmeta.populate_registry(self.registry)
+
+    def tearDown(self):
+        self.editmeta.CLIENT.close()
+        rmtree(self.scratch_dir)
+
+    def meta_path(self, i):
+        return realpath(join(self.packages[i], 'metadata.xml'))
+
+    def changes(self, i):
+        meta = read_metadata(self.meta_path(i))
+        return meta.xpath('//change-history/change/description/text()')
+
+    def write_batch(self, fn, rows):
+        path = join(self.scratch_dir, fn)
+        with open(path, 'w', encoding='utf-8') as f:
+            if fn.endswith('.csv'):
+                f.write('package,title,photographer\n')
+                for row in rows:
+                    f.write('{package},{title},{photographer}\n'.format(**row))
+            else:
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+        return path
+
+    def test_read_batch(self):
+        path = self.write_batch('batch.csv', [
+            {'package': 'package0', 'title': 'Cat', 'photographer': ''},
+            {'package': 'package1', 'title': '', 'photographer': 'x'}])
+        assert_equal(self.editmeta.read_batch(path), [
+            (self.meta_path(0), {'title': 'Cat'}),
+            (self.meta_path(1), {'photographer': 'x'})])
+        path = self.write_batch('batch.jsonl', [
+            {'meta_file': 'package0/metadata.xml', 'width': 640},
+            {'meta_file': 'package1', 'title': None}])
+        assert_equal(self.editmeta.read_batch(path), [
+            (self.meta_path(0), {'width': '640'}),
+            (self.meta_path(1), {})])
+
+    def test_edit_package(self):
+        path, modified, error = self.editmeta.edit_package(
+            (self.meta_path(0),
+             {'title': ' Cat  Drawer ', 'photographer': 'registry:jd',
+              'copyright_holder': 'copy:photographer'}))
+        assert_is_none(error)
+        assert_equal(len(modified), 3)
+        isaw = read_metadata(self.meta_path(0)).xpath(
+            "//info[@type='isaw']")[0]
+        assert_equal(isaw.findtext('title'), 'Cat Drawer')
+        for tag in ['photographer', 'copyright-holder']:
+            assert_equal(isaw.xpath('{}/last-name/text()'.format(tag)),
+                         ['Doe'])
+        assert_equal(len(self.changes(0)), 2)
+        # nothing to change, so no change record
+        path, modified, error = self.editmeta.edit_package(
+            (self.meta_path(1), {}))
+        assert_equal((modified, error), ([], None))
+        assert_equal(len(self.changes(1)), 1)
+
+    def test_edit_package_fails(self):
+        # an unknown registry id, an unresolvable place or a bad date fail
+        # the package and leave its metadata untouched
+        self.editmeta.CLIENT.offline = True
+        with open(self.meta_path(0), 'rb') as f:
+            original = f.read()
+        for assignments in [
+                {'title': 'Cat', 'photographer': 'registry:nobody'},
+                {'title': 'Cat', 'photographed_place': PLACE},
+                {'title': 'Cat', 'photographed_place': '=gpsgeonames'},
+                {'title': 'Cat', 'date_photographed': 'never'}]:
+            path, modified, error = self.editmeta.edit_package(
+                (self.meta_path(0), assignments))
+            assert_equal(modified, [])
+            assert_in('EditBailout', error)
+            with open(self.meta_path(0), 'rb') as f:
+                assert_equal(f.read(), original)
+
+    def run(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = dirname(TESTS_DIR)
+        return subprocess.run(
+            [sys.executable, SCRIPT] + list(args), env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+
+    def test_batch_script(self):
+        cache_path = join(self.scratch_dir, 'gazetteer.db')
+        cache = ResponseCache(cache_path)
+        cache.put('{}/json'.format(PLACE), json.dumps(PLACE_JSON))
+        cache.close()
+        path = self.write_batch('batch.jsonl', [
+            {'package': 'package0', 'photographer': 'registry:jd',
+             'photographed_place': PLACE},
+            {'package': 'package1', 'photographer': 'registry:jd',
+             'photographed_place': 'https://pleiades.stoa.org/places/1'}])
+        result = self.run(
+            '-o', '-gc', cache_path, '-r', self.registry, '-j', '2',
+            '-b', path)
+        assert_equal(result.returncode, 1)
+        assert_in('modified: {} (2 fields)'.format(self.meta_path(0)),
+                  result.stdout)
+        assert_in('FAILED: {}'.format(self.meta_path(1)), result.stdout)
+        meta = read_metadata(self.meta_path(0))
+        isaw = meta.xpath("//info[@type='isaw']")[0]
+        assert_equal(isaw.findtext('photographer/first-name'), 'Jane')
+        assert_equal(
+            isaw.findtext('geography/photographed-place/city_name'), 'Athens')
+        assert_equal(len(self.changes(1)), 1)
+        # the registry is not a metadata file
+        result = self.run('-o', '-b', path, self.registry)
+        assert_equal(result.returncode, 1)
+        assert_in('use --registry', result.stdout)
+        assert_equal(len(self.changes(0)), 2)
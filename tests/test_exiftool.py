@@ -0,0 +1,123 @@
+from isaw.awib.exiftool import ExifTool, ExifToolError, ExifToolPool
+import json
+import logging
+from nose.tools import assert_equal, assert_raises
+import threading
+from os import mkdir
+from os.path import dirname, join, realpath
+from shutil import copy, rmtree
+
+FAKE_EXIFTOOL = join(dirname(realpath(__file__)), 'fake_exiftool.py')
+
+
+class TestExifTool():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def make_copies(self, count):
+        paths = []
+        for i in range(count):
+            paths.append(join(self.scratch_dir, 'master{}.tif'.format(i)))
+            copy(join(self.data_dir, 'cat_drawer.tif'), paths[-1])
+        return paths
+
+    def test_execute(self):
+        paths = self.make_copies(3)
+        with ExifTool(FAKE_EXIFTOOL) as exiftool:
+            for i, path in enumerate(paths):
+                exiftool.execute(
+                    '-q', '-overwrite_original',
+                    '-DigitalImageGUID=urn:uuid:{}'.format(i), path)
+            output = exiftool.execute('-X', paths[1])
+            assert_equal(
+                output.decode('utf-8').splitlines()[4],
+                ' <XMP:DigitalImageGUID>urn:uuid:1</XMP:DigitalImageGUID>')
+            with assert_raises(ExifToolError):
+                exiftool.execute('-X', join(self.scratch_dir, 'missing.tif'))
+            with assert_raises(ValueError):
+                exiftool.execute('-Title=two\nlines', paths[0])
+            # the session survives errors
+            assert_equal(exiftool.execute('-q', paths[0]), b'')
+        for i, path in enumerate(paths):
+            with open(path + '.tags.json') as f:
+                assert_equal(
+                    json.load(f),
+                    {'DigitalImageGUID': 'urn:uuid:{}'.format(i)})
+        with assert_raises(ExifToolError):
+            exiftool.execute('-ver')
+        with assert_raises(ExifToolError):
+            ExifTool(join(self.scratch_dir, 'no-such-exiftool'))
+
+    def test_parsed(self):
+        src, dest = self.make_copies(2)
+        with ExifTool(FAKE_EXIFTOOL) as exiftool:
+            exiftool.write_tags(src, Title='Cat & drawer', Rating='3')
+            exiftool.copy_tags(src, dest)
+            report = exiftool.extract(dest)
+            assert_equal(
+                report.findtext(
+                    './/{http://ns.exiftool.ca/File/System/1.0/}FileName'),
+                'master1.tif')
+            assert_equal(
+                report.findtext(
+                    './/{http://ns.exiftool.ca/XMP/XMP/1.0/}Title'),
+                'Cat & drawer')
+            assert_equal(
+                exiftool.read_tags(src, dest),
+                [{'SourceFile': p, 'Title': 'Cat & drawer', 'Rating': '3'}
+                    for p in (src, dest)])
+
+    def test_pool(self):
+        paths = self.make_copies(8)
+        with ExifToolPool(3, FAKE_EXIFTOOL) as pool:
+            pids = set([e.process.pid for e in list(pool.idle.queue)])
+            assert_equal(len(pids), 3)
+            pool.map(
+                lambda exiftool, path, i: exiftool.write_tags(
+                    path, DigitalImageGUID='urn:uuid:{}'.format(i)),
+                paths, range(len(paths)))
+            reports = pool.map(ExifTool.extract, paths)
+            for i, report in enumerate(reports):
+                assert_equal(
+                    report.findtext(
+                        './/{http://ns.exiftool.ca/XMP/XMP/1.0/}'
+                        'DigitalImageGUID'),
+                    'urn:uuid:{}'.format(i))
+            # threads share the processes
+            results = []
+            threads = [
+                threading.Thread(
+                    target=lambda p: results.append(pool.read_tags(p)),
+                    args=(p,))
+                for p in paths]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert_equal(
+                sorted([r[0]['SourceFile'] for r in results]), sorted(paths))
+            # a process that stops is replaced
+            worker = pool.idle.queue[0]
+            worker.process.kill()
+            worker.process.wait()
+            with assert_raises(ExifToolError):
+                pool.execute('-ver')
+            assert_equal(
+                [e.process.poll() for e in list(pool.idle.queue)],
+                [None, None, None])
+            assert_equal(pool.read_tags(paths[0])[0]['SourceFile'], paths[0])
+            with assert_raises(ExifToolError):
+                pool.execute('-X', join(self.scratch_dir, 'missing.tif'))
+        with assert_raises(ExifToolError):
+            pool.execute('-ver')
@@ -0,0 +1,156 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from isaw.awib.gazetteer import (GazetteerClient, GazetteerError,
+                                 ResponseCache)
+import json
+import logging
+from nose.tools import assert_equal, assert_is_none, assert_raises
+from os import mkdir
+from os.path import dirname, join, realpath
+from shutil import rmtree
+from threading import Thread
+import time
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        server.ports.add(self.client_address[1])
+        if self.path.startswith('/flaky'):
+            server.flaky += 1
+            if server.flaky < 3:
+                return self.reply(503, {})
+        elif self.path.startswith('/slow'):
+            time.sleep(1)
+        elif self.path.startswith('/missing'):
+            return self.reply(404, {})
+        self.reply(200, {'path': self.path})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting (see test_timeout)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestGazetteer():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.ports = set()
+        self.server.flaky = 0
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.client = GazetteerClient(
+            'tester', timeout=0.5, backoff=0.01, geonames_api=self.base)
+        self.scratch_dir = join(dirname(realpath(__file__)), 'data', 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        rmtree(self.scratch_dir)
+
+    def test_get_json(self):
+        for i in range(5):
+            j = self.client.get_json('{}/places/{}/json'.format(self.base, i))
+            assert_equal(j, {'path': '/places/{}/json'.format(i)})
+        # one connection, kept alive
+        assert_equal(len(self.server.ports), 1)
+        assert_is_none(self.client.get_json('{}/missing'.format(self.base)))
+
+    def test_retry(self):
+        j = self.client.get_json('{}/flaky'.format(self.base))
+        assert_equal(j, {'path': '/flaky'})
+        assert_equal(self.server.requests, ['/flaky'] * 3)
+
+    def test_timeout(self):
+        client = GazetteerClient(timeout=0.2, retries=0)
+        with assert_raises(GazetteerError):
+            client.get_json('{}/slow'.format(self.base))
+        client.close()
+
+    def test_geonames_urls(self):
+        assert_equal(
+            self.client.json_url('http://www.geonames.org/3169070/roma.html'),
+            '{}/getJSON?geonameId=3169070&username=tester&style=full'
+            ''.format(self.base))
+        assert_equal(
+            self.client.json_url('https://pleiades.stoa.org/places/423025'),
+            'https://pleiades.stoa.org/places/423025/json')
+        assert_equal(
+            self.client.safe_url(self.client.geonames_nearby_url(41.9, 12.5)),
+            '{}/findNearbyJSON?lat=41.900&lng=12.500&style=full'
+            ''.format(self.base))
+
+    def test_resolve_many(self):
+        urls = [
+            'http://sws.geonames.org/{}/'.format(geoid)
+            for geoid in range(100, 120)]
+        results = self.client.resolve_many(urls + urls[:5])
+        assert_equal(sorted(results.keys()), sorted(urls))
+        for url, j in results.items():
+            geoid = url.split('/')[-2]
+            assert_equal(
+                j['path'],
+                '/getJSON?geonameId={}&username=tester&style=full'
+                ''.format(geoid))
+        assert_equal(len(self.server.requests), 20)
+        results = self.client.resolve_many(['http://example.com/nowhere'])
+        assert_is_none(results['http://example.com/nowhere'])
+
+    def test_cache(self):
+        cache_path = join(self.scratch_dir, 'gazetteer.db')
+        urls = ['{}/places/{}/json'.format(self.base, i) for i in range(3)]
+        with GazetteerClient(cache=ResponseCache(cache_path)) as client:
+            for url in urls:
+                client.get_json(url)
+        assert_equal(len(self.server.requests), 3)
+        # a new client, as in a later session, answers from the cache
+        with GazetteerClient(cache=ResponseCache(cache_path)) as client:
+            for url in urls:
+                assert_equal(
+                    client.get_json(url), {'path': url[len(self.base):]})
+            assert_equal(len(self.server.requests), 3)
+        # stale entries are fetched again, except in offline mode
+        cache = ResponseCache(cache_path, ttl=0)
+        with GazetteerClient(cache=cache, offline=True) as client:
+            client.get_json(urls[0])
+            with assert_raises(GazetteerError):
+                client.get_json('{}/places/9/json'.format(self.base))
+        assert_equal(len(self.server.requests), 3)
+        cache = ResponseCache(cache_path, ttl=0, max_entries=2)
+        with GazetteerClient(cache=cache) as client:
+            client.get_json(urls[0])
+            assert_equal(len(self.server.requests), 4)
+            assert_equal(len(cache), 2)
+
+    def test_nearby_cache(self):
+        client = GazetteerClient(
+            'tester', geonames_api=self.base, latlon_precision=2)
+        client.get_json(client.geonames_nearby_url(41.9021, 12.4531))
+        client.get_json(client.geonames_nearby_url(41.8989, 12.4549))
+        assert_equal(
+            self.server.requests,
+            ['/findNearbyJSON?lat=41.90&lng=12.45&username=tester&style=full'])
+        client.close()
@@ -0,0 +1,96 @@
+from isaw.awib.accession import get_agent
+from isaw.awib.exiftool import ExifTool
+from isaw.awib.guid import assign_guid, make_guid, package_guid
+from isaw.awib.metadata import make_metadata, read_metadata, write_metadata
+import json
+import logging
+from nose.tools import assert_equal, assert_true
+import os
+from os import mkdir
+from os.path import dirname, join, realpath
+from shutil import copy, rmtree
+import subprocess
+import sys
+
+TESTS_DIR = dirname(realpath(__file__))
+FAKE_EXIFTOOL = join(TESTS_DIR, 'fake_exiftool.py')
+
+
+class TestGuid():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(TESTS_DIR, 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+        self.packages = []
+        for i in range(3):
+            path = join(self.scratch_dir, 'package{}'.format(i))
+            mkdir(path)
+            copy(
+                join(self.data_dir, 'cat_drawer.tif'),
+                join(path, 'master.tif'))
+            meta = make_metadata(
+                join(self.data_dir, 'metadata', 'original_exiftool.xml'),
+                iptc_name='isawi-{}'.format(i))
+            write_metadata(meta, join(path, 'metadata.xml'))
+            self.packages.append(path)
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def assert_assigned(self, path, guid, agent):
+        meta = read_metadata(join(path, 'metadata.xml'))
+        assert_equal(meta.findtext('guid'), guid.urn)
+        assert_equal(
+            meta.findtext('change-history/change/agent'), agent)
+        with open(join(path, 'master.tif.tags.json')) as f:
+            assert_equal(json.load(f), {'DigitalImageGUID': guid.urn})
+
+    def test_make_guid(self):
+        assert_equal(
+            str(make_guid('isawi-0')),
+            str(make_guid('isawi-0', 'images.isaw.nyu.edu')))
+        assert_true(make_guid('isawi-0') != make_guid('isawi-1'))
+        assert_equal(
+            package_guid(self.packages[0]), make_guid('isawi-0'))
+        assert_equal(
+            package_guid(self.packages[0], 'Cat Drawer'),
+            make_guid('cat-drawer'))
+
+    def test_assign_guid(self):
+        guids = []
+        with ExifTool(FAKE_EXIFTOOL) as exiftool:
+            for path in self.packages[:2]:
+                guids.append(assign_guid(path, exiftool, agent='Jane'))
+            assert_equal(exiftool.count, 2)
+        assert_true(guids[0] != guids[1])
+        for i, path in enumerate(self.packages[:2]):
+            assert_equal(guids[i], make_guid('isawi-{}'.format(i)))
+            self.assert_assigned(path, guids[i], 'Jane')
+
+    def test_make_guid_script(self):
+        # the script finds the stand-in as 'exiftool' on its PATH
+        bin_dir = join(self.scratch_dir, 'bin')
+        mkdir(bin_dir)
+        os.symlink(FAKE_EXIFTOOL, join(bin_dir, 'exiftool'))
+        list_path = join(self.scratch_dir, 'packages.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write('# packages\n{}\n\n{}\n'.format(*self.packages[1:]))
+        env = dict(os.environ)
+        env['PATH'] = os.pathsep.join([bin_dir, env.get('PATH', '')])
+        env['PYTHONPATH'] = dirname(TESTS_DIR)
+        result = subprocess.run(
+            [sys.executable, join(dirname(TESTS_DIR), 'scripts',
+                                  'make_guid.py'),
+                '-a', '-f', list_path, self.packages[0]],
+            env=env, stdout=subprocess.PIPE, check=True)
+        guids = [make_guid('isawi-{}'.format(i)) for i in range(3)]
+        assert_equal(
+            result.stdout.decode('utf-8').split(), [g.urn for g in guids])
+        for path, guid in zip(self.packages, guids):
+            self.assert_assigned(path, guid, get_agent())
@@ -0,0 +1,97 @@
+from isaw.awib.accession import accession
+from isaw.awib.checksums import write_sidecar
+from isaw.awib.index import PackageIndex
+import logging
+from nose.tools import assert_equal, assert_is_none, assert_raises
+from os import mkdir
+from os.path import dirname, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+METADATA = """<?xml version="1.0" encoding="UTF-8"?>
+<image-info>
+    <iptc_name>{}</iptc_name>
+    <guid>urn:uuid:{}</guid>
+    <status>{}</status>
+</image-info>
+"""
+
+
+class TestIndex():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+        self.collection = join(self.scratch_dir, 'collection')
+        mkdir(self.collection)
+        self.packages = []
+        for i, fn in enumerate(['cat_drawer.jpg', 'cat_drawer_adobe.tif']):
+            package = accession(
+                join(self.data_dir, fn), self.collection,
+                external_tools=False)
+            self.write_metadata(package.path, i, 'draft')
+            self.packages.append(package.path)
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def write_metadata(self, path, i, status):
+        meta_path = join(path, 'metadata.xml')
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            f.write(METADATA.format('isawi-{}'.format(i), i, status))
+        write_sidecar(meta_path)
+
+    def test_large_master(self):
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            with PackageIndex(join(self.scratch_dir, 'index.db')) as index:
+                assert_equal(index.update(self.collection)['added'], 2)
+                record = index.get(self.packages[1])
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        assert_equal(record['iptc_name'], 'isawi-1')
+        assert_equal((record['width'], record['height']), (1024, 721))
+        assert_equal(record['profile'], 'ProPhoto')
+
+    def test_index(self):
+        db = join(self.scratch_dir, 'index.db')
+        with PackageIndex(db) as index:
+            counts = index.update(self.collection)
+            assert_equal(counts['added'], 2)
+            assert_equal(len(index), 2)
+            record = index.find(guid='urn:uuid:1')[0]
+            assert_equal(record['path'], self.packages[1])
+            assert_equal(record['iptc_name'], 'isawi-1')
+            assert_equal((record['width'], record['height']), (1024, 721))
+            assert_equal(record['profile'], 'ProPhoto')
+            assert_equal(
+                sorted(record['checksums']),
+                ['master', 'metadata', 'original'])
+            assert_equal(
+                index.find_checksum(record['checksums']['original']),
+                [record])
+            assert_equal(len(index.find(status='draft')), 2)
+            with assert_raises(ValueError):
+                index.find(nonsense='draft')
+        # only the changed package is read again, in a later session
+        self.write_metadata(self.packages[0], 0, 'published')
+        with PackageIndex(db) as index:
+            counts = index.update(self.collection)
+            assert_equal(
+                counts,
+                {'added': 0, 'updated': 1, 'removed': 0, 'unchanged': 1})
+            assert_equal(
+                [r['path'] for r in index.find(status='draft')],
+                [self.packages[1]])
+            rmtree(self.packages[1])
+            assert_equal(index.update(self.collection)['removed'], 1)
+            assert_is_none(index.get(self.packages[1]))
+            assert_equal(len(index.find_checksum(
+                record['checksums']['original'])), 0)
@@ -0,0 +1,87 @@
+from nose.tools import assert_equal, assert_in, assert_true
+import os
+from os import listdir, mkdir
+from os.path import dirname, join, realpath
+from shutil import copy, rmtree
+import subprocess
+import sys
+
+TESTS_DIR = dirname(realpath(__file__))
+SCRIPT = join(dirname(TESTS_DIR), 'scripts', 'make_master.py')
+
+
+class TestMakeMaster():
+
+    def setUp(self):
+        self.data_dir = join(TESTS_DIR, 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+        self.src = join(self.scratch_dir, 'originals')
+        mkdir(self.src)
+        for fn in ['cat_drawer.jpg', 'cat_drawer.tif', 'cat_drawer_adobe.tif',
+                   'cat_drawer_posterized.png', 'morning-alley-2010.jpg']:
+            copy(join(self.data_dir, fn), self.src)
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def run(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = dirname(TESTS_DIR)
+        return subprocess.run(
+            [sys.executable, SCRIPT] + list(args), env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+
+    def converted(self, result):
+        # the originals reported as converted
+        return sorted([
+            line[len('OK: '):].split(' -> ')[0]
+            for line in result.stdout.splitlines() if line.startswith('OK: ')])
+
+    def test_jobs(self):
+        with open(join(self.src, 'broken.jpg'), 'w') as f:
+            f.write('not an image')
+        expected = [
+            'cat_drawer.tif', 'cat_drawer_adobe.tif',
+            'cat_drawer_posterized.tif', 'morning-alley-2010.tif']
+        for jobs in ['1', '2']:
+            dest = join(self.scratch_dir, 'masters{}'.format(jobs))
+            mkdir(dest)
+            result = self.run('-j', jobs, self.src, dest)
+            assert_equal(result.returncode, 1)
+            assert_equal(sorted(listdir(dest)), expected)
+            assert_equal(self.converted(result), sorted([
+                join(self.src, fn) for fn in [
+                    'cat_drawer.jpg', 'cat_drawer_adobe.tif',
+                    'cat_drawer_posterized.png', 'morning-alley-2010.jpg']]))
+            errors = result.stderr.splitlines()
+            assert_in(
+                'ERROR: {}: skipped because another original has the same '
+                'name'.format(join(self.src, 'cat_drawer.tif')),
+                errors)
+            assert_true(any([
+                line.startswith('ERROR: {}: '.format(
+                    join(self.src, 'broken.jpg')))
+                for line in errors]))
+            assert_equal(
+                errors[-1], 'ERROR: 2 of 6 files could not be converted')
+
+    def test_success(self):
+        os.remove(join(self.src, 'cat_drawer.tif'))
+        dest = join(self.scratch_dir, 'masters')
+        mkdir(dest)
+        result = self.run('-q', '-j', '2', self.src, dest)
+        assert_equal(result.returncode, 0)
+        assert_equal(self.converted(result), [])
+        assert_equal(len(listdir(dest)), 4)
+        # existing masters are not overwritten without -x
+        result = self.run('-q', self.src, dest)
+        assert_equal(result.returncode, 1)
+        assert_equal(
+            result.stderr.splitlines()[-1],
+            'ERROR: 4 of 4 files could not be converted')
+        assert_equal(self.run('-q', '-x', self.src, dest).returncode, 0)
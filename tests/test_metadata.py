@@ -0,0 +1,126 @@
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from isaw.awib.metadata import (make_metadata, read_metadata, set_value,
+                                update_metadata, write_metadata)
+import logging
+from lxml import etree
+from nose.tools import assert_equal, assert_true
+from os import mkdir
+from os.path import dirname, join, realpath
+from shutil import rmtree
+
+NOW = datetime(
+    2017, 3, 1, 12, 34, 56, 789000, tzinfo=timezone(timedelta(hours=-5)))
+# The files in data/metadata/xslt are the output of the stylesheets that
+# isaw.awib.metadata replaces, each named after its stylesheet and made with
+# saxon (SaxonC-HE) from the files in data/metadata:
+#   exiftool2meta.xml: scripts/exiftool2meta.xsl on original_exiftool.xml,
+#     with agent="Jane Archivist" iptc_name=isawi-201703011234
+#     jhove_file=original_jhove.xml
+#   update_metadata.xml: scripts/update_metadata.xsl on old_metadata.xml,
+#     with operator="Jane Archivist"
+#   setmetaval.xml: scripts/setmetaval.xsl on xslt/exiftool2meta.xml, with
+#     agent="Jane Archivist" target=width value=1234
+
+
+class TestMetadata():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data', 'metadata')
+        self.scratch_dir = join(
+            dirname(realpath(__file__)), 'data', 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def serialize(self, meta):
+        return etree.tostring(
+            meta, pretty_print=True, xml_declaration=True,
+            encoding='UTF-8').decode('utf-8')
+
+    def comparable(self, meta, new):
+        # meta serialized without the dates and descriptions of its new
+        # newest changes, which say when and with what they were made
+        meta = deepcopy(meta)
+        for change in meta.findall('change-history/change')[:new]:
+            change.find('date').text = None
+            change.find('description').text = None
+        return self.serialize(meta)
+
+    def assert_like_xslt(self, meta, fn, description, new=1):
+        xslt = read_metadata(join(self.data_dir, 'xslt', fn))
+        assert_equal(self.comparable(meta, new), self.comparable(xslt, new))
+        change = meta.find('change-history/change')
+        assert_equal(change.findtext('date'), NOW.isoformat())
+        assert_equal(change.findtext('description'), description)
+
+    def make_metadata(self, **kwargs):
+        return make_metadata(
+            join(self.data_dir, 'original_exiftool.xml'),
+            join(self.data_dir, 'original_jhove.xml'),
+            agent='Jane Archivist', iptc_name='isawi-201703011234', now=NOW,
+            **kwargs)
+
+    def test_make_metadata(self):
+        self.assert_like_xslt(
+            self.make_metadata(), 'exiftool2meta.xml',
+            'Metadata file created from embedded metadata extracted from '
+            'original.jpg using isaw.awib.metadata.')
+
+    def test_make_metadata_href(self):
+        # the stylesheet always wrote original.jpg, whatever the original
+        xslt = read_metadata(join(self.data_dir, 'xslt', 'exiftool2meta.xml'))
+        assert_equal(
+            xslt.find("image-files/image[@type='original']").get('href'),
+            'original.jpg')
+        meta = self.make_metadata(original_fn='original.tif')
+        assert_equal(
+            meta.find("image-files/image[@type='original']").get('href'),
+            'original.tif')
+
+    def test_make_metadata_name(self):
+        meta = make_metadata(
+            join(self.data_dir, 'original_exiftool.xml'), now=NOW)
+        assert_equal(
+            meta.findtext('iptc_name'), 'isawi-201703011234567890')
+        assert_equal(meta.findall("info[@type='original']/jhove-format"), [])
+
+    def test_make_metadata_missing_jhove(self):
+        meta = make_metadata(
+            join(self.data_dir, 'original_exiftool.xml'),
+            join(self.data_dir, 'missing_jhove.xml'), now=NOW)
+        assert_equal(meta.findtext("info[@type='original']/width"), '4032')
+
+    def test_update_metadata(self):
+        meta = update_metadata(
+            read_metadata(join(self.data_dir, 'old_metadata.xml')),
+            'Jane Archivist', NOW)
+        self.assert_like_xslt(
+            meta, 'update_metadata.xml',
+            'This metadata file was updated using isaw.awib.metadata.')
+
+    def test_set_value(self):
+        meta = set_value(
+            self.make_metadata(), 'width', '1234', 'Jane Archivist', NOW)
+        assert_equal(meta.findtext("info[@type='isaw']/width"), '1234')
+        assert_equal(meta.findtext("info[@type='original']/width"), '4032')
+        # the stylesheet left out the closing quote after the value
+        self.assert_like_xslt(
+            meta, 'setmetaval.xml',
+            'Set value of "width" to "1234" using isaw.awib.metadata.', new=2)
+
+    def test_write_metadata(self):
+        meta = make_metadata(
+            join(self.data_dir, 'original_exiftool.xml'), now=NOW)
+        path = join(self.scratch_dir, 'metadata.xml')
+        write_metadata(meta, path)
+        with open(path, encoding='utf-8') as f:
+            assert_true(f.read().startswith('<?xml'))
+        assert_equal(
+            self.serialize(read_metadata(path)), self.serialize(meta))
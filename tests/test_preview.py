@@ -0,0 +1,64 @@
+from isaw.awib.conversions import get_profile
+from isaw.awib.preview import (load_reduced, open_reduced, preview,
+                               PREVIEW_PROFILE, reduction)
+import logging
+from nose.tools import assert_equal, assert_raises
+from os import listdir, mkdir
+from os.path import dirname, isfile, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+
+class TestPreview():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_reduction(self):
+        assert_equal(reduction((1024, 721), (128, 90)), 8)
+        assert_equal(reduction((1024, 721), (200, 141)), 4)
+        assert_equal(reduction((1024, 721), (1000, 700)), 1)
+
+    def test_reduced_decode(self):
+        jpeg = join(self.data_dir, 'cat_drawer.jpg')
+        for scale, size in [(1, (1024, 721)), (2, (512, 361)),
+                            (4, (256, 181)), (8, (128, 91))]:
+            assert_equal(load_reduced(jpeg, scale=scale).size, size)
+        assert_equal(load_reduced(jpeg, (200, 141)).size, (256, 181))
+        # JPEG 2000 is reduced by resolution level; a file with only two
+        # decodes at the smallest it has when asked for more
+        jpf = join(self.data_dir, 'cat_drawer.jpf')
+        assert_equal(load_reduced(jpf, scale=4).size, (256, 181))
+        assert_equal(load_reduced(jpf, scale=8).size, (128, 91))
+        im = Image.open(jpeg)
+        jp2 = join(self.scratch_dir, 'cat_drawer.jp2')
+        im.save(jp2, 'JPEG2000', num_resolutions=2)
+        assert_equal(load_reduced(jp2, scale=8).size, (512, 361))
+        # other formats are decoded at full size
+        png = join(self.data_dir, 'cat_drawer.png')
+        assert_equal(load_reduced(png, scale=8).size, (1024, 721))
+        with assert_raises(ValueError):
+            open_reduced(jpeg, scale=3)
+
+    def test_preview(self):
+        srgb = get_profile(PREVIEW_PROFILE).tobytes()
+        for fn in sorted(listdir(self.data_dir)):
+            path = join(self.data_dir, fn)
+            if not isfile(path):
+                continue
+            im = preview(path, 200)
+            assert_equal(im.mode, 'RGB')
+            assert_equal(max(im.size), 200)
+            assert_equal(im.info['icc_profile'], srgb)
+        im = preview(join(self.data_dir, 'cat_drawer.jpg'), None, scale=2)
+        assert_equal(im.size, (512, 361))
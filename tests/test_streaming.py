@@ -0,0 +1,152 @@
+from isaw.awib.streaming import (band_height, compression_available,
+                                 iter_bands, needs_bigtiff, open_level,
+                                 pyramid_sizes, TiffWriter)
+import logging
+from nose.tools import assert_equal, assert_raises, assert_true
+from os import mkdir
+from os.path import dirname, isfile, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+
+class TestStreaming():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_iter_bands(self):
+        im = Image.open(join(self.data_dir, 'cat_drawer.jpg'))
+        bands = list(iter_bands(im, band_size=100000))
+        assert_equal(len(bands), 31)
+        assert_equal(sum([b.size[1] for b in bands]), im.size[1])
+        for band in bands:
+            assert_equal(band.size[0], im.size[0])
+
+    def test_iter_bands_mapped(self):
+        path = join(self.data_dir, 'cat_drawer_adobe.tif')
+        im = Image.open(path)
+        bands = list(iter_bands(im, band_size=100000))
+        assert_true(im.im is None)
+        assert_equal(len(bands), 31)
+        expected = Image.open(path)
+        for i, band in enumerate(bands):
+            y = i * band_height(im, 100000)
+            assert_equal(
+                band.tobytes(),
+                expected.crop(
+                    (0, y, im.size[0], y + band.size[1])).tobytes())
+        im.close()
+        expected.close()
+
+    def test_round_trip(self):
+        im = Image.open(join(self.data_dir, 'cat_drawer.tif'))
+        im.load()
+        path = join(self.scratch_dir, 'strips.tif')
+        writer = TiffWriter(
+            path, im.size, icc_profile=im.info['icc_profile'], dpi=(300, 300))
+        with writer:
+            for band in iter_bands(im, band_size=150000):
+                writer.write(band)
+        assert_true(len(writer.offsets) > 1)
+        im_out = Image.open(path)
+        assert_equal(im_out.info['icc_profile'], im.info['icc_profile'])
+        assert_equal(im_out.info['dpi'], (300, 300))
+        # read the multi-strip output back band by band from disk
+        bands = list(iter_bands(im_out, band_size=200000))
+        assert_true(im_out.im is None)
+        result = Image.new('RGB', im.size)
+        y = 0
+        for band in bands:
+            result.paste(band, (0, y))
+            y += band.size[1]
+        assert_equal(result.tobytes(), im.tobytes())
+
+    def test_incomplete(self):
+        path = join(self.scratch_dir, 'incomplete.tif')
+        with assert_raises(ValueError):
+            with TiffWriter(path, (10, 10)) as writer:
+                writer.write(Image.new('RGB', (10, 5)))
+                raise ValueError('interrupted')
+        assert_true(not isfile(path))
+
+    def test_compression_and_tiles(self):
+        im = Image.open(join(self.data_dir, 'cat_drawer.tif'))
+        im.load()
+        path = join(self.scratch_dir, 'options.tif')
+        options = [
+            {'compression': 'lzw'},
+            {'compression': 'adobe_deflate', 'tile_size': 256},
+            {'compression': 'packbits', 'bigtiff': True},
+            {'tile_size': 128, 'bigtiff': True}]
+        for kwargs in options:
+            writer = TiffWriter(
+                path, im.size, icc_profile=im.info['icc_profile'], **kwargs)
+            with writer:
+                for band in iter_bands(im, band_size=150000):
+                    writer.write(band)
+            with open(path, 'rb') as f:
+                magic = f.read(4)
+            if kwargs.get('bigtiff'):
+                assert_equal(magic, b'II+\0')
+            else:
+                assert_equal(magic, b'II*\0')
+            im_out = Image.open(path)
+            if 'tile_size' in kwargs:
+                assert_equal(
+                    len(writer.offsets),
+                    -(-im.size[0] // kwargs['tile_size']) *
+                    -(-im.size[1] // kwargs['tile_size']))
+                assert_equal(
+                    im_out.tag_v2[322], kwargs['tile_size'])
+            assert_equal(im_out.tobytes(), im.tobytes())
+            assert_equal(im_out.info['icc_profile'], im.info['icc_profile'])
+            im_out.close()
+
+    def test_options(self):
+        path = join(self.scratch_dir, 'options.tif')
+        for kwargs in [{'compression': 'jpeg'}, {'tile_size': 100},
+                       {'predictor': 2}, {'compression': 'packbits',
+                                          'predictor': 2}]:
+            with assert_raises(ValueError):
+                TiffWriter(path, (10, 10), **kwargs)
+        assert_true(compression_available('lzw'))
+        assert_true(not needs_bigtiff((30000, 40000)))
+        assert_true(needs_bigtiff((40000, 40000)))
+
+    def test_pyramid(self):
+        im = Image.open(join(self.data_dir, 'cat_drawer.tif'))
+        im.load()
+        assert_equal(
+            pyramid_sizes(im.size), [(1024, 721), (512, 361), (256, 181)])
+        path = join(self.scratch_dir, 'pyramid.tif')
+        for kwargs in [{}, {'tile_size': 128, 'compression': 'lzw'}]:
+            writer = TiffWriter(
+                path, im.size, dpi=(300, 300), pyramid=True, **kwargs)
+            with writer:
+                # odd band heights exercise the rows held back for halving
+                for band in iter_bands(im, band_size=100001):
+                    writer.write(band)
+            im_out = Image.open(path)
+            assert_equal(im_out.n_frames, 3)
+            expected = im
+            for frame in range(3):
+                im_out.seek(frame)
+                if frame > 0:
+                    expected = expected.reduce(2)
+                assert_equal(im_out.size, expected.size)
+                assert_equal(im_out.tobytes(), expected.tobytes())
+            assert_equal(im_out.info['dpi'], (75, 75))
+            im_out.close()
+        assert_equal(open_level(path, (300, 200)).size, (512, 361))
+        assert_equal(open_level(path, (100, 100)).size, (256, 181))
+        assert_equal(open_level(path).size, (1024, 721))
@@ -0,0 +1,99 @@
+from isaw.awib.accession import accession
+from isaw.awib.checksums import write_sidecar
+from isaw.awib.validate import (ChecksumCache, EXPECTED_FILES, find_packages,
+                                validate_package, validate_packages)
+import logging
+from nose.tools import assert_equal, assert_in, assert_true
+from os import mkdir, remove
+from os.path import dirname, join, realpath
+from PIL import Image
+from shutil import rmtree
+
+
+class TestValidate():
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.data_dir = join(dirname(realpath(__file__)), 'data')
+        self.scratch_dir = join(self.data_dir, 'scratch')
+        try:
+            mkdir(self.scratch_dir)
+        except FileExistsError:
+            pass
+        self.collection = join(self.scratch_dir, 'collection')
+        mkdir(self.collection)
+        self.packages = []
+        for fn in ['cat_drawer.jpg', 'cat_drawer_posterized.gif']:
+            package = accession(
+                join(self.data_dir, fn), self.collection,
+                external_tools=False)
+            # stand-ins for the reports made by external tools
+            for xml_fn in [f for f in EXPECTED_FILES if f.endswith('.xml')]:
+                with open(package.join(xml_fn), 'w') as f:
+                    f.write('<report/>\n')
+                write_sidecar(package.join(xml_fn))
+            self.packages.append(package.path)
+
+    def tearDown(self):
+        rmtree(self.scratch_dir)
+
+    def test_valid(self):
+        assert_equal(find_packages(self.collection), self.packages)
+        for path in self.packages:
+            report = validate_package(path)
+            assert_equal(report['errors'], [])
+            assert_true(report['valid'])
+            assert_equal(report['hashed'], 7)
+
+    def test_large_images(self):
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            report = validate_package(self.packages[0])
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        assert_equal(report['errors'], [])
+        assert_true(report['valid'])
+
+    def test_invalid(self):
+        path = self.packages[0]
+        with open(join(path, 'metadata.xml'), 'a') as f:
+            f.write('tampered')
+        remove(join(path, 'master_jhove.xml'))
+        report = validate_package(path)
+        assert_true(not report['valid'])
+        assert_in('checksum verification on metadata.xml failed',
+                  report['errors'])
+        assert_in(
+            'master_jhove.xml must be a regular file in the package '
+            'directory',
+            report['errors'])
+        with open(join(path, 'master.tif'), 'w') as f:
+            f.write('not an image')
+        write_sidecar(join(path, 'master.tif'))
+        report = validate_package(path)
+        assert_in('master.tif is not an image file', report['errors'])
+
+    def test_parallel_with_cache(self):
+        cache_path = join(self.scratch_dir, 'cache.db')
+        with ChecksumCache(cache_path) as cache:
+            reports = list(validate_packages(self.packages, 2, cache))
+            assert_equal(len(reports), 2)
+            for report in reports:
+                assert_true(report['valid'])
+                assert_equal(report['cached'], 0)
+            reports = list(
+                validate_packages(self.packages, 2, cache, fast=True))
+            for report in reports:
+                assert_true(report['valid'])
+                assert_equal(report['hashed'], 0)
+                assert_equal(report['cached'], 7)
+        with open(join(self.packages[0], 'metadata.xml'), 'a') as f:
+            f.write('tampered')
+        with ChecksumCache(cache_path) as cache:
+            reports = list(
+                validate_packages(self.packages[:1], cache=cache, fast=True))
+        report = reports[0]
+        assert_true(not report['valid'])
+        assert_equal(report['hashed'], 1)